@@ -0,0 +1,112 @@
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+import contextlib
+import io
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+from import_to_db import DATA_DIR, clean_dataframe
+
+
+def legacy_clean_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    """The cell-by-cell implementation that clean_dataframe replaced, kept for comparison."""
+    def persian_to_english_numerals(text):
+        if not isinstance(text, str):
+            return str(text)
+        return text.translate(str.maketrans('۰۱۲۳۴۵۶۷۸۹', '0123456789'))
+
+    def extract_number_from_text(text):
+        if not isinstance(text, str):
+            return text
+        match = re.search(r'\d+\.?\d*', text)
+        if match:
+            return float(match.group(0))
+        return None
+
+    df = df.copy()
+    for col in df.columns:
+        df[col] = df[col].apply(persian_to_english_numerals)
+        if df[col].dtype == 'object':
+            df[col] = df[col].str.replace("سانتی متر", "", regex=False)
+            df[col] = df[col].str.replace("سانتی‌متر", "", regex=False)
+            df[col] = df[col].str.replace("سانتیمتر", "", regex=False)
+            df[col] = df[col].str.replace(",", "", regex=False)
+            df[col] = df[col].str.replace("لیتر", "", regex=False)
+            df[col] = df[col].str.replace("عدد", "", regex=False)
+            df[col] = df[col].str.strip()
+
+    for col in df.columns:
+        numeric_series = pd.to_numeric(df[col], errors='coerce')
+        numeric_ratio = numeric_series.notna().sum() / len(df)
+        if numeric_ratio > 0.7:
+            mask = numeric_series.isna() & df[col].notna()
+            df.loc[mask, col] = df.loc[mask, col].apply(extract_number_from_text)
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    if 'title' in df.columns:
+        df.dropna(subset=['title'], inplace=True)
+        df.drop_duplicates(subset=['title'], keep='first', inplace=True)
+    elif 'id' in df.columns:
+        df.dropna(subset=['id'], inplace=True)
+        df.drop_duplicates(subset=['id'], keep='first', inplace=True)
+    return df
+
+
+def time_call(func, df):
+    # The cleaners print one line per numeric column; keep the benchmark output readable.
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = func(df)
+        elapsed = time.perf_counter() - start
+    return result, elapsed
+
+
+def compare(label, df):
+    legacy_df, legacy_time = time_call(legacy_clean_dataframe, df)
+    new_df, new_time = time_call(clean_dataframe, df)
+    try:
+        pd.testing.assert_frame_equal(new_df, legacy_df)
+        same = "identical"
+    except AssertionError:
+        same = "DIFFERENT"
+    speedup = legacy_time / new_time if new_time else float('inf')
+    print(f"  {label:<45} rows={len(df):>9,}  legacy={legacy_time:8.3f}s  new={new_time:8.3f}s  "
+          f"speedup={speedup:5.1f}x  output={same}")
+    return legacy_time, new_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark clean_dataframe against the legacy implementation.")
+    parser.add_argument('--rows', type=int, default=1_000_000, help="Row count of the synthetic sheet.")
+    args = parser.parse_args()
+
+    excel_files = sorted(glob.glob(os.path.join(DATA_DIR, '*', '*.xlsx')))
+    if not excel_files:
+        print(f"Error: No Excel files found in '{DATA_DIR}'")
+        return
+
+    print("--- Real workbooks ---")
+    sheets = []
+    total_legacy = total_new = 0.0
+    for file_path in excel_files:
+        df = pd.read_excel(file_path, header=1)
+        sheets.append(df)
+        label = os.path.relpath(file_path, DATA_DIR)
+        legacy_time, new_time = compare(label, df)
+        total_legacy += legacy_time
+        total_new += new_time
+    print(f"  {'TOTAL':<45} legacy={total_legacy:.3f}s  new={total_new:.3f}s")
+
+    print(f"\n--- Synthetic sheet ({args.rows:,} rows) ---")
+    base = max(sheets, key=lambda sheet: len(sheet.columns))
+    synthetic = base.sample(n=args.rows, replace=True, random_state=42).reset_index(drop=True)
+    compare(f"synthetic from {len(base.columns)}-column sheet", synthetic)
+
+
+if __name__ == '__main__':
+    main()
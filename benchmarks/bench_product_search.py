@@ -0,0 +1,145 @@
+import argparse
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+from import_to_db import DB_PATH
+from bulk_writer import bulk_write_table
+from database_connection import get_db_engine, get_category_tables, raw_connection
+from near_duplicates import url_title
+from product_search import write_search_index, search_products, match_expression, MAX_RANKED_MATCHES
+
+# Latency targets for a search over the whole index, in milliseconds.
+TARGETS_MS = {'p50': 20.0, 'p95': 50.0}
+
+# Query shapes, filled in from the synthetic data: a common category word, a
+# brand, a two-word phrase, a model code, 2- and 3-character prefixes, and a
+# common word within one category.
+QUERY_KINDS = ('common word', 'brand', 'two words', 'model code', 'prefix 2', 'prefix 3', 'one category')
+
+
+def synthetic_tables(rows, seed=42):
+    """
+    Resamples the real products up to rows in total, keeping each category's
+    share, and gives every copy a fresh model code so titles stay distinct.
+    """
+    rng = np.random.default_rng(seed)
+    engine = get_db_engine(DB_PATH)
+    sources = {table: pd.read_sql_table(table, engine) for table in get_category_tables(DB_PATH)}
+    total = sum(len(df) for df in sources.values())
+    alphabet = np.array(list('abcdefghkmnprstvwxz0123456789'))
+
+    tables = {}
+    for table, df in sources.items():
+        n = max(1, round(rows * len(df) / total))
+        sample = df.sample(n=n, replace=True, random_state=int(rng.integers(1 << 31))).reset_index(drop=True)
+        codes = [''.join(code) for code in rng.choice(alphabet, size=(n, 6))]
+        titles = sample['product_url'].map(url_title).str.replace(r'مدل .*$', '', regex=True)
+        sample['product_url'] = [f"https://www.digikala.com/product/dkp-{i}/{title.replace(' ', '-')}-مدل-{code}/"
+                                 for i, (title, code) in enumerate(zip(titles, codes))]
+        tables[table] = sample
+    return tables
+
+
+def pick_queries(tables, seed=7, per_kind=20):
+    rng = np.random.default_rng(seed)
+    titles = pd.concat([df['product_url'].map(url_title) for df in tables.values()], ignore_index=True)
+    brands = pd.concat([df['brand'] for df in tables.values()], ignore_index=True)
+    brands = brands[brands.astype(str).str.len() > 1].astype(str)
+    words = titles.str.split()
+
+    queries = {kind: [] for kind in QUERY_KINDS}
+    for _ in range(per_kind):
+        tokens = words.iloc[rng.integers(len(words))]
+        queries['common word'].append((tokens[0], None))
+        queries['brand'].append((brands.iloc[rng.integers(len(brands))], None))
+        queries['two words'].append((' '.join(tokens[:2]), None))
+        queries['model code'].append((tokens[-1], None))
+        word = max(tokens, key=len)
+        queries['prefix 2'].append((word[:2], None))
+        queries['prefix 3'].append((word[:3], None))
+        queries['one category'].append((tokens[0], [list(tables)[rng.integers(len(tables))]]))
+    return queries
+
+
+def like_scan(db_path, tables, query):
+    """
+    The only way to search before the index: a LIKE over the URL of every table.
+    """
+    with raw_connection(db_path) as conn:
+        for table in tables:
+            conn.execute(f'SELECT rowid FROM "{table}" WHERE product_url LIKE ? LIMIT 10', (f'%{query}%',)).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the FTS5 product search at scale.")
+    parser.add_argument('--rows', type=int, default=1_000_000, help="Products in the synthetic database.")
+    parser.add_argument('--queries', type=int, default=20, help="Queries per query shape.")
+    parser.add_argument('--limit', type=int, default=10, help="Results per search.")
+    parser.add_argument('--max-ranked', type=int, metavar='N',
+                        help=f"Rank only the first N matches of each search (e.g. {MAX_RANKED_MATCHES:,}); "
+                             f"by default every match is ranked.")
+    args = parser.parse_args()
+
+    tables = synthetic_tables(args.rows)
+    print(f"Synthetic database: {sum(len(df) for df in tables.values()):,} products in {len(tables)} tables\n")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'search.db')
+        engine = get_db_engine(db_path, read_only=False)
+        for table, df in tables.items():
+            bulk_write_table(df, table, engine)
+
+        start = time.perf_counter()
+        write_search_index(db_path)
+        build_seconds = time.perf_counter() - start
+        print(f"  - Index built in {build_seconds:.1f}s "
+              f"({sum(len(df) for df in tables.values()) / build_seconds:,.0f} products/s), "
+              f"database {os.path.getsize(db_path) / 1e6:.0f} MB\n")
+
+        queries = pick_queries(tables, per_kind=args.queries)
+        max_ranked = args.max_ranked
+        search_products(queries['common word'][0][0], db_path=db_path)
+
+        latencies = []
+        print(f"{'query shape':<15}{'p50 (ms)':>10}{'p95 (ms)':>10}{'max (ms)':>10}{'hits':>7}{'truncated':>11}  example")
+        for kind, items in queries.items():
+            timings, hits, truncated = [], [], 0
+            for query, categories in items:
+                start = time.perf_counter()
+                results = search_products(query, args.limit, categories, db_path=db_path, max_ranked=max_ranked)
+                timings.append((time.perf_counter() - start) * 1000)
+                hits.append(len(results))
+                truncated += results.attrs['truncated']
+            latencies += timings
+            example = match_expression(items[0][0], categories=items[0][1])
+            print(f"{kind:<15}{np.percentile(timings, 50):>10.2f}{np.percentile(timings, 95):>10.2f}"
+                  f"{max(timings):>10.2f}{np.mean(hits):>7.1f}{truncated:>11}  {example}")
+
+        query = queries['model code'][0][0]
+        start = time.perf_counter()
+        like_scan(db_path, tables, query)
+        like_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        search_products(query, args.limit, db_path=db_path)
+        fts_ms = (time.perf_counter() - start) * 1000
+        print(f"\nModel code '{query}': LIKE scan {like_ms:.1f} ms, FTS5 {fts_ms:.2f} ms ({like_ms / fts_ms:.0f}x)")
+
+        print()
+        failed = []
+        for name, target in TARGETS_MS.items():
+            value = np.percentile(latencies, int(name[1:]))
+            print(f"  - {'✅' if value <= target else '❌'} {name} over all searches: {value:.2f} ms (target {target:.0f} ms)")
+            if value > target:
+                failed.append(name)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import os
+import sys
+import time
+import tempfile
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+from import_to_db import DB_PATH
+from bulk_writer import bulk_write_table
+from database_connection import get_db_engine, raw_connection
+
+# The query shapes query_example.py runs against every table, plus two lookups on indexed columns.
+QUERIES = {
+    'top 5 by price': 'SELECT brand, price FROM "{table}" WHERE price IS NOT NULL ORDER BY price DESC LIMIT 5',
+    'average price': 'SELECT AVG(price) FROM "{table}"',
+    'top 5 by rating': 'SELECT brand, rating FROM "{table}" WHERE rating IS NOT NULL ORDER BY rating DESC LIMIT 5',
+    'price range': 'SELECT COUNT(*) FROM "{table}" WHERE price BETWEEN 10000000 AND 20000000',
+    'one brand': 'SELECT COUNT(*) FROM "{table}" WHERE brand = (SELECT brand FROM "{table}" LIMIT 1)',
+}
+
+
+def time_queries(db_path, table, repeats):
+    timings = {}
+    with raw_connection(db_path) as conn:
+        for label, sql in QUERIES.items():
+            sql = sql.format(table=table)
+            conn.execute(sql).fetchall()
+            start = time.perf_counter()
+            for _ in range(repeats):
+                conn.execute(sql).fetchall()
+            timings[label] = (time.perf_counter() - start) / repeats
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark to_sql against the bulk SQLite writer.")
+    parser.add_argument('--rows', type=int, default=1_000_000, help="Rows in the synthetic table.")
+    parser.add_argument('--table', default='Refrigerator', help="Table of database/dataset.db to sample from.")
+    parser.add_argument('--repeats', type=int, default=20, help="Runs per query when timing latency.")
+    args = parser.parse_args()
+
+    source = pd.read_sql_table(args.table, get_db_engine(DB_PATH))
+    df = source.sample(n=args.rows, replace=True, random_state=42).reset_index(drop=True)
+    print(f"Synthetic '{args.table}' table: {len(df):,} rows x {len(df.columns)} columns\n")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        results = {}
+        for label in ('to_sql', 'bulk'):
+            db_path = os.path.join(temp_dir, f"{label}.db")
+            engine = get_db_engine(db_path, read_only=False)
+            start = time.perf_counter()
+            if label == 'to_sql':
+                df.to_sql(args.table, engine, if_exists='replace', index=False)
+            else:
+                bulk_write_table(df, args.table, engine)
+            elapsed = time.perf_counter() - start
+            results[label] = (elapsed, time_queries(db_path, args.table, args.repeats))
+
+        print(f"{'writer':<10}{'seconds':>10}{'rows/s':>14}")
+        for label, (elapsed, _) in results.items():
+            print(f"{label:<10}{elapsed:>10.2f}{len(df) / elapsed:>14,.0f}")
+
+        print(f"\n{'query':<18}{'to_sql (ms)':>14}{'bulk (ms)':>12}{'speedup':>10}")
+        for query in QUERIES:
+            before = results['to_sql'][1][query] * 1000
+            after = results['bulk'][1][query] * 1000
+            print(f"{query:<18}{before:>14.3f}{after:>12.3f}{before / after:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
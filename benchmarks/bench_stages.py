@@ -0,0 +1,166 @@
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+import preprocess
+import train_model
+import make_predictions
+from import_to_db import clean_dataframe
+from measurements import add_measurement_columns
+from feature_engineering import feature_engineer_dataframe
+from synthetic_data import SIZES, generate_sheet, write_table
+from instrumentation import REPORTS_DIR, build_report, measure, start_run, write_report
+
+RUN_NAME = 'bench_stages'
+# The in-memory stages hold the whole table (several times over while
+# cleaning); above this many rows only the streaming stages are run.
+MAX_IN_MEMORY_ROWS = 1_000_000
+# A stage is flagged when it is this much slower than in the baseline run.
+# Stages faster than MIN_COMPARED_SECONDS in both runs are mostly noise.
+REGRESSION_RATIO = 1.25
+MIN_COMPARED_SECONDS = 0.05
+
+
+def latest_report():
+    reports = sorted(glob.glob(os.path.join(REPORTS_DIR, f'{RUN_NAME}-*.json')))
+    return reports[-1] if reports else None
+
+
+def timed(stage, category, rows, func, *args):
+    """Runs one stage as a measured record of the run, its log lines captured."""
+    with measure(stage, category, rows_in=rows) as record:
+        record['details']['size'] = rows
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = func(*args)
+        if isinstance(result, pd.DataFrame):
+            record['rows_out'] = len(result)
+    return result
+
+
+def skip(stage, category, rows, reason):
+    with measure(stage, category, rows_in=rows) as record:
+        record.update(status='skipped', error=reason)
+        record['details']['size'] = rows
+
+
+def clean_sheet(sheet):
+    cleaned, _ = add_measurement_columns(clean_dataframe(sheet), sheet)
+    return cleaned
+
+
+def blank_targets(df, category):
+    """The rows to predict: every price and rating blanked, named after the table."""
+    blanked = df.copy()
+    blanked['category'] = category
+    blanked[['price', 'rating']] = np.nan
+    return blanked
+
+
+def run_in_memory(category, rows, seed, work_dir):
+    """
+    The stages as the in-process pipeline runs them on one table: generate,
+    clean, preprocess (fit, save, transform), features, train and predict.
+    The cleaned table takes a CSV round trip between cleaning and
+    preprocessing, as it does through the database export. Training calls
+    train_category_models directly, so the stage cache never skips it.
+    """
+    sheet = timed('generate', category, rows, generate_sheet, category, rows, seed)
+    cleaned = timed('clean', category, rows, clean_sheet, sheet)
+    del sheet
+    raw_path = os.path.join(work_dir, f'{category}_raw.csv')
+    cleaned.to_csv(raw_path, index=False)
+    raw = pd.read_csv(raw_path)
+    del cleaned
+
+    processed = timed('preprocess', category, rows, preprocess.fit_and_save_preprocessor, raw, category)
+    final = timed('features', category, rows, feature_engineer_dataframe, processed, category)
+    timed('train', category, rows, train_model.train_category_models, final, category)
+    del processed, final
+    timed('predict', category, rows, make_predictions.predict_missing_values, blank_targets(raw, category), False)
+
+
+def run_streaming(category, rows, seed, work_dir):
+    """
+    The streaming stages: the synthetic table generated and cleaned chunk by
+    chunk, then preprocessed in two passes (preprocess.py --chunk-size).
+    """
+    table_path = timed('generate_table', category, rows, write_table, category, rows, work_dir, seed)
+    output_path = os.path.join(work_dir, f'{category}_preprocessed.csv')
+    timed('preprocess_chunked', category, rows, preprocess.preprocess_file_chunked,
+          table_path, category, output_path, preprocess.CHUNK_SIZE)
+
+
+def print_results(records, baseline_records):
+    """Prints each stage's time, throughput and peak RSS, against the baseline run when there is one."""
+    baseline = {(r['stage'], r['category'], r['details'].get('size')): r for r in baseline_records
+                if r['status'] == 'ok'}
+    print(f"\n{'stage':<20}{'rows':>12}{'seconds':>10}{'rows/s':>14}{'peak RSS (MB)':>15}{'baseline':>10}")
+    regressions = 0
+    for record in records:
+        size = record['details'].get('size')
+        if record['status'] != 'ok':
+            print(f"{record['stage']:<20}{size:>12,}  {record['status']}: {record['error']}")
+            continue
+        seconds = record['wall_seconds']
+        line = (f"{record['stage']:<20}{size:>12,}{seconds:>10.3f}{size / seconds if seconds else 0:>14,.0f}"
+                f"{record['peak_rss_mb']:>15.1f}")
+        previous = baseline.get((record['stage'], record['category'], size))
+        if previous:
+            ratio = seconds / previous['wall_seconds'] if previous['wall_seconds'] else float('inf')
+            line += f"{ratio:>9.2f}x"
+            if ratio > REGRESSION_RATIO and max(seconds, previous['wall_seconds']) > MIN_COMPARED_SECONDS:
+                line += "  ❌ slower"
+                regressions += 1
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every pipeline stage on synthetic tables of growing size.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES[:2]),
+                        help=f"Rows per run (default: %(default)s; the full suite is {' '.join(map(str, SIZES))}).")
+    parser.add_argument('--category', default='Refrigerator', help="Category the synthetic tables are drawn from.")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed of the synthetic data.")
+    parser.add_argument('--baseline', help="Run report to compare with (default: the latest in reports/).")
+    parser.add_argument('--report', metavar='PATH', help="Where to write this run's report.")
+    args = parser.parse_args()
+
+    baseline_path = args.baseline or latest_report()
+    baseline_records = []
+    if baseline_path:
+        with open(baseline_path, 'r', encoding='utf-8') as f:
+            baseline_records = json.load(f)['records']
+
+    start_run(RUN_NAME)
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Models and preprocessors trained on synthetic data go to the scratch
+        # directory, never over the real ones in models/.
+        preprocess.MODELS_DIR = train_model.MODELS_DIR = make_predictions.MODELS_DIR = work_dir
+        for rows in args.sizes:
+            print(f"--- {args.category}: {rows:,} rows ---")
+            if rows <= MAX_IN_MEMORY_ROWS:
+                run_in_memory(args.category, rows, args.seed, work_dir)
+            else:
+                for stage in ('generate', 'clean', 'preprocess', 'features', 'train', 'predict'):
+                    skip(stage, args.category, rows, f"in-memory stages run up to {MAX_IN_MEMORY_ROWS:,} rows")
+            run_streaming(args.category, rows, args.seed, work_dir)
+
+    report_path = write_report(args.report)
+    regressions = print_results(build_report()['records'], baseline_records)
+    print(f"\nResults saved to '{os.path.relpath(report_path)}'"
+          + (f", compared with '{os.path.relpath(baseline_path)}'." if baseline_path else "."))
+    if regressions:
+        print(f"{regressions} stages were more than {REGRESSION_RATIO:.2f}x slower than the baseline.")
+
+
+if __name__ == '__main__':
+    main()
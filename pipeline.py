@@ -1,4 +1,9 @@
-import subprocess
-subprocess.run(["python", "scripts/load_data.py"]) 
-subprocess.run(["python", "scripts/preprocess.py"]) 
-subprocess.run(["python", "scripts/feature_engineering.py"])
\ No newline at end of file
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts'))
+from pipeline_runner import main
+
+# Data preparation only (load, preprocess, feature engineering). The staging
+# files are written by default because train_model.py reads them when run on its own.
+main(until='features', write_staging=True, description="Prepare the training data in one process.")
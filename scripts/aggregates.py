@@ -0,0 +1,140 @@
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+from database_connection import (
+    DB_PATH, STATS_TABLE, RATINGS_TABLE, TOP_ITEMS_TABLE, get_category_tables, get_column_types, raw_connection,
+)
+from queries import column_roles, value_sql, NUMERIC_ROLES, SUMMARY_TOP_N
+
+PERCENTILES = {'p10': 0.10, 'p25': 0.25, 'median': 0.50, 'p75': 0.75, 'p90': 0.90}
+RATING_BUCKET = 0.5
+
+# Column definitions of the summary tables. Statistics have one row per
+# category (scope 'category', brand NULL) and one per brand of the category
+# (scope 'brand'; brand NULL for products without one).
+STATS_COLUMNS = {
+    'table_name': 'TEXT', 'scope': 'TEXT', 'brand': 'TEXT',
+    'items': 'INTEGER', 'priced_items': 'INTEGER', 'mean_price': 'REAL', 'min_price': 'REAL',
+    **{f'{name}_price': 'REAL' for name in PERCENTILES}, 'max_price': 'REAL',
+    'rated_items': 'INTEGER', 'mean_rating': 'REAL', 'median_rating': 'REAL',
+}
+# Products per rating bucket [rating, rating + RATING_BUCKET); rating NULL counts the unrated.
+RATINGS_COLUMNS = {'table_name': 'TEXT', 'scope': 'TEXT', 'brand': 'TEXT', 'rating': 'REAL', 'items': 'INTEGER'}
+# The SUMMARY_TOP_N products with the highest price, rating and capacity of each category.
+TOP_ITEMS_COLUMNS = {'table_name': 'TEXT', 'metric': 'TEXT', 'rank': 'INTEGER', 'row_id': 'INTEGER',
+                     'title': 'TEXT', 'value': 'REAL'}
+SUMMARY_SCHEMAS = {STATS_TABLE: STATS_COLUMNS, RATINGS_TABLE: RATINGS_COLUMNS, TOP_ITEMS_TABLE: TOP_ITEMS_COLUMNS}
+SUMMARY_INDEXES = {STATS_TABLE: ('table_name', 'scope'), RATINGS_TABLE: ('table_name', 'scope'),
+                   TOP_ITEMS_TABLE: ('table_name', 'metric', 'rank')}
+
+def read_role_values(table, db_path=None) -> pd.DataFrame:
+    """
+    Reads what the summaries are computed from, in one pass over the table:
+    rowid, title, brand and the price, rating and capacity values, with the
+    same casts the ad-hoc queries use (see queries.value_sql).
+    """
+    roles = column_roles(table, db_path)
+    columns = get_column_types(db_path)[table]
+    selected = ['rowid AS row_id', f'"{roles["title"]}" AS title',
+                '"brand" AS brand' if 'brand' in columns else 'NULL AS brand']
+    selected += [f'{value_sql(table, roles[role], db_path)} AS {role}' for role in NUMERIC_ROLES if roles[role]]
+    with raw_connection(db_path) as conn:
+        df = pd.read_sql_query(f'SELECT {", ".join(selected)} FROM "{table}"', conn)
+    for role in NUMERIC_ROLES:
+        if role not in df.columns:
+            df[role] = np.nan
+    df['brand'] = df['brand'].where(df['brand'].notna() & (df['brand'].astype(str) != 'nan'))
+    return df
+
+def group_stats(df: pd.DataFrame) -> dict:
+    price, rating = df['price'].dropna(), df['rating'].dropna()
+    stats = {
+        'items': len(df), 'priced_items': len(price),
+        'mean_price': price.mean(), 'min_price': price.min(),
+        **{f'{name}_price': price.quantile(q) for name, q in PERCENTILES.items()},
+        'max_price': price.max(),
+        'rated_items': len(rating), 'mean_rating': rating.mean(), 'median_rating': rating.median(),
+    }
+    return {key: (None if pd.isna(value) else float(value) if isinstance(value, float) else int(value))
+            for key, value in stats.items()}
+
+def summarize_table(table, db_path=None):
+    """
+    Computes the summary rows of one category. Returns
+    {summary table: DataFrame} with the columns of SUMMARY_SCHEMAS.
+    """
+    df = read_role_values(table, db_path)
+    groups = [('category', None, df)] + [('brand', brand, group) for brand, group in df.groupby('brand', dropna=False)]
+
+    stats, ratings = [], []
+    buckets = (np.floor(df['rating'] / RATING_BUCKET) * RATING_BUCKET)
+    for scope, brand, group in groups:
+        brand = None if pd.isna(brand) else brand
+        stats.append({'table_name': table, 'scope': scope, 'brand': brand, **group_stats(group)})
+        counts = buckets.loc[group.index].value_counts(dropna=False).sort_index()
+        ratings += [{'table_name': table, 'scope': scope, 'brand': brand,
+                     'rating': None if pd.isna(bucket) else float(bucket), 'items': int(items)}
+                    for bucket, items in counts.items()]
+
+    top = []
+    for metric in NUMERIC_ROLES:
+        ranked = df.dropna(subset=[metric]).sort_values([metric, 'row_id'], ascending=[False, True]).head(SUMMARY_TOP_N)
+        top += [{'table_name': table, 'metric': metric, 'rank': rank, 'row_id': int(row.row_id),
+                 'title': row.title, 'value': float(getattr(row, metric))}
+                for rank, row in enumerate(ranked.itertuples(index=False), start=1)]
+
+    return {
+        STATS_TABLE: pd.DataFrame(stats, columns=list(STATS_COLUMNS)),
+        RATINGS_TABLE: pd.DataFrame(ratings, columns=list(RATINGS_COLUMNS)),
+        TOP_ITEMS_TABLE: pd.DataFrame(top, columns=list(TOP_ITEMS_COLUMNS)),
+    }
+
+def create_summary_tables(conn):
+    for table, columns in SUMMARY_SCHEMAS.items():
+        definitions = ', '.join(f'"{col}" {kind}' for col, kind in columns.items())
+        conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({definitions})')
+        indexed = ', '.join(f'"{col}"' for col in SUMMARY_INDEXES[table])
+        conn.execute(f'CREATE INDEX IF NOT EXISTS "ix_{table}_lookup" ON "{table}" ({indexed})')
+
+def update_summaries(db_path=None, tables=None):
+    """
+    Recomputes the summary rows of the given category tables (default: all)
+    and replaces theirs in the summary tables, leaving the other categories'
+    rows as they are, so an import only pays for the categories it wrote.
+    Rows of categories that no longer exist are removed. The replacement is
+    one transaction, so readers see the old or the new summaries, never a mix.
+    Returns the categories summarized.
+    """
+    categories = get_category_tables(db_path)
+    tables = categories if tables is None else [table for table in categories if table in set(tables)]
+    summaries = [summarize_table(table, db_path) for table in tables]
+
+    with raw_connection(db_path, read_only=False) as conn:
+        create_summary_tables(conn)
+        for summary, columns in SUMMARY_SCHEMAS.items():
+            stale = ', '.join('?' * len(tables)) or 'NULL'
+            current = ', '.join('?' * len(categories)) or 'NULL'
+            conn.execute(f'DELETE FROM "{summary}" WHERE table_name IN ({stale}) OR table_name NOT IN ({current})',
+                         list(tables) + list(categories))
+            names = ', '.join(f'"{col}"' for col in columns)
+            insert = f'INSERT INTO "{summary}" ({names}) VALUES ({", ".join("?" * len(columns))})'
+            for frames in summaries:
+                rows = frames[summary].astype(object).where(frames[summary].notna(), None)
+                conn.executemany(insert, rows.itertuples(index=False, name=None))
+        conn.commit()
+    return tables
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute the per-category summary tables.")
+    parser.add_argument('--tables', nargs='+', help="Only these categories (default: all).")
+    parser.add_argument('--db', default=DB_PATH, help="SQLite database to summarize.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    tables = update_summaries(args.db, args.tables)
+    print(f"  - ✅ Summaries of {len(tables)} categories written in {time.perf_counter() - start:.2f}s.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+import sqlite3
+import itertools
+import contextlib
+import pandas as pd
+
+from database_connection import release_readers
+
+CHUNK_SIZE = 50_000
+INDEXED_COLUMNS = ['price', 'rating', 'brand', 'title']
+
+# Load-time settings. The table is rebuilt from its workbook in one
+# transaction, so a rollback journal without fsyncs is enough; WAL would
+# write every new page twice (once to the log, once at checkpoint).
+LOAD_JOURNAL_MODE = 'TRUNCATE'
+LOAD_PRAGMAS = {
+    'synchronous': 'OFF',
+    'temp_store': 'MEMORY',
+    'cache_size': -64_000,
+}
+# Settings for the readers that come after the load. The journal mode is
+# stored in the database file, so every later connection reads in WAL mode.
+READ_JOURNAL_MODE = 'WAL'
+AFTER_LOAD_PRAGMAS = {
+    'synchronous': 'NORMAL',
+}
+
+def apply_pragmas(conn, pragmas):
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+
+def set_journal_mode(conn, mode):
+    """
+    Switching into or out of WAL needs the database to itself. If another
+    connection has it open the current mode is kept, which is still correct,
+    only slower for the load.
+    """
+    try:
+        return conn.execute(f"PRAGMA journal_mode = {mode}").fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+def to_sql_values(df: pd.DataFrame):
+    """
+    Yields rows as plain Python tuples with NaN turned into NULL, the same
+    values pandas' to_sql would bind. Datetimes use SQLAlchemy's SQLite text format.
+    """
+    for col in df.select_dtypes(include=['datetime', 'datetimetz']).columns:
+        df = df.assign(**{col: df[col].dt.strftime('%Y-%m-%d %H:%M:%S.%f')})
+    return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+def create_table_sql(df: pd.DataFrame, table_name, engine):
+    """
+    Builds the CREATE TABLE statement pandas' to_sql would issue, so the
+    bulk path produces the same column types as the SQLAlchemy path.
+    """
+    return pd.io.sql.get_schema(df, table_name, con=engine)
+
+def create_indexes(conn, table_name, columns, skip=()):
+    created = []
+    for col in INDEXED_COLUMNS:
+        if col in columns and col not in skip:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "ix_{table_name}_{col}" ON "{table_name}" ("{col}")')
+            created.append(col)
+    return created
+
+@contextlib.contextmanager
+def bulk_load(table_name, schema_df: pd.DataFrame, engine, chunk_size=CHUNK_SIZE, unique_key=None):
+    """
+    Opens a replacing load of table_name and yields write_rows(df), which can
+    be called any number of times with frames shaped like schema_df. The
+    table is dropped and recreated from schema_df's dtypes (same DDL as
+    to_sql), all rows go in through chunked executemany calls inside one
+    transaction under load-time pragmas, and on exit the table is indexed on
+    the columns the query scripts filter and sort on (price, rating, brand,
+    title). Nothing is visible to readers until the whole load has committed.
+    The yielded function's .indexed attribute lists the indexed columns afterwards.
+
+    With unique_key set, the table gets a UNIQUE index on that column before
+    any row goes in and rows are written with INSERT OR IGNORE, so SQLite
+    keeps the first row of each key across all write_rows calls (rows with
+    no key are all kept). write_rows returns the number of rows it inserted.
+    """
+    columns = list(schema_df.columns)
+    quoted_columns = ', '.join(f'"{col}"' for col in columns)
+    placeholders = ', '.join('?' for _ in columns)
+    verb = 'INSERT OR IGNORE' if unique_key else 'INSERT'
+    insert_sql = f'{verb} INTO "{table_name}" ({quoted_columns}) VALUES ({placeholders})'
+    schema_sql = create_table_sql(schema_df, table_name, engine)
+
+    # Idle reader connections of this process would keep the journal mode from changing.
+    release_readers(engine.url.database)
+    connection = engine.raw_connection()
+    conn = connection.driver_connection
+    conn.isolation_level = None
+
+    def write_rows(df: pd.DataFrame):
+        rows = to_sql_values(df[columns])
+        inserted = 0
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            inserted += conn.executemany(insert_sql, chunk).rowcount
+        return inserted
+
+    try:
+        set_journal_mode(conn, LOAD_JOURNAL_MODE)
+        apply_pragmas(conn, LOAD_PRAGMAS)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+            conn.execute(schema_sql)
+            if unique_key:
+                conn.execute(f'CREATE UNIQUE INDEX "ux_{table_name}_{unique_key}" ON "{table_name}" ("{unique_key}")')
+            yield write_rows
+            write_rows.indexed = ([unique_key] if unique_key else []) + create_indexes(
+                conn, table_name, columns, skip=[unique_key])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        set_journal_mode(conn, READ_JOURNAL_MODE)
+        apply_pragmas(conn, AFTER_LOAD_PRAGMAS)
+        conn.execute("PRAGMA optimize")
+    finally:
+        connection.close()
+
+def bulk_write_table(df: pd.DataFrame, table_name, engine, chunk_size=CHUNK_SIZE):
+    """
+    Replaces table_name with the rows of df. This is a faster equivalent of
+    df.to_sql(table_name, engine, if_exists='replace', index=False); see bulk_load.
+    Returns the list of indexed columns.
+    """
+    with bulk_load(table_name, df, engine, chunk_size) as write_rows:
+        write_rows(df)
+    return write_rows.indexed
@@ -0,0 +1,287 @@
+import os
+import sys
+import time
+import argparse
+import traceback
+import pandas as pd
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from database_connection import DB_PATH
+from load_data import get_table_names, read_table, RAW_DIR
+from preprocess import preprocess_table, PREPROCESSED_DIR
+from feature_engineering import engineer_table, FINAL_DIR
+from train_model import train_category
+from stage_cache import merge_cache_stats, print_cache_stats
+from memory_usage import frame_mb, print_memory
+from instrumentation import measure, add_records, start_run, finish_run, add_report_arguments
+
+CATEGORY_STAGES = ('load', 'preprocess', 'features', 'train')
+STAGING_DIRS = {'load': RAW_DIR, 'preprocess': PREPROCESSED_DIR, 'features': FINAL_DIR}
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+DEFAULT_RETRIES = 1
+RETRY_DELAY = 0.5
+
+# func is called as func(*args, *results of deps), in the order of deps.
+Task = namedtuple('Task', ['name', 'func', 'args', 'deps'])
+TaskResult = namedtuple('TaskResult', ['status', 'value', 'attempts', 'seconds', 'error'])
+# What a category stage hands on: its output, the stage cache statistics of
+# the task and the run report records measured in the worker.
+CategoryOutput = namedtuple('CategoryOutput', ['output', 'cache_stats', 'records'], defaults=[()])
+
+def check_dag(tasks: dict):
+    """
+    Raises ValueError when a task depends on an unknown task or the
+    dependencies form a cycle.
+    """
+    for task in tasks.values():
+        missing = [dep for dep in task.deps if dep not in tasks]
+        if missing:
+            raise ValueError(f"Task '{task.name}' depends on unknown tasks: {missing}")
+
+    state = {}
+    def visit(name, path):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError(f"Dependency cycle: {' -> '.join(path + [name])}")
+        state[name] = 'visiting'
+        for dep in tasks[name].deps:
+            visit(dep, path + [name])
+        state[name] = 'done'
+    for name in tasks:
+        visit(name, [])
+
+def run_dag(tasks: dict, workers=DEFAULT_WORKERS, retries=DEFAULT_RETRIES, on_result=None):
+    """
+    Runs {name: Task} on a pool of worker processes. A task starts as soon as
+    all of its dependencies have succeeded, and at most workers tasks run at
+    once; ready tasks start in the order of the dict. A task that raises is
+    run again after RETRY_DELAY seconds, up to retries more times. A task that still fails is marked
+    'failed' and everything downstream of it 'skipped', while the rest of the
+    graph carries on. When a worker process dies, the pool is replaced and
+    every task that was running on it counts one failed attempt.
+    on_result(name, TaskResult) is called as each task settles.
+    Returns {name: TaskResult} with status 'ok', 'failed' or 'skipped'.
+    """
+    check_dag(tasks)
+    workers = max(workers, 1)
+    pending = dict(tasks)
+    results = {}
+    attempts = dict.fromkeys(tasks, 0)
+    running = {}
+    retry_at = {}
+
+    def settle(name, result):
+        results[name] = result
+        if on_result is not None:
+            on_result(name, result)
+
+    def failed(name, seconds, error):
+        if attempts[name] <= retries:
+            print(f"  - WARNING: Task '{name}' failed (attempt {attempts[name]} of {retries + 1}), retrying: {error}")
+            retry_at[name] = time.perf_counter() + RETRY_DELAY
+            pending[name] = tasks[name]
+        else:
+            settle(name, TaskResult('failed', None, attempts[name], seconds, error))
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        while pending or running:
+            for name, task in list(pending.items()):
+                upstream = next((dep for dep in task.deps if dep in results and results[dep].status != 'ok'), None)
+                if upstream is not None:
+                    del pending[name]
+                    settle(name, TaskResult('skipped', None, 0, 0.0, f"upstream task '{upstream}' {results[upstream].status}"))
+
+            for name, task in list(pending.items()):
+                if len(running) >= workers:
+                    break
+                if all(dep in results for dep in task.deps) and retry_at.get(name, 0) <= time.perf_counter():
+                    del pending[name]
+                    retry_at.pop(name, None)
+                    attempts[name] += 1
+                    inputs = [results[dep].value for dep in task.deps]
+                    running[executor.submit(task.func, *task.args, *inputs)] = (name, time.perf_counter())
+
+            if not running:
+                if pending:
+                    time.sleep(RETRY_DELAY)
+                continue
+            done, _ = wait(running, timeout=RETRY_DELAY if retry_at else None, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                name, start = running.pop(future)
+                seconds = time.perf_counter() - start
+                try:
+                    settle(name, TaskResult('ok', future.result(), attempts[name], seconds, None))
+                except BrokenProcessPool as e:
+                    broken = True
+                    failed(name, seconds, f"worker process died: {e}")
+                except Exception as e:
+                    failed(name, seconds, ''.join(traceback.format_exception_only(type(e), e)).strip())
+
+            if broken:
+                # Every other task on the dead pool is lost with it.
+                for future, (name, start) in running.items():
+                    failed(name, time.perf_counter() - start, "worker process died")
+                running.clear()
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = ProcessPoolExecutor(max_workers=workers)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    return {name: results[name] for name in tasks}
+
+def run_category_stage(stage, table_name, write_staging=False, force=False, compact=False, previous=None):
+    """
+    One stage of one category, run in a worker process on the CategoryOutput
+    of the category's previous stage. The stages after 'load' go through the
+    stage cache; with compact=True the data is held in compact dtypes (see
+    memory_usage.compact_dtypes). The stage is measured for the run report.
+    Returns a CategoryOutput holding the stage's DataFrame, or the saved
+    model files for 'train'.
+    """
+    stats, records = {}, []
+    with measure(stage, table_name, records=records) as record:
+        if previous is not None:
+            record['rows_in'] = len(previous.output)
+        if stage == 'load':
+            result = read_table(table_name, compact=compact)
+        elif stage == 'preprocess':
+            result = preprocess_table(previous.output, table_name, force, stats, compact)
+        elif stage == 'features':
+            result = engineer_table(previous.output, table_name, force, stats)
+        else:
+            result = train_category(previous.output, table_name, force, stats)
+            record['details']['models'] = result
+        if isinstance(result, pd.DataFrame):
+            record['rows_out'] = len(result)
+
+        if write_staging and stage in STAGING_DIRS:
+            result.to_csv(os.path.join(STAGING_DIRS[stage], f"{table_name}.csv"), index=False)
+    return CategoryOutput(result, stats, records)
+
+def category_tasks(tables, until='train', write_staging=False, force=False, compact=False) -> dict:
+    """
+    Builds the DAG of the per-category pipeline: for each table a chain of
+    tasks '<stage>:<table>' over CATEGORY_STAGES up to until. The chains do
+    not depend on each other.
+    """
+    stages = CATEGORY_STAGES[:CATEGORY_STAGES.index(until) + 1]
+    tasks = {}
+    for table_name in tables:
+        previous = None
+        for stage in stages:
+            name = f"{stage}:{table_name}"
+            tasks[name] = Task(name, run_category_stage, (stage, table_name, write_staging, force, compact),
+                               (previous,) if previous else ())
+            previous = name
+    return tasks
+
+def run_categories(tables=None, until='train', workers=DEFAULT_WORKERS, retries=DEFAULT_RETRIES, write_staging=False,
+                   force=False, compact=False):
+    """
+    Runs load -> preprocess -> features -> train (up to until) for every
+    category as independent tasks on a process pool, so a slow or failing
+    category does not hold up the others. Unchanged stages are taken from
+    the stage cache unless force=True.
+    Returns {table_name: {stage: TaskResult}}.
+    """
+    if tables is None:
+        tables = get_table_names(DB_PATH)
+
+    def report(name, result):
+        detail = f" after {result.attempts} attempts" if result.attempts > 1 else ''
+        if result.status == 'ok':
+            print(f"  - ✅ {name} finished in {result.seconds:.2f}s{detail}.")
+        else:
+            print(f"  - ❌ {name} {result.status}{detail}: {result.error}")
+
+    results = run_dag(category_tasks(tables, until, write_staging, force, compact), workers, retries, on_result=report)
+    by_category = {table_name: {} for table_name in tables}
+    for name, result in results.items():
+        stage, table_name = name.split(':', 1)
+        by_category[table_name][stage] = result
+    return by_category
+
+def print_category_report(by_category):
+    stages = list(next(iter(by_category.values()), {}))
+    print(f"\n{'category':<18}" + ''.join(f"{stage:>14}" for stage in stages) + f"{'total (s)':>12}")
+    for table_name, stage_results in by_category.items():
+        cells = []
+        for stage in stages:
+            result = stage_results[stage]
+            cells.append(f"{result.seconds:>14.2f}" if result.status == 'ok' else f"{result.status:>14}")
+        total = sum(result.seconds for result in stage_results.values())
+        print(f"{table_name:<18}" + ''.join(cells) + f"{total:>12.2f}")
+
+def category_cache_stats(by_category):
+    stats = {}
+    for stage_results in by_category.values():
+        for result in stage_results.values():
+            if result.status == 'ok':
+                merge_cache_stats(stats, result.value.cache_stats)
+    return stats
+
+def category_memory(by_category):
+    """
+    {stage: (largest peak RSS of a worker running the stage, MB of the stage's
+    DataFrames over all categories)}, as memory_usage.print_memory reports it.
+    """
+    memory = {}
+    for stage_results in by_category.values():
+        for stage, result in stage_results.items():
+            if result.status != 'ok':
+                continue
+            peak, data = memory.get(stage, (0.0, None))
+            if isinstance(result.value.output, pd.DataFrame):
+                data = (data or 0.0) + frame_mb(result.value.output)
+            peaks = [record['peak_rss_mb'] for record in result.value.records]
+            memory[stage] = (max([peak] + peaks), data)
+    return memory
+
+def category_records(by_category):
+    """
+    The run report records of every finished task, measured in the workers.
+    """
+    return [record for stage_results in by_category.values() for result in stage_results.values()
+            if result.status == 'ok' for record in result.value.records]
+
+def category_failures(by_category):
+    return [table_name for table_name, stage_results in by_category.items()
+            if any(result.status != 'ok' for result in stage_results.values())]
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the pipeline of every category as independent tasks on a process pool.")
+    parser.add_argument('--until', choices=CATEGORY_STAGES, default='train', help="Last stage to run (default: %(default)s).")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Tasks run at the same time (default: %(default)s).")
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES, help="Extra attempts for a failing task (default: %(default)s).")
+    parser.add_argument('--categories', nargs='+', help="Only these tables (default: all).")
+    parser.add_argument('--write-staging', action='store_true', help="Also write each data stage's output to staging/ as CSV.")
+    parser.add_argument('--force', action='store_true', help="Recompute every stage, ignoring the stage cache.")
+    parser.add_argument('--compact', action='store_true',
+                        help="Hold the data in float32/int32 and category dtypes to save memory.")
+    # No --profile: the stages run in worker processes, out of reach of this process's profiler.
+    add_report_arguments(parser)
+    args = parser.parse_args()
+    start_run('category_scheduler')
+
+    print("====== Starting Per-Category Pipeline ======")
+    start = time.perf_counter()
+    by_category = run_categories(args.categories, args.until, args.workers, args.retries, args.write_staging,
+                                 args.force, args.compact)
+    print_category_report(by_category)
+    print_memory(category_memory(by_category))
+    print_cache_stats(category_cache_stats(by_category))
+    add_records(category_records(by_category))
+    finish_run(args)
+
+    failures = category_failures(by_category)
+    if failures:
+        print(f"\n====== ❌ {len(failures)} of {len(by_category)} categories failed: {', '.join(failures)} ======")
+        sys.exit(1)
+    print(f"\n====== ✅ All {len(by_category)} categories finished in {time.perf_counter() - start:.2f}s ======")
+
+if __name__ == '__main__':
+    main()
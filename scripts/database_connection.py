@@ -1,24 +1,159 @@
 import os
+import contextlib
+import threading
 import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.pool import NullPool, QueuePool
 
-def get_db_engine():
+DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'database', 'dataset.db')
+
+# Settings for every reader connection: map the file instead of copying pages
+# through read(), keep a larger page cache, and refuse writes.
+READ_PRAGMAS = {
+    'mmap_size': 268_435_456,
+    'cache_size': -64_000,
+    'temp_store': 'MEMORY',
+    'query_only': 'ON',
+}
+READ_POOL_SIZE = 5
+READ_MAX_OVERFLOW = 10
+
+# Tables the pipeline derives from the category tables: the near-duplicate
+# clusters and the summaries. Every other table is a category.
+CLUSTERS_TABLE = 'duplicate_clusters'
+STATS_TABLE = 'summary_stats'
+RATINGS_TABLE = 'summary_ratings'
+TOP_ITEMS_TABLE = 'summary_top_items'
+DERIVED_TABLES = (CLUSTERS_TABLE, STATS_TABLE, RATINGS_TABLE, TOP_ITEMS_TABLE)
+
+# Text cells pd.read_excel reads as missing by default (its na_values list).
+# The streaming import reads them as missing too, and the typed export
+# treats them as missing when it infers a text column's type.
+NA_STRINGS = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+}
+
+_engines = {}
+_catalogs = {}
+_lock = threading.Lock()
+
+def _apply_read_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in READ_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+def _create_engine(db_path, read_only):
+    url = f'sqlite:///{db_path}'
+    if not read_only:
+        # Writers get no pool: an idle pooled connection would stop the bulk
+        # writer from switching journal modes.
+        return sqlalchemy.create_engine(url, poolclass=NullPool)
+
+    engine = sqlalchemy.create_engine(
+        url,
+        poolclass=QueuePool,
+        pool_size=READ_POOL_SIZE,
+        max_overflow=READ_MAX_OVERFLOW,
+        connect_args={'check_same_thread': False},
+    )
+    event.listen(engine, 'connect', _apply_read_pragmas)
+    return engine
+
+def get_db_engine(db_path=None, read_only=True):
     """
-    Dynamically creates and returns a SQLAlchemy engine connected to the project's SQLite database.
+    Returns the process-wide SQLAlchemy engine for a database, creating it on
+    first use. Readers share one pooled engine per database whose connections
+    are read-only (see READ_PRAGMAS); read_only=False gives the writer engine,
+    which opens a fresh connection per use and may create the database file.
+    Engines are per process, so pool connections are never shared across a fork.
     """
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    
-    project_root = os.path.dirname(script_dir)
-    
-    db_path = os.path.join(project_root, 'database', 'dataset.db')
-
-    if not os.path.exists(db_path):
+    db_path = os.path.abspath(db_path or DB_PATH)
+    if read_only and not os.path.exists(db_path):
         raise FileNotFoundError(f"Database file not found at: {db_path}. Please run the import script first.")
-        
 
-    engine = sqlalchemy.create_engine(f'sqlite:///{db_path}')
-    
+    key = (os.getpid(), db_path, read_only)
+    with _lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = _engines[key] = _create_engine(db_path, read_only)
     return engine
 
+def release_readers(db_path=None):
+    """
+    Closes the idle reader connections of a database, e.g. before a load
+    that needs the file to itself. The engine is reused afterwards.
+    """
+    engine = _engines.get((os.getpid(), os.path.abspath(db_path or DB_PATH), True))
+    if engine is not None:
+        engine.dispose()
+
+@contextlib.contextmanager
+def raw_connection(db_path=None, read_only=True):
+    """
+    Yields the plain sqlite3 connection behind a pooled engine connection, for
+    code that talks DB-API directly (executemany, PRAGMAs, pandas with sqlite3).
+    The connection goes back to the pool on exit.
+    """
+    connection = get_db_engine(db_path, read_only).raw_connection()
+    try:
+        yield connection.driver_connection
+    finally:
+        connection.close()
+
+def _read_catalog(db_path):
+    """
+    Returns {table_name: {column: declared type}} for every table, read with a
+    single query over sqlite_master and pragma_table_info. SQLite's own
+    tables (sqlite_stat1, which PRAGMA optimize may create, sqlite_sequence),
+    virtual tables (the full-text search index) and their shadow tables are
+    left out. The
+    result is cached and only re-read when the database's schema_version changes.
+    """
+    db_path = os.path.abspath(db_path or DB_PATH)
+    if not os.path.exists(db_path):
+        return {}
+
+    with raw_connection(db_path) as conn:
+        version = conn.execute("PRAGMA schema_version").fetchone()[0]
+        cached = _catalogs.get(db_path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        catalog = {}
+        rows = conn.execute(
+            "SELECT m.name, p.name, p.type FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p "
+            "WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite\\_%' ESCAPE '\\' AND NOT EXISTS ("
+            "    SELECT 1 FROM sqlite_master AS v WHERE v.type = 'table' AND v.sql LIKE 'CREATE VIRTUAL TABLE%' "
+            "    AND (m.name = v.name OR substr(m.name, 1, length(v.name) + 1) = v.name || '_')"
+            ") ORDER BY m.rowid, p.cid"
+        )
+        for table_name, column, declared_type in rows:
+            catalog.setdefault(table_name, {})[column] = declared_type.upper()
+
+    _catalogs[db_path] = (version, catalog)
+    return catalog
+
+def get_schema_catalog(db_path=None):
+    """
+    Returns {table_name: [column names]} for every table, from the cached
+    catalog (see _read_catalog). A missing database has an empty catalog.
+    """
+    return {table: list(columns) for table, columns in _read_catalog(db_path).items()}
+
+def get_column_types(db_path=None):
+    """
+    Returns {table_name: {column: declared SQLite type}} from the cached catalog.
+    """
+    return {table: dict(columns) for table, columns in _read_catalog(db_path).items()}
+
+def get_table_names(db_path=None):
+    return list(get_schema_catalog(db_path))
+
+def get_category_tables(db_path=None):
+    return [table for table in get_schema_catalog(db_path) if table not in DERIVED_TABLES]
+
 if __name__ == '__main__':
 
     print("Attempting to connect to the database...")
@@ -27,5 +162,6 @@ if __name__ == '__main__':
         with engine.connect() as connection:
             print("✅ Database connection successful!")
             print(f"Engine Dialect: {connection.dialect.name}")
+            print(f"Tables: {get_table_names()}")
     except Exception as e:
-        print(f"❌ Database connection failed. Error: {e}")
\ No newline at end of file
+        print(f"❌ Database connection failed. Error: {e}")
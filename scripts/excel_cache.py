@@ -0,0 +1,90 @@
+import os
+import glob
+import hashlib
+import pandas as pd
+import numpy as np
+
+from import_manifest import hash_file
+
+CACHE_SUFFIX = '.parquet'
+
+def sidecar_path(file_path, sha256, read_kwargs):
+    """
+    The sidecar sits beside its workbook as a hidden file. Its name carries a
+    hash of the workbook content and of the read options, so a changed
+    workbook (or a different header row) never reuses a stale copy.
+    """
+    key = hashlib.sha256(f"{sha256}|{sorted(read_kwargs.items())!r}".encode('utf-8')).hexdigest()[:16]
+    directory, name = os.path.split(file_path)
+    return os.path.join(directory, f".{name}.{key}{CACHE_SUFFIX}")
+
+def to_columnar(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Parquet needs one type per column. Object columns that mix numbers and
+    text are stored as text (missing cells stay missing), which is how
+    clean_dataframe treats every object cell anyway.
+    """
+    mixed_columns = [
+        col for col in df.select_dtypes(include=['object']).columns
+        if pd.api.types.infer_dtype(df[col], skipna=True) not in ('string', 'empty')
+    ]
+    if not mixed_columns:
+        return df
+
+    df = df.copy()
+    for col in mixed_columns:
+        df[col] = df[col].map(lambda value: value if isinstance(value, str) or pd.isna(value) else str(value))
+    return df
+
+def from_columnar(df: pd.DataFrame) -> pd.DataFrame:
+    # read_excel marks missing text cells with NaN, Parquet gives them back as None.
+    for col in df.select_dtypes(include=['object']).columns:
+        if df[col].isna().any():
+            df[col] = df[col].where(df[col].notna(), np.nan)
+    return df
+
+def remove_stale_sidecars(file_path, keep_path):
+    directory, name = os.path.split(file_path)
+    pattern = os.path.join(glob.escape(directory), f".{glob.escape(name)}.*{CACHE_SUFFIX}")
+    for path in glob.glob(pattern):
+        if path != keep_path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def read_excel_cached(file_path, sha256=None, use_cache=True, **read_kwargs):
+    """
+    Drop-in replacement for pd.read_excel(file_path, **read_kwargs) that keeps
+    a Parquet copy of the parsed sheet beside the workbook and reads that copy
+    while the workbook is unchanged. Falls back to plain read_excel whenever
+    the cache cannot be used (e.g. pyarrow is not installed).
+    """
+    if not use_cache:
+        return pd.read_excel(file_path, **read_kwargs)
+
+    if sha256 is None:
+        sha256 = hash_file(file_path)
+    cache_path = sidecar_path(file_path, sha256, read_kwargs)
+
+    if os.path.exists(cache_path):
+        try:
+            df = from_columnar(pd.read_parquet(cache_path))
+            print(f"  - Loaded cached copy '{os.path.basename(cache_path)}'.")
+            return df
+        except Exception as e:
+            print(f"  - Warning: Could not read cached copy ({e}). Re-reading the workbook.")
+
+    df = pd.read_excel(file_path, **read_kwargs)
+
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        to_columnar(df).to_parquet(temp_path, index=False)
+        os.replace(temp_path, cache_path)
+        remove_stale_sidecars(file_path, cache_path)
+    except Exception as e:
+        print(f"  - Warning: Could not write cached copy ({e}).")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    return df
@@ -2,74 +2,187 @@ import pandas as pd
 import os
 import glob
 import numpy as np
+import argparse
+from functools import lru_cache
+from collections import namedtuple
+from import_manifest import hash_source
+from stage_cache import cached_stage, record_cache_stats, print_cache_stats
+from instrumentation import measure, record_skip, start_run, finish_run, add_report_arguments
 
 PREPROCESSED_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'staging', '02_preprocessed')
 FINAL_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'staging', '03_final')
 os.makedirs(FINAL_DIR, exist_ok=True)
 
-def feature_engineer_dataframe(df: pd.DataFrame, category_name: str) -> pd.DataFrame:
-    
-    df = df.copy()
-    original_cols = df.columns.tolist()
+# Values several features are built from, computed at most once per call.
+SHARED_EXPRESSIONS = {
+    'box_cm3': 'height_cm * width_cm * depth_cm',
+}
+# Every engineered feature, as an arithmetic expression over columns and
+# shared values; each is evaluated on NumPy arrays (float64, or float32
+# when every input column is 32-bit, as in compact mode).
+FEATURE_EXPRESSIONS = {
+    'volume_m3': 'box_cm3 / 1_000_000',
+    'form_factor_ratio': 'height_cm / (width_cm + 0.01)',
+    'shelf_to_capacity_ratio': '(fridge_shelves + freezer_shelves) / (total_capacity + 0.01)',
+    'price_per_kg': 'price / (capacity_kg + 0.01)',
+    'efficiency_score': 'capacity_kg / (water_consumption + power_consumption + 0.01)',
+    'compactness': 'capacity / (box_cm3 + 0.01)',
+}
+# The features of each category, in the order they are added.
+CATEGORY_FEATURES = {
+    'Refrigerator': ['volume_m3', 'form_factor_ratio', 'shelf_to_capacity_ratio'],
+    'Washing_machine': ['price_per_kg', 'efficiency_score', 'volume_m3'],
+    'Dishwasher': ['compactness'],
+}
 
-    
-    if category_name == 'Refrigerator':
-        if all(c in df.columns for c in ['height', 'width', 'depth']):
-            df['volume_m3'] = (df['height'] * df['width'] * df['depth']) / 1_000_000
-            df['form_factor_ratio'] = df['height'] / (df['width'] + 0.01)
-        if all(c in df.columns for c in ['fridge_shelves', 'freezer_shelves']):
-            df['shelf_to_capacity_ratio'] = (df['fridge_shelves'] + df['freezer_shelves']) / (df['total_capacity'] + 0.01)
-
-    elif category_name == 'Washing_machine':
-        if all(c in df.columns for c in ['price', 'capacity']) and df['capacity'].mean() > 0:
-            df['price_per_kg'] = df['price'] / (df['capacity'] + 0.01)
-        if all(c in df.columns for c in ['water_consumption', 'power_consumption', 'capacity']) and df['capacity'].mean() > 0:
-            df['efficiency_score'] = df['capacity'] / (df['water_consumption'] + df['power_consumption'] + 0.01)
-        if all(c in df.columns for c in ['height', 'width', 'depth']):
-            df['volume_m3'] = (df['height'] * df['width'] * df['depth']) / 1_000_000
-
-    elif category_name == 'Dishwasher':
-        if all(c in df.columns for c in ['height', 'width', 'depth', 'capacity']) and df['height'].mean() > 0:
-            df['compactness'] = df['capacity'] / ((df['height'] * df['width'] * df['depth']) + 0.01)
-
-
-
-    new_features = [col for col in df.columns if col not in original_cols]
-    if new_features:
-        print(f"      - Created new features: {new_features}")
-            
+FeaturePlan = namedtuple('FeaturePlan', ['columns', 'steps', 'outputs'])
+
+def expression_code(name):
+    expression = FEATURE_EXPRESSIONS[name] if name in FEATURE_EXPRESSIONS else SHARED_EXPRESSIONS[name]
+    return compile(expression, name, 'eval')
+
+def expression_inputs(name, columns):
+    """
+    The columns an expression reads, directly or through shared values.
+    """
+    inputs = set()
+    for dependency in expression_code(name).co_names:
+        if dependency in SHARED_EXPRESSIONS and dependency not in columns:
+            inputs |= expression_inputs(dependency, columns)
+        else:
+            inputs.add(dependency)
+    return inputs
+
+@lru_cache(maxsize=None)
+def compile_features(category_name, columns, wanted=None) -> FeaturePlan:
+    """
+    Compiles the features of a category for a table with the given columns
+    into one evaluation plan: the columns to read, then (name, code) steps
+    in dependency order with each shared value once. A feature is skipped
+    when one of its inputs is not a column. wanted limits the plan to some
+    features, e.g. the ones a model was trained on.
+    """
+    read, steps, outputs = [], {}, []
+
+    def add_step(name):
+        code = expression_code(name)
+        for dependency in code.co_names:
+            if dependency in columns:
+                if dependency not in read:
+                    read.append(dependency)
+            elif dependency not in steps:
+                add_step(dependency)
+        steps[name] = code
+
+    for feature in CATEGORY_FEATURES.get(category_name, []):
+        if wanted is not None and feature not in wanted:
+            continue
+        if not expression_inputs(feature, columns) <= set(columns):
+            continue
+        add_step(feature)
+        outputs.append(feature)
+    return FeaturePlan(tuple(read), tuple(steps.items()), tuple(outputs))
+
+def feature_engineer_dataframe(df: pd.DataFrame, category_name: str, features=None) -> pd.DataFrame:
+    """
+    Adds the engineered features of a category (CATEGORY_FEATURES) to df in
+    place and returns it: the input columns are read once as arrays and
+    every expression is evaluated in one pass over them. features limits the
+    work to the named features (see compile_features).
+    """
+    plan = compile_features(category_name, tuple(df.columns), frozenset(features) if features is not None else None)
+    dtype = np.float32 if all(df[col].dtype.itemsize <= 4 for col in plan.columns) else np.float64
+    values = {col: df[col].to_numpy(dtype=dtype) for col in plan.columns}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for name, code in plan.steps:
+            values[name] = eval(code, {'__builtins__': {}}, values)
+    for feature in plan.outputs:
+        df[feature] = values[feature]
+
+    if plan.outputs:
+        print(f"      - Created new features: {list(plan.outputs)}")
     return df
 
+def feature_code_hash():
+    return hash_source([feature_engineer_dataframe, compile_features, expression_code, expression_inputs,
+                        SHARED_EXPRESSIONS, FEATURE_EXPRESSIONS, CATEGORY_FEATURES])
+
+def engineer_table(df: pd.DataFrame, category_name, force=False, stats=None) -> pd.DataFrame:
+    """
+    feature_engineer_dataframe through the stage cache: the cached output is
+    reused while the category's data and feature_engineer_dataframe are unchanged.
+    """
+    output = cached_stage('features', category_name, feature_engineer_dataframe, df, args=(category_name,),
+                          code_hash=feature_code_hash(), force=force)
+    if stats is not None:
+        record_cache_stats(stats, 'features', output)
+    if output.hit:
+        print(f"      - Unchanged since the last run; reusing the cached output.")
+    return output.value
+
+def engineer_tables(tables: dict, force=False, stats=None) -> dict:
+    """
+    Runs feature_engineer_dataframe over {category_name: preprocessed DataFrame}
+    in memory, through the stage cache. A category that fails is reported and
+    left out, as in main().
+    """
+    engineered = {}
+    for category_name, df in tables.items():
+        print(f"    - Engineering features for '{category_name}'...")
+        try:
+            with measure('features', category_name, rows_in=len(df)) as record:
+                engineered[category_name] = engineer_table(df, category_name, force, stats)
+                record['rows_out'] = len(engineered[category_name])
+            print(f"      - Successfully engineered features. Final shape: {engineered[category_name].shape}")
+        except Exception as e:
+            print(f"    - ERROR: Failed to engineer features for '{category_name}'. Details: {e}")
+    return engineered
+
 def main():
+    parser = argparse.ArgumentParser(description="Engineer features from the preprocessed staging files.")
+    parser.add_argument('--force', action='store_true', help="Recompute every category, ignoring the stage cache.")
+    add_report_arguments(parser, ['features'])
+    args = parser.parse_args()
+    start_run('feature_engineering', args.profile)
+
     print(f"--- [3/3] Running feature_engineering.py ---")
     
     input_files = glob.glob(os.path.join(PREPROCESSED_DIR, '*.csv'))
 
     if not input_files:
         print(f"  - WARNING: No preprocessed files found in '{os.path.basename(PREPROCESSED_DIR)}'.")
+        record_skip('features', f"No preprocessed files found in '{os.path.basename(PREPROCESSED_DIR)}'.")
+        finish_run(args)
         return
         
     print(f"  - Found {len(input_files)} files for feature engineering...")
+    stats = {}
 
-    for file_path in input_files:
-        file_name = os.path.basename(file_path)
-        category_name = file_name.replace('.csv', '')
-        print(f"    - Engineering features for '{file_name}'...")
-        
-        try:
-            df = pd.read_csv(file_path)
-            
-            final_df = feature_engineer_dataframe(df, category_name)
-            
-            output_path = os.path.join(FINAL_DIR, file_name)
-            final_df.to_csv(output_path, index=False)
-            print(f"      - Successfully engineered features. Final shape: {final_df.shape}")
-            
-        except Exception as e:
-            print(f"    - ERROR: Failed to engineer features for '{file_name}'. Details: {e}")
-            continue
+    with measure('features'):
+        for file_path in input_files:
+            file_name = os.path.basename(file_path)
+            category_name = file_name.replace('.csv', '')
+            print(f"    - Engineering features for '{file_name}'...")
+
+            try:
+                with measure('features', category_name) as record:
+                    df = pd.read_csv(file_path)
+                    record['rows_in'] = len(df)
+
+                    final_df = engineer_table(df, category_name, args.force, stats)
+
+                    output_path = os.path.join(FINAL_DIR, file_name)
+                    final_df.to_csv(output_path, index=False)
+                    record['rows_out'] = len(final_df)
+                print(f"      - Successfully engineered features. Final shape: {final_df.shape}")
+
+            except Exception as e:
+                print(f"    - ERROR: Failed to engineer features for '{file_name}'. Details: {e}")
+                continue
 
+    print_cache_stats(stats)
     print(f"  - ✅ Feature engineering complete for all files.")
+    finish_run(args)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
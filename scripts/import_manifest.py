@@ -0,0 +1,83 @@
+import os
+import json
+import hashlib
+import inspect
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def manifest_path_for(db_path):
+    """
+    The manifest lives next to the database it describes, e.g. database/dataset_manifest.json.
+    """
+    return os.path.splitext(db_path)[0] + '_manifest.json'
+
+def hash_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_source(objects):
+    """
+    Hashes the source code of the given functions together with the repr of
+    any plain values (patterns, thresholds) that influence their output.
+    """
+    digest = hashlib.sha256()
+    for obj in objects:
+        text = inspect.getsource(obj) if callable(obj) else repr(obj)
+        digest.update(text.encode('utf-8'))
+    return digest.hexdigest()
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {'cleaning_code_hash': None, 'files': {}}
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"  - Warning: Could not read manifest '{manifest_path}' ({e}). Doing a full import.")
+        return {'cleaning_code_hash': None, 'files': {}}
+    manifest.setdefault('files', {})
+    return manifest
+
+def save_manifest(manifest, manifest_path):
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+
+def file_state(file_path, previous=None):
+    """
+    Returns the manifest entry (sha256, size, mtime) of a workbook. When size
+    and mtime match the previous entry the stored hash is reused instead of
+    reading the file again.
+    """
+    stat = os.stat(file_path)
+    if previous and previous.get('size') == stat.st_size and previous.get('mtime') == stat.st_mtime:
+        sha256 = previous['sha256']
+    else:
+        sha256 = hash_file(file_path)
+    return {'sha256': sha256, 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+def unchanged_tables(files_by_table, states, manifest, code_hash, existing_tables):
+    """
+    Returns the tables whose workbooks all match the manifest, with no workbook
+    added or removed, built by the same cleaning code and still present in the database.
+    """
+    if manifest.get('cleaning_code_hash') != code_hash:
+        return set()
+
+    recorded_by_table = {}
+    for key, entry in manifest['files'].items():
+        recorded_by_table.setdefault(entry.get('table'), set()).add(key)
+
+    unchanged = set()
+    for table_name, keys in files_by_table.items():
+        if table_name not in existing_tables:
+            continue
+        if recorded_by_table.get(table_name, set()) != set(keys):
+            continue
+        if all(manifest['files'][key]['sha256'] == states[key]['sha256'] for key in keys):
+            unchanged.add(table_name)
+    return unchanged
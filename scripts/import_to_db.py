@@ -1,53 +1,134 @@
 import pandas as pd
 import os
 import glob
-from sqlalchemy import create_engine
+import sqlalchemy
 import re
+import io
+import sys
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from bulk_writer import bulk_write_table, create_indexes, to_sql_values
+from excel_cache import read_excel_cached
+from measurements import (
+    add_measurement_columns, infer_measurement_spec, measurement_columns, parse_unique_values, read_chain,
+    normalize_text, UNITS, MEASUREMENT_PATTERN, MIN_UNIT_RATIO, SIZE_SEPARATORS, SUM_SEPARATORS, AXES,
+)
+from database_connection import get_db_engine, get_table_names, CLUSTERS_TABLE, STATS_TABLE
+from near_duplicates import write_duplicate_clusters
+from aggregates import update_summaries
+from product_search import SEARCH_TABLE, search_index_exists, write_search_index
+from instrumentation import measure, add_records, start_run, finish_run, add_report_arguments
+from import_manifest import manifest_path_for, load_manifest, save_manifest, file_state, hash_source, unchanged_tables
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'dataset.db')
 
+PERSIAN_DIGITS_TABLE = str.maketrans('۰۱۲۳۴۵۶۷۸۹', '0123456789')
+UNIT_STRINGS = ["سانتی متر", "سانتی‌متر", "سانتیمتر", ",", "لیتر", "عدد"]
+UNIT_PATTERN = re.compile('|'.join(re.escape(unit) for unit in UNIT_STRINGS))
+NUMBER_PATTERN = r'(\d+\.?\d*)'
+NUMERIC_RATIO_THRESHOLD = 0.7
+
 def persian_to_english_numerals(text: str) -> str:
     if not isinstance(text, str):
         return str(text)
-    
-    persian_nums = '۰۱۲۳۴۵۶۷۸۹'
-    english_nums = '0123456789'
-    translation_table = str.maketrans(persian_nums, english_nums)
-    return text.translate(translation_table)
+    return text.translate(PERSIAN_DIGITS_TABLE)
 
 def extract_number_from_text(text: str) -> float:
     if not isinstance(text, str):
         return text
-    match = re.search(r'\d+\.?\d*', text)
+    match = re.search(NUMBER_PATTERN, text)
     if match:
         return float(match.group(0))
     return None
 
-def clean_dataframe(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
+def clean_text(value) -> str:
+    if not isinstance(value, str):
+        value = str(value)
+    return UNIT_PATTERN.sub('', value.translate(PERSIAN_DIGITS_TABLE)).strip()
 
-    for col in df.columns:
-        df[col] = df[col].apply(persian_to_english_numerals)
-        if df[col].dtype == 'object':
-            df[col] = df[col].str.replace("سانتی متر", "", regex=False)
-            df[col] = df[col].str.replace("سانتی‌متر", "", regex=False)
-            df[col] = df[col].str.replace("سانتیمتر", "", regex=False)
-            df[col] = df[col].str.replace(",", "", regex=False)
-            df[col] = df[col].str.replace("لیتر", "", regex=False)
-            df[col] = df[col].str.replace("عدد", "", regex=False)
-            df[col] = df[col].str.strip()
+def clean_text_column(series: pd.Series) -> pd.Series:
+    """
+    Converts a whole column to cleaned text. Columns of plain strings are
+    factorized so each distinct value is translated and unit-stripped only once.
+    """
+    values = series.to_numpy(dtype=object)
+
+    if pd.api.types.infer_dtype(values, skipna=True) in ('string', 'empty'):
+        codes, uniques = pd.factorize(values)
+        cleaned = np.array([clean_text(value) for value in uniques] + [None], dtype=object).take(codes)
+        null_mask = codes == -1
+        if null_mask.any():
+            cleaned[null_mask] = [clean_text(value) for value in values[null_mask]]
+    else:
+        # Mixed cells (e.g. 1 and 1.0) hash alike but print differently, so clean them one by one.
+        cleaned = np.array([clean_text(value) for value in values], dtype=object)
+
+    return pd.Series(cleaned, index=series.index, dtype=object, name=series.name)
+
+def recover_numeric_column(series: pd.Series, row_count: int, force=False):
+    """
+    Returns the numeric version of a cleaned text column when more than
+    NUMERIC_RATIO_THRESHOLD of it parses as numbers (or always, with force=True),
+    otherwise None. Cells that do not parse directly get the first number found in their text.
+    """
+    codes, uniques = pd.factorize(series.to_numpy(dtype=object))
+    unique_series = pd.Series(uniques, dtype=object)
+    numeric_uniques = pd.to_numeric(unique_series, errors='coerce')
+
+    if not force:
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        numeric_ratio = counts[numeric_uniques.notna().to_numpy()].sum() / row_count
+        if numeric_ratio <= NUMERIC_RATIO_THRESHOLD:
+            return None
+        print(f"  - Column '{series.name}' identified as numeric ({numeric_ratio:.0%}). Forcing conversion.")
+
+    mask = numeric_uniques.isna()
+    if mask.any():
+        numeric_uniques = numeric_uniques.astype(float)
+        numeric_uniques[mask] = unique_series[mask].str.extract(NUMBER_PATTERN, expand=False).astype(float)
+
+    if (codes == -1).any():
+        numeric_uniques = pd.concat([numeric_uniques.astype(float), pd.Series([np.nan])], ignore_index=True)
+    numeric_values = numeric_uniques.to_numpy().take(codes)
+    return pd.Series(numeric_values, index=series.index, name=series.name)
+
+def clean_dataframe(df: pd.DataFrame, numeric_columns=None) -> pd.DataFrame:
+    """
+    Cleans a raw sheet. Columns are typed as numeric when more than
+    NUMERIC_RATIO_THRESHOLD of their cells hold numbers. Passing numeric_columns
+    skips that inference and applies a known schema instead (used by the
+    streaming import to give every chunk the types of its first chunk).
+    """
+    row_count = len(df)
+    cleaned_columns = {}
 
     for col in df.columns:
-        numeric_series = pd.to_numeric(df[col], errors='coerce')
-        numeric_ratio = numeric_series.notna().sum() / len(df)
+        series = df[col]
+        is_numeric = pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
 
-        if numeric_ratio > 0.7:
-            print(f"  - Column '{col}' identified as numeric ({numeric_ratio:.0%}). Forcing conversion.")
-            mask = numeric_series.isna() & df[col].notna()
-            df.loc[mask, col] = df.loc[mask, col].apply(extract_number_from_text)
-            
-            df[col] = pd.to_numeric(df[col], errors='coerce')
+        if numeric_columns is not None:
+            if col in numeric_columns:
+                numeric_series = series if is_numeric else recover_numeric_column(clean_text_column(series), row_count, force=True)
+                cleaned_columns[col] = numeric_series
+            else:
+                cleaned_columns[col] = clean_text_column(series)
+        elif is_numeric:
+            # Numbers have no digits or units to clean, so only the type check is needed.
+            numeric_ratio = series.notna().sum() / row_count if row_count else 0
+            if numeric_ratio > NUMERIC_RATIO_THRESHOLD:
+                print(f"  - Column '{col}' identified as numeric ({numeric_ratio:.0%}). Forcing conversion.")
+                cleaned_columns[col] = series
+            else:
+                cleaned_columns[col] = clean_text_column(series)
+        else:
+            text_series = clean_text_column(series)
+            numeric_series = recover_numeric_column(text_series, row_count) if row_count else None
+            cleaned_columns[col] = numeric_series if numeric_series is not None else text_series
+
+    df = pd.DataFrame(cleaned_columns, index=df.index, columns=df.columns)
 
     if 'title' in df.columns:
         df.dropna(subset=['title'], inplace=True)
@@ -62,39 +143,364 @@ def find_excel_files(base_path):
     search_pattern = os.path.join(base_path, '**', '*.xlsx')
     return glob.glob(search_pattern, recursive=True)
 
-def import_data_to_db():
+def drop_duplicate_workbooks(excel_files, tables, hashes):
+    """
+    Category folders often hold the same workbook twice under different names
+    (e.g. Dishwasher.xlsx and its Persian-named copy). Keeps one file per
+    (category, content hash) so each is parsed only once. The last copy is the
+    one kept, because later files replace earlier ones in the same table.
+    Returns (files_to_keep, duplicates) where duplicates maps each dropped file to its kept twin.
+    """
+    kept = {}
+    for file_path in excel_files:
+        kept[(tables[file_path], hashes[file_path])] = file_path
+    keep = set(kept.values())
+    duplicates = {f: kept[(tables[f], hashes[f])] for f in excel_files if f not in keep}
+    return [f for f in excel_files if f in keep], duplicates
+
+def read_and_clean_file(file_path, sha256=None, use_cache=True):
+    """
+    Parses and cleans one category workbook. Used both by the serial loop and
+    by the process-pool workers, so the log lines are captured and returned
+    instead of printed, and errors are returned instead of raised.
+    Returns (table_name, cleaned_df, log, error).
+    """
+    table_name = os.path.basename(os.path.dirname(file_path))
+    log = io.StringIO()
+
+    try:
+        with contextlib.redirect_stdout(log):
+            df = read_excel_cached(file_path, sha256, use_cache, header=1)
+            print(f"  - Read {len(df)} rows and {len(df.columns)} columns.")
+
+            cleaned_df = clean_dataframe(df)
+            cleaned_df, _ = add_measurement_columns(cleaned_df, df)
+            print(f"  - After cleaning, {len(cleaned_df)} rows remain.")
+        return table_name, cleaned_df, log.getvalue(), None
+    except Exception as e:
+        return table_name, None, log.getvalue(), str(e)
+
+def measured_clean_file(file_path, sha256=None, use_cache=True):
+    """
+    read_and_clean_file, measured as a 'clean' record of the run report.
+    Returns its result followed by the list of records, which the caller adds
+    to the run (the cleaning may run in a worker process).
+    """
+    records = []
+    table_name = os.path.basename(os.path.dirname(file_path))
+    with measure('clean', table_name, records=records) as record:
+        result = read_and_clean_file(file_path, sha256, use_cache)
+        cleaned_df = result[1]
+        record.update(rows_out=None if cleaned_df is None else len(cleaned_df),
+                      status='ok' if result[3] is None else 'failed', error=result[3])
+        record['details']['workbook_bytes'] = os.path.getsize(file_path)
+    return result + (records,)
+
+def iter_cleaned_files(excel_files, workers, hashes=None, use_cache=True):
+    """
+    Yields measured_clean_file results in the order of excel_files. With more
+    than one worker the files are parsed in a process pool; results are still
+    yielded in file order so the single writer behaves exactly like the serial path.
+    """
+    hashes = hashes or {}
+    if workers <= 1 or len(excel_files) <= 1:
+        for file_path in excel_files:
+            yield measured_clean_file(file_path, hashes.get(file_path), use_cache)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(excel_files))) as executor:
+        futures = [
+            executor.submit(measured_clean_file, file_path, hashes.get(file_path), use_cache)
+            for file_path in excel_files
+        ]
+        for file_path, future in zip(excel_files, futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                # The worker itself died (e.g. out of memory) rather than the parsing failing.
+                yield os.path.basename(os.path.dirname(file_path)), None, "", f"worker failed: {e}", []
+
+def row_key_column(df: pd.DataFrame):
+    """
+    The column that identifies a row, using the same preference as the
+    de-duplication in clean_dataframe.
+    """
+    for key in ('title', 'id'):
+        if key in df.columns:
+            return key
+    return None
+
+def upsert_table(table_name, df: pd.DataFrame, engine, key):
+    """
+    Synchronises an existing table with df row by row: rows whose key is no
+    longer present are deleted and the rest are inserted or updated in place.
+    Returns (upserted, deleted), or None when the stored table has different
+    columns and has to be rebuilt instead.
+    """
+    columns = list(df.columns)
+    quoted_columns = ', '.join(f'"{col}"' for col in columns)
+    placeholders = ', '.join('?' for _ in columns)
+    updates = ', '.join(f'"{col}" = excluded."{col}"' for col in columns if col != key)
+    conflict_action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+
+    with engine.begin() as conn:
+        existing_columns = [row[1] for row in conn.exec_driver_sql(f'PRAGMA table_info("{table_name}")')]
+        if existing_columns != columns:
+            return None
+
+        conn.exec_driver_sql(
+            f'CREATE UNIQUE INDEX IF NOT EXISTS "ux_{table_name}_{key}" ON "{table_name}" ("{key}")'
+        )
+
+        conn.exec_driver_sql('CREATE TEMP TABLE IF NOT EXISTS import_keys (row_key PRIMARY KEY)')
+        conn.exec_driver_sql('DELETE FROM import_keys')
+        conn.exec_driver_sql('INSERT INTO import_keys (row_key) VALUES (?)', list(to_sql_values(df[[key]])))
+        deleted = conn.exec_driver_sql(
+            f'DELETE FROM "{table_name}" WHERE "{key}" NOT IN (SELECT row_key FROM import_keys)'
+        ).rowcount
+        conn.exec_driver_sql('DROP TABLE import_keys')
+
+        conn.exec_driver_sql(
+            f'INSERT INTO "{table_name}" ({quoted_columns}) VALUES ({placeholders}) '
+            f'ON CONFLICT("{key}") {conflict_action}',
+            list(to_sql_values(df))
+        )
+        create_indexes(conn.connection.driver_connection, table_name, columns)
+
+    return len(df), deleted
+
+def write_category_table(table_name, df: pd.DataFrame, engine, existing_tables, incremental):
+    key = row_key_column(df)
+    if incremental and key is not None and table_name in existing_tables:
+        try:
+            result = upsert_table(table_name, df, engine, key)
+        except sqlalchemy.exc.IntegrityError:
+            # Old table still holds duplicate keys, so it cannot get a unique index.
+            result = None
+        if result is not None:
+            upserted, deleted = result
+            print(f"  - ✅ Upserted {upserted} rows into '{table_name}' (keyed on '{key}'), removed {deleted} stale rows.")
+            return
+
+    indexed = bulk_write_table(df, table_name, engine)
+    existing_tables.add(table_name)
+    print(f"  - ✅ Successfully created/replaced table '{table_name}' in the database (indexed: {indexed}).")
+
+def cleaning_code_hash():
+    return hash_source([
+        read_and_clean_file, clean_dataframe, clean_text_column, recover_numeric_column, clean_text,
+        UNIT_STRINGS, NUMBER_PATTERN, NUMERIC_RATIO_THRESHOLD, PERSIAN_DIGITS_TABLE,
+        add_measurement_columns, infer_measurement_spec, measurement_columns, parse_unique_values, read_chain,
+        normalize_text, UNITS, MEASUREMENT_PATTERN.pattern, MIN_UNIT_RATIO, SIZE_SEPARATORS, SUM_SEPARATORS, AXES,
+    ])
+
+def import_data_to_db(workers=1, db_path=DB_PATH, incremental=True, use_cache=True,
+                      chunk_size=None, on_type_mismatch='coerce'):
+    """
+    Imports every category workbook into the database. workers > 1 parses and
+    cleans the workbooks in a process pool while this process remains the only
+    writer.
+
+    With incremental=True a manifest of workbook hashes (plus a hash of the
+    cleaning code) is kept next to the database: categories whose workbooks
+    are unchanged are skipped, and changed categories are upserted row by row
+    when they have a 'title'/'id' key. incremental=False rebuilds every table.
+
+    Byte-identical workbooks within a category are parsed once, and with
+    use_cache=True each parsed sheet is kept as a Parquet sidecar beside its
+    workbook (see excel_cache.read_excel_cached).
+
+    With chunk_size set, workbooks are streamed instead: rows are read, cleaned
+    and inserted chunk_size at a time so memory does not grow with the sheet
+    (see streaming_import.stream_import_file for the typing rules and the
+    on_type_mismatch policy). Streaming always rebuilds tables and ignores workers.
+
+    Whenever a table was written, near-duplicate products are clustered again
+    across the whole database (see near_duplicates.write_duplicate_clusters)
+    and the full-text search index is rebuilt (see product_search.write_search_index).
+    The per-category summaries are recomputed for the categories written
+    only (see aggregates.update_summaries).
+
+    Returns a dict of {table_name: error message} for failed categories.
+    """
     excel_files = find_excel_files(DATA_DIR)
     if not excel_files:
         print(f"Error: No Excel files found in '{DATA_DIR}'")
-        return
+        return {}
+
+    engine = get_db_engine(db_path, read_only=False)
+    existing_tables = set(get_table_names(db_path))
+    errors = {}
 
-    engine = create_engine(f'sqlite:///{DB_PATH}')
-    
-    print("Starting data import process...")
-    
+    manifest_path = manifest_path_for(db_path)
+    manifest = load_manifest(manifest_path) if incremental else {'files': {}}
+    code_hash = cleaning_code_hash()
+
+    keys = {file_path: os.path.relpath(file_path, DATA_DIR) for file_path in excel_files}
+    tables = {file_path: os.path.basename(os.path.dirname(file_path)) for file_path in excel_files}
+    states = {keys[f]: file_state(f, manifest['files'].get(keys[f])) for f in excel_files}
+    files_by_table = {}
     for file_path in excel_files:
-        table_name = os.path.basename(os.path.dirname(file_path))
-        print(f"\nProcessing category: {table_name}")
-        
-        try:
-            df = pd.read_excel(file_path, header=1)
-            
-            print(f"  - Read {len(df)} rows and {len(df.columns)} columns.")
-            
-            cleaned_df = clean_dataframe(df)
-            print(f"  - After cleaning, {len(cleaned_df)} rows remain.")
+        files_by_table.setdefault(tables[file_path], []).append(keys[file_path])
+
+    skipped = set()
+    if incremental:
+        skipped = unchanged_tables(files_by_table, states, manifest, code_hash, existing_tables)
+    hashes = {f: states[keys[f]]['sha256'] for f in excel_files}
+    files_to_import, duplicates = drop_duplicate_workbooks(
+        [f for f in excel_files if tables[f] not in skipped], tables, hashes
+    )
+
+    if chunk_size:
+        mode = f"streaming, chunks of {chunk_size} rows"
+    else:
+        mode = f"parallel, {workers} workers" if workers > 1 else "serial"
+    print(f"Starting data import process ({mode})...")
+    if skipped:
+        print(f"  - Skipping {len(skipped)} unchanged categories: {sorted(skipped)}")
+    if duplicates:
+        print(f"  - Ignoring {len(duplicates)} duplicate workbooks:")
+        for duplicate, original in duplicates.items():
+            print(f"    - {keys[duplicate]} (same content as {keys[original]})")
+
+    failed_tables = set()
+    if chunk_size:
+        # streaming_import builds on this module, so it can only be imported once this one is loaded.
+        from streaming_import import stream_import_file
+
+        for file_path in files_to_import:
+            table_name = tables[file_path]
+            print(f"\nProcessing category: {table_name}")
+            try:
+                with measure('import', table_name) as record:
+                    stream_import_file(file_path, table_name, engine, chunk_size, on_type_mismatch)
+                    record['details'].update(chunk_size=chunk_size, workbook_bytes=os.path.getsize(file_path))
+                existing_tables.add(table_name)
+            except Exception as e:
+                print(f"  - ❌ Error processing file for '{table_name}': {e}")
+                errors[table_name] = str(e)
+                failed_tables.add(table_name)
+    else:
+        for table_name, cleaned_df, log, error, records in iter_cleaned_files(files_to_import, workers, hashes, use_cache):
+            add_records(records)
+            print(f"\nProcessing category: {table_name}")
+            print(log, end='')
+
+            if error is not None:
+                print(f"  - ❌ Error processing file for '{table_name}': {error}")
+                errors[table_name] = error
+                failed_tables.add(table_name)
+                continue
 
             if cleaned_df.empty:
                 print(f"  - Warning: No data left for '{table_name}' after cleaning. Skipping.")
                 continue
 
-            cleaned_df.to_sql(table_name, engine, if_exists='replace', index=False)
-            print(f"  - ✅ Successfully created/replaced table '{table_name}' in the database.")
+            try:
+                with measure('write', table_name, rows_in=len(cleaned_df)) as record:
+                    write_category_table(table_name, cleaned_df, engine, existing_tables, incremental)
+                    record['rows_out'] = len(cleaned_df)
+            except Exception as e:
+                print(f"  - ❌ Error processing file for '{table_name}': {e}")
+                errors[table_name] = str(e)
+                failed_tables.add(table_name)
+
+    if files_to_import or CLUSTERS_TABLE not in existing_tables:
+        print("\nFinding near-duplicate products...")
+        try:
+            with measure('clusters'):
+                write_duplicate_clusters(db_path)
+        except Exception as e:
+            print(f"  - ❌ Error writing '{CLUSTERS_TABLE}': {e}")
+            errors[CLUSTERS_TABLE] = str(e)
+
+    if files_to_import or not search_index_exists(db_path):
+        print("\nBuilding the product search index...")
+        try:
+            with measure('search_index') as record:
+                record['rows_out'] = write_search_index(db_path)
+        except Exception as e:
+            print(f"  - ❌ Error writing '{SEARCH_TABLE}': {e}")
+            errors[SEARCH_TABLE] = str(e)
 
+    written = {tables[f] for f in files_to_import} - failed_tables
+    if written or STATS_TABLE not in existing_tables:
+        print("\nUpdating the category summaries...")
+        try:
+            with measure('summaries') as record:
+                summarized = update_summaries(db_path, None if STATS_TABLE not in existing_tables else written)
+                record['details']['categories'] = summarized
+            print(f"  - Summaries of {len(summarized)} categories updated.")
         except Exception as e:
-            print(f"  - ❌ Error processing file for '{table_name}': {e}")
+            print(f"  - ❌ Error writing '{STATS_TABLE}': {e}")
+            errors[STATS_TABLE] = str(e)
+
+    # Failed categories keep their old entries (or none), so the next run retries them.
+    new_files = {}
+    for file_path in excel_files:
+        key, table_name = keys[file_path], tables[file_path]
+        if table_name in failed_tables:
+            if key in manifest['files']:
+                new_files[key] = manifest['files'][key]
+            continue
+        new_files[key] = dict(states[key], table=table_name)
+    save_manifest({'cleaning_code_hash': code_hash, 'files': new_files}, manifest_path)
+
+    if errors:
+        print(f"\n❌ {len(errors)} categories failed:")
+        for table_name, error in errors.items():
+            print(f"  - {table_name}: {error}")
 
     print("\nData import process finished.")
+    return errors
+
+def main():
+    parser = argparse.ArgumentParser(description="Import the category workbooks into the SQLite database.")
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help="Number of worker processes that parse and clean workbooks (1 = serial, 0 = one per CPU)."
+    )
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        help="Ignore the import manifest and rebuild every table from its workbook."
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help="Always parse the workbooks instead of reading their Parquet sidecar copies."
+    )
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=None,
+        help="Stream each workbook in chunks of this many rows to keep memory flat on very large sheets."
+    )
+    parser.add_argument(
+        '--on-type-mismatch',
+        choices=['coerce', 'raise'],
+        default='coerce',
+        help="In streaming mode, what to do when a later row has text in a column typed numeric from the first chunk."
+    )
+    add_report_arguments(parser, ['import', 'clean', 'write', 'clusters', 'search_index', 'summaries'])
+
+    args = parser.parse_args()
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    start_run('import_to_db', args.profile)
+
+    with measure('import'):
+        errors = import_data_to_db(
+            workers=workers,
+            incremental=not args.full,
+            use_cache=not args.no_cache,
+            chunk_size=args.chunk_size,
+            on_type_mismatch=args.on_type_mismatch,
+        )
+    finish_run(args)
+    if errors:
+        sys.exit(1)
 
 if __name__ == '__main__':
-    import_data_to_db()
\ No newline at end of file
+    main()
@@ -0,0 +1,323 @@
+import io
+import os
+import math
+import time
+import joblib
+import contextlib
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+from sklearn.base import clone
+from sklearn.model_selection import KFold
+
+from train_model import BEST_MODELS, ESTIMATORS, MODELS_DIR, TASKS, model_spec_hash, task_matrices, train_task_model
+from preprocess import RAW_DIR, find_raw_files, read_raw_file, load_preprocessor, preprocessor_path, transform_dataframe
+from feature_engineering import feature_engineer_dataframe
+from stage_cache import CACHE_DIR
+from import_manifest import hash_file
+from instrumentation import measure
+
+# What an incremental run knows about each model it trained: the rows it
+# saw and the statistics the checks and the linear update need.
+# Incremental runs build their features from the raw export (staging/01_raw)
+# with the category's saved preprocessor, never a refit one: refitting the
+# fill values, classes and scaling on the grown table would move the
+# features of every old row, leaving no row the models have already seen.
+STATE_DIR = os.path.join(CACHE_DIR, 'incremental')
+
+# The checks that send an ensemble back to a full refit instead of an update.
+# The new rows may be at most MAX_NEW_SHARE of the rows the model has seen;
+# an ensemble may grow to MAX_GROWTH times its configured trees (or boosting
+# rounds) before it is rebuilt at its configured size.
+MAX_NEW_SHARE = 0.5
+MAX_GROWTH = 2.0
+# With at least MIN_CHECK_ROWS new rows, a feature drifts when the new rows'
+# mean lies more than DRIFT_Z standard errors from the training mean, and
+# the model has gone stale when its error on the new rows (before the
+# update) is more than ACCURACY_TOLERANCE times its cross-validated error
+# at the last refit, measured on REFERENCE_FOLDS folds.
+MIN_CHECK_ROWS = 10
+DRIFT_Z = 4.0
+ACCURACY_TOLERANCE = 1.5
+REFERENCE_FOLDS = 3
+
+# The outcome for one model: 'unchanged', 'updated', 'refit' or 'skipped',
+# why it was refit, the rows it had not seen and the seconds it took.
+IncrementalResult = namedtuple('IncrementalResult', ['action', 'reason', 'new_rows', 'seconds'])
+
+def state_path(category_name, task_name):
+    return os.path.join(STATE_DIR, f"{category_name}_{task_name}.joblib")
+
+def estimator_name(model):
+    return next((name for name, estimator in ESTIMATORS.items() if isinstance(model, estimator)), None)
+
+def row_keys(X: pd.DataFrame, y: pd.Series) -> pd.MultiIndex:
+    """
+    One key per training row: the hash of its features and target, and how
+    many identical rows came before it, so duplicated rows count separately.
+    """
+    hashes = pd.util.hash_pandas_object(pd.concat([X, y], axis=1), index=False).to_numpy()
+    return pd.MultiIndex.from_arrays([hashes, pd.Series(hashes).groupby(hashes).cumcount().to_numpy()])
+
+def rmse(y: pd.Series, predictions) -> float:
+    return float(np.sqrt(np.mean((y.to_numpy() - predictions) ** 2)))
+
+def reference_rmse(model, X: pd.DataFrame, y: pd.Series):
+    """
+    The cross-validated RMSE of an unfitted model on REFERENCE_FOLDS folds,
+    or None with too few rows.
+    """
+    if len(X) < REFERENCE_FOLDS:
+        return None
+    folds = KFold(n_splits=REFERENCE_FOLDS, shuffle=True, random_state=42)
+    return float(np.mean([rmse(y.iloc[test], clone(model).fit(X.iloc[train], y.iloc[train]).predict(X.iloc[test]))
+                          for train, test in folds.split(X)]))
+
+def normal_equations(X: pd.DataFrame, y: pd.Series) -> dict:
+    """
+    The sums a least-squares fit is solved from: XᵀX, Xᵀy, the column sums,
+    the target sum and the row count. They add up over batches of rows.
+    """
+    values = X.to_numpy(dtype=np.float64)
+    target = y.to_numpy(dtype=np.float64)
+    return {'gram': values.T @ values, 'moments': values.T @ target, 'sums': values.sum(axis=0),
+            'target_sum': float(target.sum()), 'rows': len(values)}
+
+def add_normal_equations(totals: dict, batch: dict) -> dict:
+    return {key: totals[key] + batch[key] for key in totals}
+
+def solve_linear(model, sums: dict):
+    """
+    Sets a LinearRegression's coefficients to the least-squares solution of
+    the accumulated normal equations, as fit() on all of their rows would:
+    with an intercept the system is centered, and directions whose singular
+    value is below fit()'s relative cutoff (LinearRegression.tol) are
+    dropped, taking the minimum-norm solution.
+    """
+    rows = sums['rows']
+    gram, moments = sums['gram'], sums['moments']
+    if model.fit_intercept:
+        means, target_mean = sums['sums'] / rows, sums['target_sum'] / rows
+        gram = gram - rows * np.outer(means, means)
+        moments = moments - rows * means * target_mean
+    # The eigenvalues of XᵀX are the squared singular values of X.
+    eigenvalues, eigenvectors = np.linalg.eigh(gram)
+    singular = np.sqrt(np.clip(eigenvalues, 0, None))
+    cutoff = getattr(model, 'tol', max(rows, len(gram)) * np.finfo(np.float64).eps)
+    kept = singular > cutoff * singular.max() if len(singular) else np.zeros(0, dtype=bool)
+    basis = eigenvectors[:, kept]
+    model.coef_ = basis @ ((basis.T @ moments) / eigenvalues[kept])
+    model.intercept_ = float(target_mean - means @ model.coef_) if model.fit_intercept else 0.0
+    model.singular_ = singular[::-1]
+    model.rank_ = int(kept.sum())
+    return model
+
+def incremental_features(raw: pd.DataFrame, category_name):
+    """
+    The final data of a category for an incremental run: its raw rows
+    transformed with the saved preprocessor (no refitting) and its features
+    engineered. Returns (final DataFrame, the preprocessor file's sha256),
+    or None when the category has no saved preprocessor.
+    """
+    state = load_preprocessor(category_name)
+    if state is None:
+        return None
+    with contextlib.redirect_stdout(io.StringIO()):
+        df = feature_engineer_dataframe(transform_dataframe(raw, state), category_name)
+    return df, hash_file(preprocessor_path(category_name))
+
+def training_state(model, model_path, category_name, X: pd.DataFrame, y: pd.Series, keys, reference, preprocessor,
+                   updates=0, linear=None) -> dict:
+    if linear is None and estimator_name(model) == 'linear':
+        linear = normal_equations(X, y)
+    return {
+        'model_sha256': hash_file(model_path),
+        'preprocessor_sha256': preprocessor,
+        'spec': model_spec_hash(category_name),
+        'columns': X.columns.tolist(),
+        'keys': keys,
+        'means': X.mean().to_numpy(dtype=np.float64),
+        'stds': X.std(ddof=0).to_numpy(dtype=np.float64),
+        'reference_rmse': reference,
+        'updates': updates,
+        'linear': linear,
+    }
+
+def save_state(state, category_name, task_name):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    path = state_path(category_name, task_name)
+    joblib.dump(state, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+def refit_reason(state, model_path, category_name, X: pd.DataFrame, keys, preprocessor):
+    """
+    Why the saved model cannot be updated in place, checked before its new
+    rows are known: no state, a model, preprocessor or spec changed behind
+    the state's back (a refit preprocessor moves the features of every row),
+    other features, or training rows that changed or were removed. None when
+    the old rows are all still there.
+    """
+    if state is None:
+        return "no training state"
+    if not os.path.exists(model_path) or hash_file(model_path) != state['model_sha256']:
+        return "the saved model was replaced"
+    if preprocessor != state['preprocessor_sha256']:
+        return "the preprocessor was refit"
+    if state['spec'] != model_spec_hash(category_name):
+        return "the model spec changed"
+    if X.columns.tolist() != state['columns']:
+        return "the features changed"
+    missing = len(state['keys']) - state['keys'].isin(keys).sum()
+    if missing:
+        return f"{missing} training rows changed or were removed"
+    return None
+
+def drift_reason(state, model, X_new: pd.DataFrame, y_new: pd.Series, configured):
+    """
+    Why an ensemble should be refit rather than grown: too many new rows,
+    too many trees, drifted features or too large an error on the new rows.
+    Returns (reason or None, RMSE on the new rows, extra trees or rounds).
+    """
+    seen = len(state['keys'])
+    error = rmse(y_new, model.predict(X_new))
+    extra = max(1, math.ceil(configured * len(X_new) / seen))
+    trees = len(model.estimators_) if hasattr(model, 'estimators_') else model.get_booster().num_boosted_rounds()
+    if len(X_new) > MAX_NEW_SHARE * seen:
+        return f"{len(X_new)} new rows on {seen} seen", error, extra
+    if trees + extra > MAX_GROWTH * configured:
+        return f"{trees + extra} trees would exceed {MAX_GROWTH:g}x the configured {configured}", error, extra
+    if len(X_new) >= MIN_CHECK_ROWS:
+        z = np.abs(X_new.mean().to_numpy() - state['means']) / np.where(state['stds'] > 0, state['stds'], np.inf)
+        z *= math.sqrt(len(X_new))
+        if z.max() > DRIFT_Z:
+            return f"'{X_new.columns[z.argmax()]}' drifted ({z.max():.1f} standard errors)", error, extra
+        if state['reference_rmse'] and error > ACCURACY_TOLERANCE * state['reference_rmse']:
+            return (f"RMSE on the new rows {error:,.3f} is {error / state['reference_rmse']:.2f}x "
+                    f"the cross-validated {state['reference_rmse']:,.3f}"), error, extra
+    return None, error, extra
+
+def grow_model(model, configured_model, X: pd.DataFrame, y: pd.Series, extra):
+    """
+    Adds extra trees to a fitted ensemble, trained on all rows: a random
+    forest grows through warm_start, XGBoost continues boosting from the
+    saved booster.
+    """
+    if estimator_name(model) == 'random_forest':
+        model.set_params(warm_start=True, n_estimators=len(model.estimators_) + extra)
+        model.fit(X, y)
+        model.set_params(warm_start=False)
+        return model
+    grown = clone(configured_model).set_params(n_estimators=extra)
+    grown.fit(X, y, xgb_model=model.get_booster())
+    return grown
+
+def refit(category_name, task_name, df: pd.DataFrame, X: pd.DataFrame, y: pd.Series, keys, preprocessor):
+    """
+    Trains the model from scratch (train_task_model) and records its training
+    state with a fresh reference error.
+    """
+    model_file = train_task_model(df, category_name, task_name, quiet=True)
+    model_path = os.path.join(MODELS_DIR, model_file)
+    model = joblib.load(model_path)
+    reference = reference_rmse(BEST_MODELS[category_name][task_name], X, y)
+    save_state(training_state(model, model_path, category_name, X, y, keys, reference, preprocessor),
+               category_name, task_name)
+
+def update_task_model(df: pd.DataFrame, category_name, task_name, preprocessor, force=False) -> IncrementalResult:
+    """
+    Brings one saved model up to date with its category's final data from
+    incremental_features (preprocessor is the hash it returned). Rows
+    the model has not seen are added without a full refit where possible:
+    a linear model is re-solved in closed form from its accumulated normal
+    equations (exactly what a refit would give), a random forest gets new
+    trees through warm_start and XGBoost continues boosting from the saved
+    booster. The ensembles are refit instead when drift_reason objects, and
+    every model is when refit_reason does or force=True.
+    """
+    start = time.perf_counter()
+    configured = BEST_MODELS.get(category_name, {}).get(task_name)
+    matrices = task_matrices(df, task_name)
+    if configured is None or matrices is None or matrices[0].empty:
+        return IncrementalResult('skipped', None, 0, 0.0)
+    X, y = matrices
+    keys = row_keys(X, y)
+    model_file = f"{category_name}_{task_name}_model.joblib"
+    model_path = os.path.join(MODELS_DIR, model_file)
+
+    path = state_path(category_name, task_name)
+    state = joblib.load(path) if os.path.exists(path) else None
+    reason = "--force" if force else refit_reason(state, model_path, category_name, X, keys, preprocessor)
+    if reason is None and estimator_name(configured) not in ('linear', 'random_forest', 'xgboost'):
+        reason = f"no incremental update for {type(configured).__name__}"
+    if reason is None and estimator_name(configured) == 'linear' and configured.positive:
+        reason = "no closed-form update with positive=True"
+    if reason is not None:
+        refit(category_name, task_name, df, X, y, keys, preprocessor)
+        return IncrementalResult('refit', reason, len(X), time.perf_counter() - start)
+
+    new = ~keys.isin(state['keys'])
+    if not new.any():
+        return IncrementalResult('unchanged', None, 0, time.perf_counter() - start)
+    X_new, y_new = X[new], y[new]
+    model = joblib.load(model_path)
+
+    linear = None
+    if estimator_name(model) == 'linear':
+        linear = add_normal_equations(state['linear'], normal_equations(X_new, y_new))
+        model = solve_linear(model, linear)
+    else:
+        configured_trees = configured.get_params()['n_estimators'] or 100
+        reason, _, extra = drift_reason(state, model, X_new, y_new, configured_trees)
+        if reason is not None:
+            refit(category_name, task_name, df, X, y, keys, preprocessor)
+            return IncrementalResult('refit', reason, int(new.sum()), time.perf_counter() - start)
+        model = grow_model(model, configured, X, y, extra)
+
+    joblib.dump(model, model_path)
+    save_state(training_state(model, model_path, category_name, X, y, keys, state['reference_rmse'], preprocessor,
+                              state['updates'] + 1, linear), category_name, task_name)
+    return IncrementalResult('updated', None, int(new.sum()), time.perf_counter() - start)
+
+def train_incremental(tables=None, force=False) -> dict:
+    """
+    update_task_model for every category and task. tables maps category
+    names to raw tables (DataFrames or files); by default the raw export in
+    staging/01_raw is read. A category without a saved preprocessor is
+    skipped: it needs the regular pipeline first.
+    Returns {(category, task): IncrementalResult}.
+    """
+    print(f"{'#'*20} Incremental Training of All Models {'#'*20}")
+    if tables is None:
+        tables = {os.path.splitext(os.path.basename(path))[0]: path for path in find_raw_files(RAW_DIR)}
+    if not tables:
+        print("  - ERROR: No raw data files found. Please run load_data.py first.")
+        return {}
+
+    results = {}
+    for category_name, data in tables.items():
+        raw = read_raw_file(data) if isinstance(data, str) else data
+        prepared = incremental_features(raw, category_name)
+        if prepared is None:
+            print(f"  - {category_name}: no saved preprocessor; run the pipeline before training incrementally.")
+            continue
+        df, preprocessor = prepared
+        for task_name in TASKS:
+            with measure('train', category_name, rows_in=len(df)) as record:
+                result = update_task_model(df, category_name, task_name, preprocessor, force)
+                record['details'].update(task=task_name, mode='incremental', action=result.action,
+                                         reason=result.reason, new_rows=result.new_rows)
+            if result.action == 'skipped':
+                continue
+            results[(category_name, task_name)] = result
+            if result.action == 'updated':
+                print(f"  - ✅ {category_name} / {task_name}: updated with {result.new_rows} new rows "
+                      f"in {result.seconds:.2f}s.")
+            elif result.action == 'refit':
+                print(f"  - ✅ {category_name} / {task_name}: refit ({result.reason}) in {result.seconds:.2f}s.")
+            else:
+                print(f"  - {category_name} / {task_name}: no new rows; keeping the saved model.")
+
+    counts = pd.Series([result.action for result in results.values()]).value_counts()
+    print(f"\n  - {counts.get('updated', 0)} models updated, {counts.get('refit', 0)} refit, "
+          f"{counts.get('unchanged', 0)} unchanged.")
+    return results
@@ -0,0 +1,197 @@
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import platform
+import threading
+from io import StringIO
+from datetime import datetime, timezone
+from contextlib import contextmanager
+
+from memory_usage import reset_peak_rss, peak_rss_mb
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPORTS_DIR = os.path.join(PROJECT_ROOT, 'reports')
+# Functions listed in the report's summary of a profiled stage; the full
+# profile is saved beside the report for pstats or snakeviz.
+PROFILE_TOP = 25
+
+_records = []
+_run = {'name': None, 'started': None, 'profile': None, 'profiled': False}
+_lock = threading.Lock()
+_local = threading.local()
+
+def io_counters(per_thread=False):
+    """
+    (bytes read, bytes written) by this process, or this thread, so far:
+    everything passed to read/write calls, page cache included. None where
+    /proc is not available.
+    """
+    path = '/proc/thread-self/io' if per_thread else '/proc/self/io'
+    try:
+        with open(path, 'r') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def start_run(name, profile=None):
+    """
+    Starts a new run report: clears the records and, with profile set to a
+    stage name, has the first measure() of that stage run under cProfile.
+    """
+    with _lock:
+        _records.clear()
+        _run.update(name=name, started=time.time(), profile=profile, profiled=False)
+
+def add_records(records):
+    """
+    Adds records measured elsewhere, e.g. in a worker process, to the run.
+    """
+    with _lock:
+        _records.extend(records)
+
+def take_records():
+    """
+    Returns the records so far and clears them (used by worker processes to
+    hand their records to the parent).
+    """
+    with _lock:
+        records = list(_records)
+        _records.clear()
+    return records
+
+@contextmanager
+def measure(stage, category=None, rows_in=None, per_thread=False, records=None):
+    """
+    Measures the block as one record of the run report: wall and CPU time,
+    peak RSS, bytes read and written, and rows in and out. Yields the record
+    (a dict) so the block can fill in rows_out or details, or replace the
+    byte counts with exact ones it knows.
+
+    Records nest: a stage measured per category inside a measured stage
+    gives one record per category plus one for the whole stage. Blocks run
+    concurrently in threads pass per_thread=True: their CPU time and I/O are
+    the thread's own, and their peak RSS is the process's. With records
+    given, the record is appended to that list instead of the run.
+    """
+    record = {
+        'stage': stage, 'category': category,
+        'wall_seconds': None, 'cpu_seconds': None, 'peak_rss_mb': None,
+        'rows_in': rows_in, 'rows_out': None, 'bytes_read': None, 'bytes_written': None,
+        'status': 'ok', 'error': None, 'details': {},
+    }
+    stack = _local.__dict__.setdefault('stack', [])
+    if not per_thread:
+        # Peak RSS can only be reset for the whole process: fold the peak so
+        # far into the enclosing records first.
+        peak = peak_rss_mb()
+        for parent in stack:
+            parent['peak_rss_mb'] = max(parent['peak_rss_mb'] or 0.0, peak)
+        reset_peak_rss()
+
+    profiler = None
+    with _lock:
+        if _run['profile'] == stage and not _run.get('profiled'):
+            _run['profiled'] = True
+            profiler = cProfile.Profile()
+
+    stack.append(record)
+    io_start = io_counters(per_thread)
+    cpu_clock = time.thread_time if per_thread else time.process_time
+    cpu_start, wall_start = cpu_clock(), time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield record
+    except BaseException as e:
+        record.update(status='failed', error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+        record['wall_seconds'] = time.perf_counter() - wall_start
+        record['cpu_seconds'] = cpu_clock() - cpu_start
+        io_end = io_counters(per_thread)
+        if io_start and io_end:
+            if record['bytes_read'] is None:
+                record['bytes_read'] = io_end[0] - io_start[0]
+            if record['bytes_written'] is None:
+                record['bytes_written'] = io_end[1] - io_start[1]
+        stack.pop()
+        record['peak_rss_mb'] = max(record['peak_rss_mb'] or 0.0, peak_rss_mb())
+        for parent in stack:
+            parent['peak_rss_mb'] = max(parent['peak_rss_mb'] or 0.0, record['peak_rss_mb'])
+        if profiler:
+            record['details']['profile'] = save_profile(profiler, stage)
+        if records is not None:
+            records.append(record)
+        else:
+            with _lock:
+                _records.append(record)
+
+def record_skip(stage, reason):
+    """
+    Records a stage that did not run, e.g. for lack of input, so the run
+    report of an early exit still says what happened.
+    """
+    with measure(stage) as record:
+        record.update(status='skipped', error=reason)
+
+def save_profile(profiler, stage):
+    """
+    Saves a stage's profile beside the run reports and returns its path and
+    the PROFILE_TOP functions by cumulative time, as pstats prints them.
+    """
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    path = os.path.join(REPORTS_DIR, f"{_run['name'] or 'run'}-{time.strftime('%Y%m%d-%H%M%S')}-{stage}.prof")
+    profiler.dump_stats(path)
+    text = StringIO()
+    pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(PROFILE_TOP)
+    return {'path': os.path.relpath(path, PROJECT_ROOT), 'top': text.getvalue().strip().splitlines()}
+
+def build_report():
+    started = _run['started'] or time.time()
+    with _lock:
+        records = list(_records)
+    return {
+        'run': _run['name'],
+        'started_at': datetime.fromtimestamp(started, timezone.utc).isoformat(),
+        'wall_seconds': time.time() - started,
+        'argv': sys.argv,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'records': records,
+    }
+
+def write_report(path=None):
+    """
+    Writes the run report as JSON, by default to
+    reports/<run>-<timestamp>.json. Returns the path.
+    """
+    if path is None:
+        os.makedirs(REPORTS_DIR, exist_ok=True)
+        path = os.path.join(REPORTS_DIR, f"{_run['name'] or 'run'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(build_report(), f, ensure_ascii=False, indent=2, default=str)
+    os.replace(temp_path, path)
+    return path
+
+def add_report_arguments(parser, stages=()):
+    """
+    Adds --report and, when there are stages this process runs itself, --profile.
+    """
+    parser.add_argument('--report', metavar='PATH',
+                        help="Where to write the JSON run report (default: reports/<script>-<time>.json).")
+    if stages:
+        parser.add_argument('--profile', choices=stages, metavar='STAGE',
+                            help=f"Run this stage under cProfile and attach the profile to the report ({', '.join(stages)}).")
+
+def finish_run(args):
+    path = write_report(args.report)
+    print(f"  - Run report written to '{args.report or os.path.relpath(path, PROJECT_ROOT)}'.")
+    return path
@@ -1,46 +1,244 @@
 import pandas as pd
-from database_connection import get_db_engine 
+from database_connection import (
+    DB_PATH, CLUSTERS_TABLE, NA_STRINGS, get_db_engine, get_schema_catalog, get_column_types, get_category_tables,
+)
 import os
 import sys
-import sqlite3
+import time
+import argparse
+import sqlalchemy
+from concurrent.futures import ThreadPoolExecutor
+from near_duplicates import exclude_duplicates_sql
+from memory_usage import compact_dtypes
+from instrumentation import measure, record_skip, start_run, finish_run, add_report_arguments
 
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'dataset.db')
 RAW_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'staging', '01_raw')
 os.makedirs(RAW_DIR, exist_ok=True)
 
+EXPORT_FORMATS = ('csv', 'arrow')
+EXTENSIONS = {'csv': '.csv', 'arrow': '.arrow'}
+CHUNK_SIZE = 50_000
+DEFAULT_WORKERS = 4
+
+# pandas dtypes for the column types to_sql declares, so every chunk of a
+# table is read with the same dtypes whatever values it happens to hold.
+SQLITE_DTYPES = {
+    'FLOAT': 'float64', 'REAL': 'float64',
+    'BIGINT': 'Int64', 'INTEGER': 'Int64', 'SMALLINT': 'Int64',
+    'BOOLEAN': 'boolean',
+    'TEXT': 'object',
+}
+
 def get_table_names(db_path):
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = [table[0] for table in cursor.fetchall()]
-        conn.close()
-        return tables
+        return get_category_tables(db_path)
     except Exception as e:
         print(f"Error getting table names: {e}")
         return []
 
+def table_query(table_name, has_clusters=True):
+    """
+    The query that reads a table, leaving out the rows near_duplicates.py
+    marked as copies of another product (across all categories); each
+    cluster keeps its representative.
+    """
+    if not has_clusters:
+        return sqlalchemy.text(f'SELECT * FROM "{table_name}"'), {}
+    query = f'SELECT * FROM "{table_name}" WHERE {exclude_duplicates_sql()}'
+    return sqlalchemy.text(query), {'table_name': table_name}
+
+def read_without_duplicates(table_name, engine, has_clusters=True):
+    query, params = table_query(table_name, has_clusters)
+    return pd.read_sql_query(query, engine, params=params)
+
+def column_dtypes(declared_types):
+    return {col: SQLITE_DTYPES[kind] for col, kind in declared_types.items() if kind in SQLITE_DTYPES}
+
+def numeric_text_columns(table_name, declared_types, engine):
+    """
+    TEXT columns hold the cleaner's output as-is, including 'nan' for missing
+    cells and numbers kept as text. A CSV round trip re-infers those with
+    read_csv's rules; the typed export applies the same rules once per table,
+    from each column's distinct values, so every chunk gets the same schema.
+    Returns the TEXT columns whose values are all numbers or missing.
+    """
+    numeric = []
+    with engine.connect() as conn:
+        for col, kind in declared_types.items():
+            if kind != 'TEXT':
+                continue
+            values = [row[0] for row in conn.exec_driver_sql(f'SELECT DISTINCT "{col}" FROM "{table_name}"')]
+            values = pd.Series([v for v in values if v is not None and v not in NA_STRINGS], dtype=object)
+            if pd.to_numeric(values, errors='coerce').notna().all():
+                numeric.append(col)
+    return numeric
+
+def normalize_text_chunk(chunk, numeric_columns):
+    for col in chunk.select_dtypes(include=['object']).columns:
+        values = chunk[col].where(~chunk[col].isin(NA_STRINGS))
+        chunk[col] = pd.to_numeric(values, errors='coerce') if col in numeric_columns else values
+    return chunk
+
+def arrow_schema(declared_types, numeric_columns):
+    import pyarrow as pa
+
+    arrow_types = {'float64': pa.float64(), 'Int64': pa.int64(), 'boolean': pa.bool_(), 'object': pa.string()}
+    dtypes = column_dtypes(declared_types)
+    dtypes.update({col: 'float64' for col in numeric_columns})
+    return pa.schema([(col, arrow_types.get(dtypes.get(col), pa.string())) for col in declared_types])
+
+def write_csv_chunks(chunks, output_path, declared_types, numeric_columns):
+    rows = 0
+    for i, chunk in enumerate(chunks):
+        chunk.to_csv(output_path, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+        rows += len(chunk)
+    if rows == 0:
+        pd.DataFrame(columns=list(declared_types)).to_csv(output_path, index=False)
+    return rows
+
+def write_arrow_chunks(chunks, output_path, declared_types, numeric_columns):
+    """
+    Writes the chunks as one uncompressed Arrow IPC file (Feather v2), which
+    keeps the column types and can be memory-mapped by the reader
+    (pyarrow.feather.read_table(path, memory_map=True)).
+    """
+    import pyarrow as pa
+
+    schema = arrow_schema(declared_types, numeric_columns)
+    rows = 0
+    with pa.OSFile(output_path, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            rows += len(chunk)
+    return rows
+
+WRITERS = {'csv': write_csv_chunks, 'arrow': write_arrow_chunks}
+
+def iter_table_chunks(table_name, chunk_size=CHUNK_SIZE, has_clusters=True, typed=False):
+    """
+    Reads a table chunk_size rows at a time through the shared reader pool.
+    With typed=True the TEXT columns are resolved the way a CSV round trip
+    would (see numeric_text_columns). Returns (chunks, declared_types, numeric_columns).
+    """
+    engine = get_db_engine(DB_PATH)
+    declared_types = get_column_types(DB_PATH)[table_name]
+    numeric_columns = numeric_text_columns(table_name, declared_types, engine) if typed else []
+    query, params = table_query(table_name, has_clusters)
+    chunks = pd.read_sql_query(query, engine, params=params, chunksize=chunk_size,
+                               dtype=column_dtypes(declared_types))
+    if typed:
+        chunks = (normalize_text_chunk(chunk, numeric_columns) for chunk in chunks)
+    return chunks, declared_types, numeric_columns
+
+def read_table(table_name, chunk_size=CHUNK_SIZE, has_clusters=True, compact=False):
+    """
+    Reads a whole table into memory with the dtypes the next stage would get
+    from its CSV export: integer columns become int64, or float64 when they
+    hold missing values. compact=True converts them to the compact dtypes
+    instead (see memory_usage.compact_dtypes).
+    """
+    chunks, declared_types, _ = iter_table_chunks(table_name, chunk_size, has_clusters, typed=True)
+    chunks = list(chunks)
+    if not chunks:
+        return pd.DataFrame(columns=list(declared_types))
+    df = pd.concat(chunks, ignore_index=True)
+    for col in df.select_dtypes(include=['Int64']).columns:
+        df[col] = df[col].astype('float64' if df[col].isna().any() else 'int64')
+    return compact_dtypes(df) if compact else df
+
+def read_table_measured(table_name, chunk_size=CHUNK_SIZE, has_clusters=True, compact=False):
+    """
+    read_table as a 'load' record of the run report, for the reader threads.
+    """
+    with measure('load', table_name, per_thread=True) as record:
+        df = read_table(table_name, chunk_size, has_clusters, compact)
+        record['rows_out'] = len(df)
+    return df
+
+def load_tables(tables=None, workers=DEFAULT_WORKERS, chunk_size=CHUNK_SIZE, compact=False):
+    """
+    Reads the category tables into memory concurrently, for the in-process
+    pipeline, in compact dtypes with compact=True. Returns {table_name: DataFrame}
+    in table order.
+    """
+    if tables is None:
+        tables = get_table_names(DB_PATH)
+    has_clusters = CLUSTERS_TABLE in get_schema_catalog(DB_PATH)
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = {table_name: executor.submit(read_table_measured, table_name, chunk_size, has_clusters, compact)
+                   for table_name in tables}
+        return {table_name: future.result() for table_name, future in futures.items()}
+
+def export_table(table_name, export_format='csv', chunk_size=CHUNK_SIZE, has_clusters=True, output_dir=RAW_DIR):
+    """
+    Streams one table into output_dir in chunks of chunk_size rows through the
+    shared reader pool. The file is written under a temporary name and moved
+    into place once complete. Returns (rows, seconds, output_path).
+    """
+    start = time.perf_counter()
+    with measure('load', table_name, per_thread=True) as record:
+        chunks, declared_types, numeric_columns = iter_table_chunks(
+            table_name, chunk_size, has_clusters, typed=(export_format == 'arrow')
+        )
+
+        output_path = os.path.join(output_dir, f"{table_name}{EXTENSIONS[export_format]}")
+        temp_path = f"{output_path}.tmp"
+        try:
+            rows = WRITERS[export_format](chunks, temp_path, declared_types, numeric_columns)
+            os.replace(temp_path, output_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        record.update(rows_out=rows, bytes_written=os.path.getsize(output_path))
+    return rows, time.perf_counter() - start, output_path
+
+def export_tables(tables, export_format='csv', workers=DEFAULT_WORKERS, chunk_size=CHUNK_SIZE, output_dir=RAW_DIR):
+    """
+    Exports the tables concurrently, workers at a time. SQLite reads and the
+    file writers spend most of their time outside the GIL, so threads are
+    enough. Returns {table_name: (rows, seconds, output_path)} in table order.
+    """
+    has_clusters = CLUSTERS_TABLE in get_schema_catalog(DB_PATH)
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = {
+            table_name: executor.submit(export_table, table_name, export_format, chunk_size, has_clusters, output_dir)
+            for table_name in tables
+        }
+        return {table_name: future.result() for table_name, future in futures.items()}
+
 def main():
+    parser = argparse.ArgumentParser(description="Export the category tables to the staging area.")
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv',
+                        help="csv (default), or arrow for typed, memory-mappable Arrow IPC files.")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Tables exported at the same time.")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Rows read and written per chunk.")
+    add_report_arguments(parser, ['load'])
+    args = parser.parse_args()
+    start_run('load_data', args.profile)
+
     print(f"--- [1/3] Running load_data.py ---")
-    
+
     tables = get_table_names(DB_PATH)
     if not tables:
         print("  - ❌ No tables found in database.")
+        record_skip('load', "No tables found in database.")
+        finish_run(args)
         sys.exit(1)
-        
-    print(f"  - Found {len(tables)} tables. Exporting to '{os.path.basename(RAW_DIR)}'...")
-    
-    engine = get_db_engine() 
-    
-    df = pd.read_sql_table('Refrigerator', engine)
-    for table_name in tables:
-        df = pd.read_sql_table(table_name, engine)
-        output_path = os.path.join(RAW_DIR, f"{table_name}.csv")
-        df.to_csv(output_path, index=False)
-        print(df.columns)
-        print(f"    - Exported '{table_name}' to {os.path.basename(output_path)}")
-        
+
+    print(f"  - Found {len(tables)} tables. Exporting to '{os.path.basename(RAW_DIR)}' as {args.format}...")
+
+    start = time.perf_counter()
+    with measure('load') as record:
+        results = export_tables(tables, args.format, args.workers, args.chunk_size)
+        record['rows_out'] = sum(rows for rows, _, _ in results.values())
+    elapsed = time.perf_counter() - start
+
+    for table_name, (rows, seconds, output_path) in results.items():
+        print(f"    - Exported '{table_name}' to {os.path.basename(output_path)}: {rows} rows in {seconds:.3f}s")
+    print(f"  - Wall time {elapsed:.3f}s for {sum(seconds for _, seconds, _ in results.values()):.3f}s of table exports.")
+
     print(f"  - ✅ All tables exported successfully.")
+    finish_run(args)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -6,79 +6,110 @@ import argparse
 import numpy as np
 
 sys.path.append(os.path.join(os.path.dirname(__file__), 'scripts'))
-from preprocess import process_single_dataframe
+from preprocess import load_preprocessor, transform_dataframe
 from feature_engineering import feature_engineer_dataframe
 
-MODELS_DIR = 'models'
+MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models')
+# Predictions are listed row by row for batches up to this size, and summarized for larger ones.
+MAX_PRINTED_ROWS = 10
+TASKS = ['price', 'rating_with_price', 'rating_without_price']
 
-def predict_missing_values(input_df: pd.DataFrame) -> pd.DataFrame:
-    
-    df = input_df.copy()
-    
-    for index, row in df.iterrows():
-        category = row.get('category')
-        if not category or pd.isna(category):
-            print(f"Skipping row {index}: 'category' column is missing.")
+_models = {}
+
+def load_model(category, task_name):
+    """
+    The saved model of a category and task, or None. Each file is loaded once
+    per process and reloaded when it changes.
+    """
+    model_path = os.path.join(MODELS_DIR, f"{category}_{task_name}_model.joblib")
+    if not os.path.exists(model_path):
+        return None
+    key = (model_path, os.path.getmtime(model_path))
+    if key not in _models:
+        _models[key] = joblib.load(model_path)
+    return _models[key]
+
+def prepare_features(rows: pd.DataFrame, state: dict, category, models) -> pd.DataFrame:
+    """
+    The model inputs of a batch of raw rows of one category: the category's
+    fitted preprocessor applied (no refitting), then the engineered features
+    the given models were trained on, and no others.
+    """
+    wanted = set().union(*(model.feature_names_in_ for model in models if model is not None))
+    return feature_engineer_dataframe(transform_dataframe(rows, state), category, wanted)
+
+def predict_task(model, features: pd.DataFrame, drop_cols) -> np.ndarray:
+    X_predict = features.drop(columns=drop_cols, errors='ignore')
+    model_features = [feat for feat in model.feature_names_in_ if feat in X_predict.columns]
+    return model.predict(X_predict[model_features])
+
+def report_predictions(name, predictions: pd.Series, value_format):
+    print(f"  - ✅ Predicted {name} for {len(predictions)} rows.")
+    if len(predictions) <= MAX_PRINTED_ROWS:
+        for index, value in predictions.items():
+            print(f"    - Row {index}: {value:{value_format}}")
+
+def missing_mask(df: pd.DataFrame, column) -> pd.Series:
+    return df[column].isna() if column in df.columns else pd.Series(True, index=df.index)
+
+def predict_missing_values(input_df: pd.DataFrame, copy=True) -> pd.DataFrame:
+    """
+    Fills in the missing prices and ratings of the input rows. Rows are
+    handled a category at a time: the batch is preprocessed with the
+    category's saved preprocessor (see preprocess.fit_preprocessor) and each
+    model predicts all of its rows in one call. Missing prices are predicted
+    first, so a row whose price was predicted gets its rating from the model
+    trained with price. The predictions go into a copy of input_df, or with
+    copy=False into input_df itself, for a caller that owns the frame.
+    """
+    df = input_df.copy() if copy else input_df
+    categories = df['category'] if 'category' in df.columns else pd.Series(np.nan, index=df.index)
+    has_category = categories.notna() & (categories.astype(str) != '')
+    for index in df.index[~has_category]:
+        print(f"Skipping row {index}: 'category' column is missing.")
+
+    for category, rows in df[has_category].groupby('category', sort=False, observed=True):
+        print(f"\n--- Processing {len(rows)} rows (Category: {category}) ---")
+        state = load_preprocessor(category)
+        if state is None:
+            print(f"  - WARNING: Preprocessor for '{category}' not found. Run the training pipeline first.")
             continue
-            
-        print(f"\n--- Processing Row {index} (Category: {category}) ---")
-        
-        row_df = pd.DataFrame([row])
-        
-        price_is_missing = pd.isna(row.get('price'))
-        rating_is_missing = pd.isna(row.get('rating'))
-        
-        preprocessed_row = process_single_dataframe(row_df.copy())
-        final_features = feature_engineer_dataframe(preprocessed_row.copy(), category)
 
-        if price_is_missing:
+        models = {task_name: load_model(category, task_name) for task_name in TASKS}
+        features = prepare_features(rows, state, category, models.values())
+        price_missing = rows.index[missing_mask(rows, 'price')]
+        if len(price_missing):
             print(f"  - Task: Predict missing 'price'.")
-            model_path = os.path.join(MODELS_DIR, f"{category}_price_model.joblib")
-            if os.path.exists(model_path):
-                model = joblib.load(model_path)
-                
-                X_predict = final_features.copy()
-                if 'rating' in X_predict.columns:
-                    X_predict = X_predict.drop(columns=['rating'])
-                
-                model_features = [feat for feat in model.feature_names_in_ if feat in X_predict.columns]
-                X_predict = X_predict[model_features]
-
-                predicted_price = model.predict(X_predict)[0]
-                df.loc[index, 'price'] = predicted_price
-                print(f"  - ✅ Predicted Price: {predicted_price:,.0f}")
+            model = models['price']
+            if model is not None:
+                predictions = pd.Series(predict_task(model, features.loc[price_missing], ['rating']), index=price_missing)
+                df.loc[price_missing, 'price'] = predictions
+                report_predictions('Price', predictions, ',.0f')
+                # The rating models see the predicted prices.
+                features = prepare_features(df.loc[rows.index], state, category, models.values())
             else:
                 print(f"  - WARNING: Price model for '{category}' not found.")
 
-        if rating_is_missing:
+        rating_missing = rows.index[missing_mask(rows, 'rating')]
+        if len(rating_missing):
             print(f"  - Task: Predict missing 'rating'.")
-            
-            if 'price' in row and pd.notna(df.loc[index, 'price']):
-                task_type = 'rating_with_price'
-                print("    - Using model trained WITH price.")
-            else:
-                task_type = 'rating_without_price'
-                print("    - Using model trained WITHOUT price.")
-                
-            model_path = os.path.join(MODELS_DIR, f"{category}_{task_type}_model.joblib")
-            if os.path.exists(model_path):
-                model = joblib.load(model_path)
-                
-                X_predict = final_features.copy()
-                
-                # If using the no-price model, drop price from features
-                if task_type == 'rating_without_price' and 'price' in X_predict.columns:
-                    X_predict = X_predict.drop(columns=['price'])
-                
-                model_features = [feat for feat in model.feature_names_in_ if feat in X_predict.columns]
-                X_predict = X_predict[model_features]
+            priced = ~missing_mask(df.loc[rating_missing], 'price')
+            for task_type, index in (('rating_with_price', rating_missing[priced.to_numpy()]),
+                                     ('rating_without_price', rating_missing[~priced.to_numpy()])):
+                if not len(index):
+                    continue
+                print(f"    - Using model trained {'WITH' if task_type == 'rating_with_price' else 'WITHOUT'} price "
+                      f"for {len(index)} rows.")
+                model = models[task_type]
+                if model is None:
+                    print(f"  - WARNING: Rating model for '{category}' ({task_type}) not found.")
+                    continue
+                # The no-price model is given no price.
+                drop_cols = ['rating'] if task_type == 'rating_with_price' else ['rating', 'price']
+                predictions = pd.Series(predict_task(model, features.loc[index], drop_cols), index=index)
+                df.loc[index, 'rating'] = predictions
+                report_predictions('Rating', predictions, '.2f')
 
-                predicted_rating = model.predict(X_predict)[0]
-                df.loc[index, 'rating'] = predicted_rating
-                print(f"  - ✅ Predicted Rating: {predicted_rating:.2f}")
-            else:
-                print(f"  - WARNING: Rating model for '{category}' ({task_type}) not found.")
-                
     return df
 
 def main():
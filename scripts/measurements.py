@@ -0,0 +1,198 @@
+import re
+import numpy as np
+import pandas as pd
+
+# unit: (dimension, factor to the dimension's canonical unit, spellings after normalize_text)
+UNITS = {
+    'cm': ('length', 1.0, ['سانتی متر', 'سانتیمتر', 'سانتی متری', 'سانتیمتری', 'سانت', 'cm']),
+    'mm': ('length', 0.1, ['میلی متر', 'میلیمتر', 'میلی متری', 'میلیمتری', 'میلمتر', 'mm']),
+    'm': ('length', 100.0, ['متر', 'm']),
+    'l': ('volume', 1.0, ['لیتر', 'لیتری', 'liter', 'litre', 'lit', 'l']),
+    'ml': ('volume', 0.001, ['میلی لیتر', 'میلیلیتر', 'میلی لیتری', 'ml', 'cc', 'سی سی']),
+    'w': ('power', 1.0, ['وات', 'watt', 'w']),
+    'kw': ('power', 1000.0, ['کیلو وات', 'کیلووات', 'kw']),
+    'kg': ('mass', 1.0, ['کیلوگرم', 'کیلو گرم', 'کیلو', 'kg']),
+    'g': ('mass', 0.001, ['گرم', 'gr', 'g']),
+}
+CANONICAL_UNITS = {'length': 'cm', 'volume': 'l', 'power': 'w', 'mass': 'kg'}
+SPELLINGS = {spelling: unit for unit, (_, _, spellings) in UNITS.items() for spelling in spellings}
+
+NUMBER_WORDS = {'نیم': 0.5, 'یک': 1, 'دو': 2, 'سه': 3, 'چهار': 4, 'پنج': 5, 'شش': 6}
+
+# Persian and Arabic-Indic digits, Arabic letter forms and ZWNJ mapped to one spelling.
+NORMALIZE_TABLE = str.maketrans({
+    **{digit: str(i) for i, digit in enumerate('۰۱۲۳۴۵۶۷۸۹')},
+    **{digit: str(i) for i, digit in enumerate('٠١٢٣٤٥٦٧٨٩')},
+    'ي': 'ی', 'ى': 'ی', 'ك': 'ک', '‌': ' ', '٫': '.', '٬': '', ',': '', 'ـ': '',
+})
+
+# One matcher for every unit: a number (or number word), optionally the rest of a
+# range or AxBxC chain, then a unit spelling. Longer spellings come first so
+# 'میلی متر' wins over 'متر'; a number glued to a letter (model codes such as
+# 'e92w') is not a measurement.
+_NUMBER = r'\d+(?:\.\d+)?'
+_SEPARATOR = r'[x×*+\-–]|تا|الی'
+_UNIT_ALTERNATIVES = '|'.join(re.escape(s) for s in sorted(SPELLINGS, key=len, reverse=True))
+_WORD_ALTERNATIVES = '|'.join(NUMBER_WORDS)
+MEASUREMENT_PATTERN = re.compile(
+    rf'(?<![\w.])(?P<value>{_NUMBER}|{_WORD_ALTERNATIVES})'
+    rf'(?P<chain>(?:\s*(?:{_SEPARATOR})\s*{_NUMBER})*)'
+    rf'\s*(?P<unit>{_UNIT_ALTERNATIVES})(?!\w)'
+)
+CHAIN_STEP_PATTERN = re.compile(rf'\s*({_SEPARATOR})\s*({_NUMBER})')
+BARE_NUMBER_PATTERN = re.compile(rf'^\s*(?P<value>{_NUMBER})\s*$')
+
+# How a chain is read: 'AxBxC' is a size, one number per axis, kept in
+# separate columns named after the usual width × height × depth order of
+# the listings; 'A+B' (a side-by-side fridge, a twin-basket fryer) is the
+# total. A range ('600-1500', '3 تا 5') has no single value and is NaN.
+SIZE_SEPARATORS = {'x', '×', '*'}
+SUM_SEPARATORS = {'+'}
+AXES = ('w', 'h', 'd')
+
+# A text column gets a typed measurement column when at least this share of
+# its non-empty cells spell out a unit, and per-axis columns when this share
+# of them are AxBxC sizes.
+MIN_UNIT_RATIO = 0.25
+# Columns measured together: once one of them spells out a unit, the others
+# are read in that unit too, even where they hold bare numbers only (a
+# dishwasher's width next to its height and depth in centimetres).
+MEASUREMENT_GROUPS = [('height', 'width', 'depth')]
+
+def normalize_text(series: pd.Series) -> pd.Series:
+    """
+    Normalises text for unit matching: digits to ASCII, Arabic ی/ک to Persian,
+    ZWNJ to a space, Persian decimal slash (1/5) to a dot, lower case, single spaces.
+    """
+    text = series.astype(str).str.translate(NORMALIZE_TABLE)
+    text = text.str.replace(r'(?<=\d)/(?=\d)', '.', regex=True)
+    return text.str.lower().str.replace(r'\s+', ' ', regex=True).str.strip()
+
+def read_chain(first, chain):
+    """
+    Reads a matched number and the rest of its chain: (value, sizes) where
+    value is the number itself, the total of an A+B chain or NaN for a size
+    or range, and sizes holds the numbers of an AxBxC chain (up to len(AXES)),
+    else None.
+    """
+    steps = CHAIN_STEP_PATTERN.findall(chain)
+    if not steps:
+        return first, None
+    separators = {separator for separator, _ in steps}
+    numbers = [first] + [float(number) for _, number in steps]
+    if separators <= SUM_SEPARATORS:
+        return sum(numbers), None
+    if separators <= SIZE_SEPARATORS and len(numbers) <= len(AXES):
+        return np.nan, numbers
+    return np.nan, None
+
+def parse_unique_values(uniques) -> pd.DataFrame:
+    """
+    Parses distinct cell values into a frame with 'value' (float, as written,
+    see read_chain), 'unit' (a key of UNITS, or NaN for a bare number or no
+    match) and one column per axis of AXES for AxBxC sizes.
+    """
+    text = normalize_text(pd.Series(uniques, dtype=object))
+    parts = text.str.extract(MEASUREMENT_PATTERN)
+    words = parts['value'].map(NUMBER_WORDS)
+    firsts = pd.to_numeric(parts['value'], errors='coerce').fillna(words)
+    chains = [read_chain(first, chain) if isinstance(chain, str) else (first, None)
+              for first, chain in zip(firsts, parts['chain'])]
+    values = pd.Series([value for value, _ in chains], index=text.index, dtype=float)
+    sizes = pd.DataFrame([sizes or [] for _, sizes in chains], index=text.index, dtype=float)
+    sizes = sizes.reindex(columns=range(len(AXES)))
+    sizes.columns = list(AXES)
+    units = parts['unit'].map(SPELLINGS)
+
+    bare = text.str.extract(BARE_NUMBER_PATTERN)['value']
+    values = values.where(parts['value'].notna(), pd.to_numeric(bare, errors='coerce'))
+    return pd.concat([pd.DataFrame({'value': values.astype(float), 'unit': units}), sizes], axis=1)
+
+def parse_measurement_column(series: pd.Series):
+    """
+    Parses a whole column with one pass of the combined matcher over its
+    distinct values. Returns (parsed, codes) where parsed is the per-unique
+    frame from parse_unique_values and codes maps each row to its unique (-1 for missing).
+    """
+    codes, uniques = pd.factorize(series.to_numpy(dtype=object))
+    return parse_unique_values(uniques), codes
+
+def infer_measurement_spec(df: pd.DataFrame) -> dict:
+    """
+    Picks the text columns of a raw sheet that hold measurements. Returns
+    {column: (unit, axes)} where unit is the most common unit spelled out in
+    that column (cells with a bare number are read in that unit) and axes is
+    how many per-axis columns its AxBxC sizes get (0 when they are rare).
+    """
+    spec = {}
+    for col in df.select_dtypes(include=['object']).columns:
+        parsed, codes = parse_measurement_column(df[col])
+        present = codes >= 0
+        if not present.any():
+            continue
+        row_units = parsed['unit'].to_numpy(dtype=object).take(codes[present])
+        row_units = pd.Series(row_units).dropna()
+        if len(row_units) / present.sum() < MIN_UNIT_RATIO:
+            continue
+        dimensions = row_units.map(lambda unit: UNITS[unit][0])
+        dimension = dimensions.value_counts().index[0]
+        unit = row_units[dimensions == dimension].value_counts().index[0]
+
+        row_sizes = parsed[list(AXES)].notna().sum(axis=1).to_numpy().take(codes[present])
+        axes = int(row_sizes.max()) if (row_sizes > 0).mean() >= MIN_UNIT_RATIO else 0
+        spec[col] = (unit, axes)
+
+    for group in MEASUREMENT_GROUPS:
+        units = [spec[col][0] for col in group if col in spec]
+        for col in group:
+            if units and col in df.columns and col not in spec:
+                spec[col] = (units[0], 0)
+    return spec
+
+def measurement_column_name(col, unit, axis=None):
+    return f"{col}_{axis}_{CANONICAL_UNITS[UNITS[unit][0]]}" if axis else f"{col}_{CANONICAL_UNITS[UNITS[unit][0]]}"
+
+def measurement_columns(df: pd.DataFrame, spec: dict) -> pd.DataFrame:
+    """
+    Builds the typed columns described by spec: each value converted to the
+    canonical unit of its dimension (cm, l, w, kg), named '<column>_<unit>',
+    and for a column with axes, each number of its AxBxC sizes in
+    '<column>_<axis>_<unit>'. Cells in another dimension, with no number or
+    with no single value (a size or a range) are NaN.
+    """
+    columns = {}
+    for col, (default_unit, axes) in spec.items():
+        if col not in df.columns:
+            continue
+        dimension = UNITS[default_unit][0]
+        parsed, codes = parse_measurement_column(df[col])
+
+        units = parsed['unit'].fillna(default_unit)
+        factors = units.map(lambda unit: UNITS[unit][1] if UNITS[unit][0] == dimension else np.nan)
+        canonical = np.append((parsed['value'] * factors).to_numpy(dtype=float), np.nan)
+        columns[measurement_column_name(col, default_unit)] = canonical.take(codes)
+        for axis in AXES[:axes]:
+            canonical = np.append((parsed[axis] * factors).to_numpy(dtype=float), np.nan)
+            columns[measurement_column_name(col, default_unit, axis)] = canonical.take(codes)
+    return pd.DataFrame(columns, index=df.index)
+
+def add_measurement_columns(cleaned_df: pd.DataFrame, raw_df: pd.DataFrame, spec=None):
+    """
+    Replaces the measured columns of cleaned_df, whose rows are a subset of
+    raw_df's, with the typed columns parsed from raw_df (the sheet before
+    unit stripping): the unit-stripped copy mixes units ('3 نفره' next to
+    '4 لیتر') or stays text, so only the typed columns are kept.
+    The spec is inferred from raw_df unless given. Returns (df, spec).
+    """
+    if spec is None:
+        spec = {col: (unit, axes) for col, (unit, axes) in infer_measurement_spec(raw_df).items()
+                if measurement_column_name(col, unit) not in cleaned_df.columns}
+        for col, (unit, axes) in spec.items():
+            names = [measurement_column_name(col, unit)] + [measurement_column_name(col, unit, axis) for axis in AXES[:axes]]
+            print(f"  - Replacing '{col}' with typed measurement columns {names}.")
+    if not spec:
+        return cleaned_df, spec
+
+    typed = measurement_columns(raw_df.loc[cleaned_df.index], spec)
+    sources = [col for col in spec if col in cleaned_df.columns]
+    return pd.concat([cleaned_df.drop(columns=sources), typed], axis=1), spec
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+
+# Text columns with at most this share of distinct values are stored as
+# pandas 'category' in compact mode: brand, type, color and the like repeat
+# a handful of Persian labels over every row.
+MAX_CATEGORY_RATIO = 0.5
+
+def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts df to the compact dtypes, in place, and returns it: float64
+    columns become float32, int64 (and nullable Int64) columns become int32
+    when their values fit, and repetitive text columns become 'category'.
+    The caller hands df over; nothing else may rely on its old dtypes.
+    """
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_float_dtype(series) and series.dtype != np.float32:
+            df[col] = series.astype(np.float32)
+        elif pd.api.types.is_integer_dtype(series) and series.dtype.itemsize > 4:
+            info = np.iinfo(np.int32)
+            if series.isna().all() or (series.min() >= info.min and series.max() <= info.max):
+                df[col] = series.astype('Int32' if isinstance(series.dtype, pd.Int64Dtype) else np.int32)
+        elif pd.api.types.is_object_dtype(series):
+            values = series.dropna()
+            if len(values) and values.nunique() <= MAX_CATEGORY_RATIO * len(values):
+                df[col] = series.astype('category')
+    return df
+
+def is_text_dtype(series: pd.Series):
+    """
+    Text columns as the stages see them: object columns, or 'category'
+    columns from compact mode.
+    """
+    return pd.api.types.is_object_dtype(series) or isinstance(series.dtype, pd.CategoricalDtype)
+
+def frame_mb(tables) -> float:
+    """
+    Memory held by a DataFrame or {name: DataFrame}, text included, in MB.
+    """
+    frames = tables.values() if isinstance(tables, dict) else [tables]
+    return sum(df.memory_usage(deep=True).sum() for df in frames) / 1e6
+
+def reset_peak_rss():
+    """
+    Resets the process's peak resident set size, so the next peak_rss_mb()
+    covers only what runs after this call. Linux only (/proc/self/clear_refs);
+    returns False elsewhere, where the peak covers the whole process.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb() -> float:
+    """
+    The process's peak resident set size in MB: VmHWM on Linux, otherwise
+    the getrusage maximum (kilobytes on Linux, bytes on macOS).
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import sys
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+def print_memory(memory: dict):
+    """
+    Prints {stage: (peak RSS in MB, MB held by the stage's DataFrames or None)}.
+    """
+    if not memory:
+        return
+    print(f"\n{'stage':<14}{'peak RSS (MB)':>15}{'data (MB)':>12}")
+    for stage, (peak, data) in memory.items():
+        print(f"{stage:<14}{peak:>15.1f}" + (f"{data:>12.1f}" if data is not None else f"{'-':>12}"))
@@ -0,0 +1,225 @@
+import os
+import json
+import math
+import time
+import pickle
+import argparse
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+from datetime import datetime, timezone
+from sklearn.model_selection import KFold
+
+from train_model import (
+    SELECTION_PATH, TASKS, DEFAULT_BEST_MODELS, ESTIMATORS, build_estimator, find_final_datasets, task_matrices,
+)
+from import_manifest import save_manifest
+from instrumentation import measure, start_run, finish_run, add_report_arguments
+
+N_FOLDS = 5
+# Successive halving: every candidate is scored on MIN_FOLDS folds, then the
+# best 1/HALVING_FACTOR go on to HALVING_FACTOR times as many folds, until
+# the survivors have been scored on all N_FOLDS. A category's fold holds a
+# few dozen rows, too few to rank the candidates on one.
+MIN_FOLDS = 2
+HALVING_FACTOR = 3
+# Single-row predictions timed per model (make_predictions predicts a
+# product at a time); the median is recorded.
+LATENCY_REPEATS = 5
+
+# The estimators and settings tried for every category and task. The
+# choices of the original selection (DEFAULT_BEST_MODELS: each estimator
+# with its defaults) are among them, so the current models compete too.
+CANDIDATES = {
+    'linear': ('linear', {}),
+    'random_forest': ('random_forest', {}),
+    'random_forest_300_leaf2': ('random_forest', {'n_estimators': 300, 'min_samples_leaf': 2}),
+    'random_forest_depth8': ('random_forest', {'max_depth': 8}),
+    'xgboost': ('xgboost', {}),
+    'xgboost_shallow': ('xgboost', {'n_estimators': 300, 'max_depth': 3, 'learning_rate': 0.05}),
+    'xgboost_sampled': ('xgboost', {'n_estimators': 300, 'max_depth': 6, 'learning_rate': 0.05,
+                                    'subsample': 0.8, 'colsample_bytree': 0.8}),
+}
+
+# The scores of one candidate on one fold.
+FoldScore = namedtuple('FoldScore', ['rmse', 'r2', 'fit_seconds', 'predict_ms', 'size_bytes'])
+
+def fold_matrices(X: pd.DataFrame, y: pd.Series, n_folds=N_FOLDS) -> list:
+    """
+    The train and test matrices of every fold, built once per category and
+    task and shared by every candidate and rung: [(X_train, y_train, X_test, y_test)].
+    """
+    folds = KFold(n_splits=min(n_folds, len(X)), shuffle=True, random_state=42)
+    return [(X.iloc[train], y.iloc[train], X.iloc[test], y.iloc[test]) for train, test in folds.split(X)]
+
+def score_fold(candidate, fold) -> FoldScore:
+    """
+    Fits a candidate on one fold and scores it on the held-out rows: RMSE and
+    R², fit time, the median latency of a one-row prediction and the size
+    of the pickled model.
+    """
+    X_train, y_train, X_test, y_test = fold
+    model = build_estimator(*CANDIDATES[candidate])
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+
+    predictions = model.predict(X_test)
+    errors = y_test.to_numpy() - predictions
+    total = ((y_test - y_test.mean()) ** 2).sum()
+    r2 = 1 - (errors ** 2).sum() / total if total > 0 else np.nan
+
+    row = X_test.iloc[:1]
+    latencies = []
+    for _ in range(LATENCY_REPEATS):
+        start = time.perf_counter()
+        model.predict(row)
+        latencies.append(time.perf_counter() - start)
+    return FoldScore(float(np.sqrt(np.mean(errors ** 2))), float(r2), fit_seconds,
+                     float(np.median(latencies) * 1000), len(pickle.dumps(model)))
+
+def halving_rungs(n_candidates, n_folds):
+    """
+    [(candidates kept, folds scored)] per rung: MIN_FOLDS folds for everyone,
+    then HALVING_FACTOR times the folds for the best 1/HALVING_FACTOR, up to all folds.
+    """
+    rungs, kept, folds = [], n_candidates, min(MIN_FOLDS, n_folds)
+    while True:
+        rungs.append((kept, folds))
+        if folds >= n_folds or kept <= 1:
+            break
+        kept, folds = max(1, math.ceil(kept / HALVING_FACTOR)), min(n_folds, folds * HALVING_FACTOR)
+    if rungs[-1][1] < n_folds:
+        rungs.append((rungs[-1][0], n_folds))
+    return rungs
+
+def summarize(scores: list) -> dict:
+    r2 = [score.r2 for score in scores if not np.isnan(score.r2)]
+    return {
+        'folds': len(scores),
+        'rmse': float(np.mean([score.rmse for score in scores])),
+        'fold_rmse': [score.rmse for score in scores],
+        'r2': float(np.mean(r2)) if r2 else None,
+        'fit_seconds': float(np.mean([score.fit_seconds for score in scores])),
+        'predict_ms': float(np.mean([score.predict_ms for score in scores])),
+        'size_bytes': int(np.mean([score.size_bytes for score in scores])),
+    }
+
+def select_model(X: pd.DataFrame, y: pd.Series, candidates=None):
+    """
+    Successive halving over the candidates (see halving_rungs), ranked by
+    mean RMSE over the folds scored so far. A candidate's fold scores are
+    kept, so moving up a rung only scores the new folds. Returns
+    (winner, {candidate: summary with the rung it reached}).
+    """
+    candidates = list(candidates or CANDIDATES)
+    folds = fold_matrices(X, y)
+    scores = {candidate: [] for candidate in candidates}
+    reached = {}
+    alive = candidates
+    for rung, (kept, n_folds) in enumerate(halving_rungs(len(candidates), len(folds))):
+        alive = alive[:kept]
+        for candidate in alive:
+            for fold in folds[len(scores[candidate]):n_folds]:
+                scores[candidate].append(score_fold(candidate, fold))
+            reached[candidate] = rung
+        alive = sorted(alive, key=lambda candidate: np.mean([score.rmse for score in scores[candidate]]))
+    winner = alive[0]
+    return winner, {candidate: {**summarize(scores[candidate]), 'rung': reached[candidate]}
+                    for candidate in candidates}
+
+def current_candidate(category_name, task_name):
+    """
+    The candidate matching the hard-coded choice of DEFAULT_BEST_MODELS (all
+    of which use their estimator's default settings, the candidate of the
+    same name), for the comparison in the report.
+    """
+    model = DEFAULT_BEST_MODELS.get(category_name, {}).get(task_name)
+    if model is None:
+        return None
+    return next((name for name, estimator in ESTIMATORS.items() if isinstance(model, estimator)), None)
+
+def run_selection(datasets=None, categories=None, tasks=None):
+    """
+    Runs select_model for every category and task of the final data.
+    Returns the selection file's content: the winner of each category and
+    task (estimator, parameters and its scores) and every candidate's scores.
+    """
+    datasets = datasets or find_final_datasets()
+    selection = {
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+        'folds': N_FOLDS, 'halving_factor': HALVING_FACTOR, 'metric': 'rmse',
+        'models': {}, 'candidates': {},
+    }
+    print(f"\n{'category':<18}{'task':<22}{'winner':<26}{'rmse':>14}{'r2':>8}{'fit (s)':>9}"
+          f"{'predict (ms)':>14}{'size (KB)':>11}  current")
+    for category_name, data in sorted(datasets.items()):
+        if categories and category_name not in categories:
+            continue
+        df = pd.read_csv(data) if isinstance(data, str) else data
+        for task_name in tasks or TASKS:
+            matrices = task_matrices(df, task_name)
+            if matrices is None or matrices[0].empty or len(df) < 2:
+                continue
+            X, y = matrices
+            with measure('select', category_name, rows_in=len(df)) as record:
+                winner, summaries = select_model(X, y)
+                record['details'].update(task=task_name, winner=winner)
+
+            estimator, params = CANDIDATES[winner]
+            best = summaries[winner]
+            selection['models'].setdefault(category_name, {})[task_name] = {
+                'candidate': winner, 'estimator': estimator, 'params': params, **best,
+            }
+            selection['candidates'].setdefault(category_name, {})[task_name] = summaries
+            # The current model may have been dropped after fewer folds than the
+            # winner was scored on; both are compared on the folds it reached.
+            current = current_candidate(category_name, task_name)
+            if current in summaries:
+                n_folds = summaries[current]['folds']
+                compared = (f"{current} {summaries[current]['rmse']:,.3f} vs {winner} "
+                            f"{np.mean(best['fold_rmse'][:n_folds]):,.3f} on the same {n_folds} folds")
+            print(f"{category_name:<18}{task_name:<22}{winner:<26}{best['rmse']:>14,.3f}"
+                  f"{best['r2'] if best['r2'] is not None else float('nan'):>8.3f}{best['fit_seconds']:>9.3f}"
+                  f"{best['predict_ms']:>14.2f}{best['size_bytes'] / 1024:>11.1f}  "
+                  + (compared if current in summaries else '-'))
+    return selection
+
+def main():
+    parser = argparse.ArgumentParser(description="Cross-validate candidate models per category and task and "
+                                                 "write the winners for train_model.py.")
+    parser.add_argument('--categories', nargs='+', help="Only these categories (default: all).")
+    parser.add_argument('--tasks', nargs='+', choices=TASKS, help="Only these tasks (default: all).")
+    parser.add_argument('--output', default=SELECTION_PATH,
+                        help="Where to write the winning configuration (default: models/model_selection.json).")
+    parser.add_argument('--dry-run', action='store_true', help="Only print the results.")
+    add_report_arguments(parser, ['select'])
+    args = parser.parse_args()
+    start_run('model_selection', args.profile)
+
+    print(f"--- Model selection: {len(CANDIDATES)} candidates, {N_FOLDS}-fold CV, halving by {HALVING_FACTOR} ---")
+    with measure('select') as record:
+        selection = run_selection(categories=args.categories, tasks=args.tasks)
+        if not selection['models']:
+            record.update(status='skipped', error="No final data to select models on.")
+    if not selection['models']:
+        print("  - ERROR: No final data to select models on. Please run the data preparation pipeline first.")
+        finish_run(args)
+        return
+
+    if not args.dry_run:
+        if os.path.exists(args.output) and (args.categories or args.tasks):
+            # A partial run keeps the other categories' and tasks' winners.
+            with open(args.output, 'r', encoding='utf-8') as f:
+                previous = json.load(f)
+            for key in ('models', 'candidates'):
+                for category_name, tasks in previous.get(key, {}).items():
+                    for task_name, entry in tasks.items():
+                        selection[key].setdefault(category_name, {}).setdefault(task_name, entry)
+        save_manifest(selection, args.output)
+        print(f"\n  - ✅ Winning configuration written to '{os.path.relpath(args.output)}'; "
+              f"train_model.py trains these models from now on.")
+    finish_run(args)
+
+if __name__ == '__main__':
+    main()
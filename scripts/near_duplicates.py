@@ -0,0 +1,259 @@
+import argparse
+import numpy as np
+import pandas as pd
+from urllib.parse import unquote
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from measurements import normalize_text
+from database_connection import DB_PATH, CLUSTERS_TABLE, DERIVED_TABLES, get_schema_catalog, raw_connection
+
+SCOPES = ('category', 'all')
+
+# MinHash/LSH settings: 128 hashes in 16 bands of 8 rows make any pair above
+# roughly 0.7 Jaccard similarity a candidate; candidates are then kept only
+# when their estimated similarity reaches the threshold.
+NUM_PERM = 128
+BANDS = 16
+ROWS_PER_BAND = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+DEFAULT_THRESHOLD = 0.9
+BATCH_SIZE = 2_000
+# Verified pairs held before they are reduced to one pair per cluster member.
+MAX_PENDING_PAIRS = 1_000_000
+
+MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+_rng = np.random.RandomState(1)
+PERM_A = _rng.randint(1, (1 << 31) - 1, size=NUM_PERM).astype(np.uint64)
+PERM_B = _rng.randint(0, (1 << 31) - 1, size=NUM_PERM).astype(np.uint64)
+BAND_MULTIPLIERS = _rng.randint(1, 1 << 62, size=ROWS_PER_BAND + 1).astype(np.uint64) | np.uint64(1)
+
+def url_title(url):
+    """
+    Digikala product URLs end in the product title as a slug
+    (.../dkp-123/آبمیوه-گیری-پارس-خزر-مدل-tiger/), which is the only
+    title the scraped sheets carry.
+    """
+    if not isinstance(url, str):
+        return ''
+    path = unquote(url).split('?')[0].rstrip('/')
+    return path.rsplit('/', 1)[-1].replace('-', ' ')
+
+def title_series(df: pd.DataFrame):
+    if 'title' in df.columns:
+        return df['title']
+    if 'product_url' in df.columns:
+        return df['product_url'].map(url_title)
+    return None
+
+def normalize_titles(titles: pd.Series) -> pd.Series:
+    text = normalize_text(titles.fillna(''))
+    return text.str.replace(r'[^\w]+', ' ', regex=True).str.strip()
+
+def shingle_hashes(titles):
+    """
+    Hashes every SHINGLE_SIZE-character window of every title in one pass over
+    their concatenated code points. Returns (hashes, starts) where the
+    shingles of title i are hashes[starts[i]:starts[i + 1]]. A title shorter
+    than a shingle is hashed whole so it still gets a signature.
+    """
+    padded = [title if len(title) >= SHINGLE_SIZE else title.ljust(SHINGLE_SIZE, '\0') for title in titles]
+    lengths = np.array([len(title) for title in padded], dtype=np.int64)
+    codes = np.frombuffer(''.join(padded).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+
+    grams = np.zeros(len(codes) - SHINGLE_SIZE + 1, dtype=np.uint64)
+    for offset in range(SHINGLE_SIZE):
+        grams = grams * np.uint64(0x110000) + codes[offset:len(codes) - SHINGLE_SIZE + 1 + offset]
+
+    # Keep only the windows that start and end inside one title.
+    counts = lengths - SHINGLE_SIZE + 1
+    title_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    positions = np.repeat(title_starts, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+    hashes = (grams[positions] * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(32)
+    starts = np.concatenate([[0], np.cumsum(counts)])
+    return hashes, starts
+
+def minhash_signatures(titles) -> np.ndarray:
+    """
+    Returns a (len(titles), NUM_PERM) array of MinHash signatures over the
+    character shingles of each title, computed a batch of titles at a time.
+    """
+    signatures = np.empty((len(titles), NUM_PERM), dtype=np.uint64)
+    for start in range(0, len(titles), BATCH_SIZE):
+        batch = titles[start:start + BATCH_SIZE]
+        hashes, starts = shingle_hashes(batch)
+        permuted = (PERM_A[:, None] * hashes[None, :] + PERM_B[:, None]) % MERSENNE_PRIME
+        signatures[start:start + len(batch)] = np.minimum.reduceat(permuted, starts[:-1], axis=1).T
+    return signatures
+
+def iter_bucket_pairs(codes):
+    """
+    Yields every pair of rows with the same bucket code, as (n, 2) arrays:
+    the rows are sorted by code and each is paired with the 1st, 2nd, ...
+    row after it for as long as those stay in its bucket, one array per step.
+    """
+    order = np.argsort(codes, kind='stable')
+    ordered = codes[order]
+    for offset in range(1, len(order)):
+        same = np.flatnonzero(ordered[offset:] == ordered[:-offset])
+        if not len(same):
+            break
+        yield np.column_stack([order[same], order[same + offset]])
+
+def iter_candidate_pairs(signatures, groups):
+    """
+    Banded LSH: rows whose signatures agree on every value of some band (and
+    share a group) land in the same bucket, and every pair within a bucket is
+    a candidate. Rows with identical signatures (exact duplicate titles) are
+    first linked to the first of them and only that one is bucketed, so a
+    title repeated many times does not make its buckets quadratic. Yields the
+    candidates as (n, 2) arrays, a bucket offset of a band at a time.
+    """
+    _, identical = np.unique(np.column_stack([signatures, groups]), axis=0, return_inverse=True)
+    identical = identical.ravel()
+    _, first = np.unique(identical, return_index=True)
+    partners = first[identical]
+    linked = np.flatnonzero(partners != np.arange(len(identical)))
+    yield np.column_stack([partners[linked], linked])
+
+    representatives = np.sort(first)
+    for band in range(BANDS):
+        rows = signatures[representatives, band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        keys = (rows * BAND_MULTIPLIERS[:-1]).sum(axis=1) + groups[representatives] * BAND_MULTIPLIERS[-1]
+        codes, _ = pd.factorize(keys)
+        for pairs in iter_bucket_pairs(codes):
+            yield representatives[pairs]
+
+def spanning_pairs(pairs, n):
+    """
+    The same clusters as pairs over n rows, with one pair per member: each
+    member of a cluster paired with the cluster's first row.
+    """
+    graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+    _, components = connected_components(graph, directed=False)
+    _, first = np.unique(components, return_index=True)
+    partners = first[components]
+    linked = np.flatnonzero(partners != np.arange(n))
+    return np.column_stack([partners[linked], linked])
+
+def find_near_duplicates(titles: pd.Series, groups=None, threshold=DEFAULT_THRESHOLD) -> np.ndarray:
+    """
+    Clusters near-duplicate titles. groups (same length as titles) limits
+    matches to titles of the same group, e.g. the same category. Titles must
+    also carry the same numbers: 'مدل 905' and 'مدل 904' are different
+    models however similar the rest, while colour variants such as
+    'dw 200w' / 'dw 200s' still match. Returns one cluster label per title;
+    titles with no near-duplicate get -1.
+    """
+    normalized = normalize_titles(pd.Series(titles, dtype=object))
+    titles = normalized.tolist()
+    labels = np.full(len(titles), -1, dtype=np.int64)
+    present = np.flatnonzero([bool(title) for title in titles])
+    if len(present) < 2:
+        return labels
+
+    numbers = normalized.str.findall(r'\d+').str.join(' ').to_numpy()
+    keys = numbers if groups is None else pd.Series(np.asarray(groups, dtype=object)).astype(str).to_numpy() + '|' + numbers
+    groups = pd.factorize(keys)[0].astype(np.uint64)
+    signatures = minhash_signatures([titles[i] for i in present])
+
+    # Candidates are verified as they come, and the verified pairs folded
+    # into one pair per member whenever they pile up, so a large bucket costs
+    # time but not memory.
+    matched, pending = [], 0
+    for pairs in iter_candidate_pairs(signatures, groups[present]):
+        similarity = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+        matched.append(pairs[similarity >= threshold])
+        pending += len(matched[-1])
+        if pending > MAX_PENDING_PAIRS:
+            matched = [spanning_pairs(np.concatenate(matched), len(present))]
+            pending = len(matched[0])
+    pairs = np.concatenate(matched)
+    if not len(pairs):
+        return labels
+
+    graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(len(present), len(present)))
+    _, components = connected_components(graph, directed=False)
+    sizes = np.bincount(components)
+    duplicated = sizes[components] > 1
+    labels[present[duplicated]] = pd.factorize(components[duplicated])[0]
+    return labels
+
+def read_titles(conn, catalog):
+    """
+    Reads (table_name, row_id, title) for every table of the schema catalog
+    that has a title or a product URL, leaving out the derived tables.
+    """
+    frames = []
+    for table, columns in sorted(catalog.items()):
+        if table in DERIVED_TABLES:
+            continue
+        column = next((col for col in ('title', 'product_url') if col in columns), None)
+        if column is None:
+            continue
+        df = pd.read_sql_query(f'SELECT rowid AS row_id, "{column}" FROM "{table}" ORDER BY rowid', conn)
+        frames.append(pd.DataFrame({'table_name': table, 'row_id': df['row_id'], 'title': title_series(df)}))
+    if not frames:
+        return pd.DataFrame(columns=['table_name', 'row_id', 'title'])
+    return pd.concat(frames, ignore_index=True)
+
+def duplicate_clusters(titles: pd.DataFrame, threshold=DEFAULT_THRESHOLD) -> pd.DataFrame:
+    """
+    Builds the rows of the clusters table for both scopes: 'category' matches
+    titles within one table, 'all' matches across every table. The first row
+    of each cluster (by table name, then rowid) is its representative.
+    """
+    clusters = []
+    for scope in SCOPES:
+        groups = titles['table_name'] if scope == 'category' else None
+        labels = find_near_duplicates(titles['title'], groups, threshold)
+        members = titles[labels >= 0].assign(scope=scope, cluster_id=labels[labels >= 0])
+        members['is_representative'] = ~members['cluster_id'].duplicated()
+        clusters.append(members)
+    columns = ['scope', 'cluster_id', 'table_name', 'row_id', 'title', 'is_representative']
+    return pd.concat(clusters, ignore_index=True)[columns]
+
+def exclude_duplicates_sql(scope='all'):
+    """
+    The WHERE condition that leaves out the rows of a table marked as copies
+    of another product within scope; each cluster keeps its representative.
+    The table is bound as :table_name.
+    """
+    return (f'rowid NOT IN (SELECT row_id FROM "{CLUSTERS_TABLE}" '
+            f"WHERE scope = '{scope}' AND table_name = :table_name AND NOT is_representative)")
+
+def write_duplicate_clusters(db_path, threshold=DEFAULT_THRESHOLD):
+    """
+    Recomputes near-duplicate clusters over every table of the database and
+    replaces the clusters table. Downstream stages drop the duplicates of a
+    table with exclude_duplicates_sql. Returns the clusters DataFrame.
+    """
+    catalog = get_schema_catalog(db_path)
+    with raw_connection(db_path, read_only=False) as conn:
+        titles = read_titles(conn, catalog)
+        clusters = duplicate_clusters(titles, threshold)
+        clusters.to_sql(CLUSTERS_TABLE, conn, if_exists='replace', index=False)
+        conn.execute(f'CREATE INDEX IF NOT EXISTS "ix_{CLUSTERS_TABLE}_lookup" '
+                     f'ON "{CLUSTERS_TABLE}" (scope, table_name, row_id)')
+        conn.commit()
+
+    for scope in SCOPES:
+        scoped = clusters[clusters['scope'] == scope]
+        print(f"  - Near-duplicates ({scope}): {len(scoped) - scoped['is_representative'].sum()} rows "
+              f"in {scoped['cluster_id'].nunique()} clusters out of {len(titles)} titles.")
+    return clusters
+
+def main():
+    parser = argparse.ArgumentParser(description="Find near-duplicate products and write them to the duplicate_clusters table.")
+    parser.add_argument('--db', default=DB_PATH, help="SQLite database to scan.")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="Minimum estimated Jaccard similarity of title shingles (default: %(default)s).")
+    args = parser.parse_args()
+
+    clusters = write_duplicate_clusters(args.db, args.threshold)
+    for (scope, cluster_id), members in clusters.groupby(['scope', 'cluster_id']):
+        print(f"    [{scope} #{cluster_id}] " + ' | '.join(f"{t}:{r} {title}" for t, r, title in
+                                                          members[['table_name', 'row_id', 'title']].itertuples(index=False)))
+
+if __name__ == '__main__':
+    main()
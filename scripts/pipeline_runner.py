@@ -0,0 +1,244 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+import numpy as np
+import pandas as pd
+
+from load_data import load_tables, RAW_DIR
+from preprocess import preprocess_tables, PREPROCESSED_DIR
+from feature_engineering import engineer_tables, FINAL_DIR
+from train_model import train_all_possible_models
+from make_predictions import predict_missing_values
+from category_scheduler import (run_categories, print_category_report, category_failures, category_cache_stats,
+                                category_memory, category_records, CATEGORY_STAGES, DEFAULT_RETRIES)
+from stage_cache import print_cache_stats
+from memory_usage import frame_mb, print_memory
+from instrumentation import measure, add_records, start_run, finish_run, add_report_arguments
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STAGES = ('load', 'preprocess', 'features', 'train', 'predict')
+SCHEDULERS = ('stages', 'categories')
+STAGING_DIRS = {'load': RAW_DIR, 'preprocess': PREPROCESSED_DIR, 'features': FINAL_DIR}
+# The scripts the subprocess chain ran for each stage. There never was a
+# prediction script (final_pipline.py pointed at a missing scripts/predict.py).
+LEGACY_SCRIPTS = {
+    'load': os.path.join('scripts', 'load_data.py'),
+    'preprocess': os.path.join('scripts', 'preprocess.py'),
+    'features': os.path.join('scripts', 'feature_engineering.py'),
+    'train': os.path.join('scripts', 'train_model.py'),
+}
+
+def write_staging_files(tables: dict, directory):
+    os.makedirs(directory, exist_ok=True)
+    for table_name, df in tables.items():
+        df.to_csv(os.path.join(directory, f"{table_name}.csv"), index=False)
+    print(f"  - Wrote {len(tables)} staging files to '{os.path.relpath(directory, PROJECT_ROOT)}'.")
+
+def predict_blanked(row: pd.DataFrame, column):
+    blanked = row.copy()
+    blanked[column] = np.nan
+    try:
+        return predict_missing_values(blanked, copy=False)[column].iloc[0]
+    except Exception as e:
+        print(f"  - WARNING: Could not predict '{column}': {e}")
+        return np.nan
+
+def showcase_predictions(raw_tables: dict, rows_per_category=1):
+    """
+    Runs the prediction engine on the first rows of each category, once with
+    the price blanked out and once with the rating blanked out, and prints
+    the predictions next to the actual values. Returns them as a DataFrame.
+    """
+    results = []
+    for table_name, df in raw_tables.items():
+        for i in range(min(rows_per_category, len(df))):
+            row = df.iloc[[i]].copy()
+            # The models are named after the table, not the Persian category label.
+            row['category'] = table_name
+            results.append({
+                'category': table_name,
+                'price': row['price'].iloc[0], 'predicted_price': predict_blanked(row, 'price'),
+                'rating': row['rating'].iloc[0], 'predicted_rating': predict_blanked(row, 'rating'),
+            })
+    results = pd.DataFrame(results)
+
+    print(f"\n{'category':<18}{'price':>16}{'predicted':>16}{'rating':>10}{'predicted':>12}")
+    for result in results.itertuples(index=False):
+        print(f"{result.category:<18}{result.price:>16,.0f}{result.predicted_price:>16,.0f}"
+              f"{result.rating:>10.2f}{result.predicted_rating:>12.2f}")
+    return results
+
+def run_pipeline(until='predict', write_staging=False, workers=4, force=False, cache_stats=None, compact=False,
+                 memory=None):
+    """
+    Runs the stages up to and including until in this process, handing the
+    DataFrames of one stage straight to the next. With write_staging=True the
+    outputs of the data stages are also written to staging/ as CSV, for
+    debugging or for running a later stage on its own. Preprocessing, feature
+    engineering and training skip the categories whose inputs and code are
+    unchanged (see stage_cache) unless force=True; cache_stats collects the
+    hits and misses. compact=True holds the data in compact dtypes (see
+    memory_usage.compact_dtypes); memory collects each stage's peak RSS and
+    the size of its output. Every stage is measured for the run report.
+    Returns ({stage: seconds}, outputs of the last data stage).
+    """
+    stages = STAGES[:STAGES.index(until) + 1]
+    timings = {}
+    raw = data = None
+
+    for stage in stages:
+        print(f"\n{'=' * 20} Stage: {stage} {'=' * 20}")
+        start = time.perf_counter()
+        with measure(stage, rows_in=sum(len(df) for df in data.values()) if data else None) as record:
+            if stage == 'load':
+                raw = data = load_tables(workers=workers, compact=compact)
+                print(f"  - Loaded {len(raw)} tables: {sum(len(df) for df in raw.values())} rows.")
+            elif stage == 'preprocess':
+                data = preprocess_tables(data, force, cache_stats, compact)
+            elif stage == 'features':
+                data = engineer_tables(data, force, cache_stats)
+            elif stage == 'train':
+                train_all_possible_models(data, force, cache_stats)
+            elif stage == 'predict':
+                record['rows_out'] = len(showcase_predictions(raw))
+
+            if stage in STAGING_DIRS:
+                record['rows_out'] = sum(len(df) for df in data.values())
+            if write_staging and stage in STAGING_DIRS:
+                write_staging_files(data, STAGING_DIRS[stage])
+        timings[stage] = time.perf_counter() - start
+        if memory is not None:
+            memory[stage] = (record['peak_rss_mb'], frame_mb(data) if stage in STAGING_DIRS else None)
+
+    return timings, data
+
+def run_pipeline_by_category(until='predict', write_staging=False, workers=4, retries=DEFAULT_RETRIES,
+                             force=False, cache_stats=None, compact=False, memory=None):
+    """
+    Runs load -> train for each category as its own chain of tasks on a
+    process pool (see category_scheduler), then the predict stage on the
+    categories that made it through. compact and memory are as in run_pipeline,
+    with each stage's peak RSS the largest of its worker processes.
+    Returns ({step: seconds}, failed categories).
+    """
+    data_until = until if until in CATEGORY_STAGES else CATEGORY_STAGES[-1]
+    print(f"\n{'=' * 20} Categories: load -> {data_until} {'=' * 20}")
+    start = time.perf_counter()
+    by_category = run_categories(until=data_until, workers=workers, retries=retries, write_staging=write_staging,
+                                 force=force, compact=compact)
+    timings = {f"load -> {data_until}": time.perf_counter() - start}
+    print_category_report(by_category)
+    if cache_stats is not None:
+        cache_stats.update(category_cache_stats(by_category))
+    if memory is not None:
+        memory.update(category_memory(by_category))
+    add_records(category_records(by_category))
+
+    if until == 'predict':
+        print(f"\n{'=' * 20} Stage: predict {'=' * 20}")
+        start = time.perf_counter()
+        with measure('predict') as record:
+            raw = {table_name: stage_results['load'].value.output for table_name, stage_results in by_category.items()
+                   if all(result.status == 'ok' for result in stage_results.values())}
+            record['rows_out'] = len(showcase_predictions(raw))
+        timings['predict'] = time.perf_counter() - start
+        if memory is not None:
+            memory['predict'] = (record['peak_rss_mb'], None)
+    return timings, category_failures(by_category)
+
+def run_subprocess_chain(until='predict', force=False):
+    """
+    The previous way of running the pipeline: one fresh interpreter per stage,
+    with the stages talking through the staging CSV files; force is passed on
+    to the stages that have a cache. The scripts write staging/ and models/
+    as they always did. Returns {stage: seconds}.
+    """
+    timings = {}
+    for stage in STAGES[:STAGES.index(until) + 1]:
+        if stage not in LEGACY_SCRIPTS:
+            continue
+        start = time.perf_counter()
+        command = [sys.executable, LEGACY_SCRIPTS[stage]] + (['--force'] if force and stage != 'load' else [])
+        subprocess.run(command, check=True, cwd=PROJECT_ROOT,
+                       stdout=subprocess.DEVNULL)
+        timings[stage] = time.perf_counter() - start
+    return timings
+
+def print_timings(timings, legacy_timings=None):
+    if legacy_timings:
+        print("\nBoth runs recomputed every stage (no stage cache hits).")
+    print(f"\n{'stage':<14}{'in-process (s)':>16}" + (f"{'subprocess (s)':>16}" if legacy_timings else ''))
+    for stage, seconds in timings.items():
+        line = f"{stage:<14}{seconds:>16.2f}"
+        if legacy_timings:
+            line += f"{legacy_timings[stage]:>16.2f}" if stage in legacy_timings else f"{'-':>16}"
+        print(line)
+    line = f"{'total':<14}{sum(timings.values()):>16.2f}"
+    if legacy_timings:
+        line += f"{sum(legacy_timings.values()):>16.2f}"
+    print(line)
+
+def main(until='predict', write_staging=False, description="Run the project pipeline in one process."):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--until', choices=STAGES, default=until, help="Last stage to run (default: %(default)s).")
+    staging = parser.add_mutually_exclusive_group()
+    staging.add_argument('--write-staging', dest='write_staging', action='store_true', default=write_staging,
+                         help="Also write each data stage's output to staging/ as CSV.")
+    staging.add_argument('--no-staging', dest='write_staging', action='store_false',
+                         help="Keep every stage's output in memory only.")
+    parser.add_argument('--scheduler', choices=SCHEDULERS, default='stages',
+                        help="stages: each stage finishes every table before the next starts (default). "
+                             "categories: each category runs its own chain of stages on a process pool.")
+    parser.add_argument('--workers', type=int, default=4,
+                        help="Tables read at the same time, or with --scheduler categories, tasks run at the same time.")
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                        help="With --scheduler categories, extra attempts for a failing task (default: %(default)s).")
+    parser.add_argument('--force', action='store_true', help="Recompute every stage, ignoring the stage cache.")
+    parser.add_argument('--compact', action='store_true',
+                        help="Hold the data in float32/int32 and category dtypes to save memory.")
+    add_report_arguments(parser, list(STAGES))
+    parser.add_argument('--compare', action='store_true',
+                        help="Afterwards, time the old one-subprocess-per-stage chain over the same stages. "
+                             "Both runs recompute every stage (implies --force), and the chain rewrites the "
+                             "staging files and models.")
+    args = parser.parse_args()
+    if args.compare and not args.force:
+        # A warm stage cache filled by the first run would turn the second
+        # run's stages into cache lookups, so both run cold.
+        print("  - --compare: recomputing every stage in both runs (--force), so neither reads the other's cache.")
+        args.force = True
+    # With --scheduler categories only predict runs in this process, so only it can be profiled.
+    start_run('pipeline', args.profile)
+
+    print("====== Starting In-Process Pipeline ======")
+    start = time.perf_counter()
+    failures = []
+    cache_stats, memory = {}, {}
+    if args.scheduler == 'categories':
+        timings, failures = run_pipeline_by_category(args.until, args.write_staging, args.workers, args.retries,
+                                                     args.force, cache_stats, args.compact, memory)
+    else:
+        timings, _ = run_pipeline(args.until, args.write_staging, args.workers, args.force, cache_stats, args.compact,
+                                  memory)
+    wall_time = time.perf_counter() - start
+
+    legacy_timings = None
+    if args.compare:
+        print("\nTiming the subprocess chain for comparison (every stage recomputed; "
+              "it rewrites staging/ and models/)...")
+        legacy_timings = run_subprocess_chain(args.until, args.force)
+
+    print_timings(timings, legacy_timings)
+    print_memory(memory)
+    print_cache_stats(cache_stats)
+    finish_run(args)
+    if failures:
+        print(f"\n====== ❌ Pipeline finished in {wall_time:.2f}s; failed categories: {', '.join(failures)} ======")
+        sys.exit(1)
+    print(f"\n====== ✅ Pipeline finished in {wall_time:.2f}s ======")
+
+if __name__ == '__main__':
+    main()
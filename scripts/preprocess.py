@@ -3,75 +3,430 @@ import os
 import glob
 from sklearn.preprocessing import MinMaxScaler, LabelEncoder
 import numpy as np
+import argparse
+import joblib
+from collections import namedtuple
+from import_manifest import hash_source
+from stage_cache import cached_stage, record_cache_stats, print_cache_stats
+from memory_usage import compact_dtypes, is_text_dtype
+from instrumentation import measure, record_skip, start_run, finish_run, add_report_arguments
 
 RAW_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'staging', '01_raw')
 PREPROCESSED_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'staging', '02_preprocessed')
+MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'models')
 os.makedirs(PREPROCESSED_DIR, exist_ok=True)
 
-def process_single_dataframe(df: pd.DataFrame) -> pd.DataFrame:
-    
-    cols_to_drop = ['title', 'image_path', 'product_url', 'url']
-    df.drop(columns=cols_to_drop, inplace=True, errors='ignore')
+COLS_TO_DROP = ['title', 'image_path', 'product_url', 'url']
+COLS_TO_EXCLUDE_FROM_SCALING = ['price', 'rating']
+
+# Chunked mode (--chunk-size): rows per chunk by default.
+CHUNK_SIZE = 50_000
+# Chunked mode counts every distinct value of a column to get its exact
+# median. A numeric column with more distinct values than this switches to a
+# log-bucket sketch, whose median is within RELATIVE_ACCURACY of the exact one.
+MAX_EXACT_VALUES = 100_000
+RELATIVE_ACCURACY = 0.001
 
-    df.dropna(axis=1, how='all', inplace=True)
+# State fitted in chunked mode: the preprocessing state, the dtype each kept
+# column has in the in-memory path, and the columns whose median is estimated.
+ChunkedFit = namedtuple('ChunkedFit', ['state', 'dtypes', 'estimated', 'rows'])
 
+def preprocessor_path(category_name):
+    return os.path.join(MODELS_DIR, f"{category_name}_preprocessor.joblib")
+
+def fit_preprocessor(df: pd.DataFrame) -> dict:
+    """
+    Learns the preprocessing state of one category from its raw table: the
+    columns kept, the fill value of each column (median or mode), the classes
+    of each label-encoded column and the min-max scaling of the numeric
+    columns. transform_dataframe applies it to any batch of the category.
+    """
+    df = df.drop(columns=COLS_TO_DROP, errors='ignore').dropna(axis=1, how='all')
+
+    fill_values = {}
     for col in df.columns:
         if pd.api.types.is_numeric_dtype(df[col]):
-            if df[col].isnull().sum() > 0:
-                median_val = df[col].median()
-                df[col] = df[col].fillna(median_val)
-        elif pd.api.types.is_object_dtype(df[col]):
-            if df[col].isnull().sum() > 0:
-                if not df[col].mode().empty:
-                    mode_val = df[col].mode()[0]
-                    df[col] = df[col].fillna(mode_val)
-
-    le = LabelEncoder()
-    object_cols = df.select_dtypes(include=['object']).columns
-    
-    if len(object_cols) > 0:
-        for col in object_cols:
-            df[col] = le.fit_transform(df[col])
+            fill_values[col] = df[col].median()
+        elif is_text_dtype(df[col]) and not df[col].mode().empty:
+            fill_values[col] = df[col].mode()[0]
+    filled = df.fillna(fill_values)
 
-    all_numeric_cols = df.select_dtypes(include=np.number).columns.tolist()
-    
-    cols_to_exclude_from_scaling = ['price', 'rating']
-    
-    cols_to_scale = [col for col in all_numeric_cols if col not in cols_to_exclude_from_scaling]
+    object_cols = [col for col in filled.columns if is_text_dtype(filled[col])]
+    classes = {col: LabelEncoder().fit(filled[col].to_numpy(dtype=object)).classes_ for col in object_cols}
 
+    # Label-encoded columns are numeric too, so they are scaled with the rest, in table order.
+    numeric_cols = filled.select_dtypes(include=np.number).columns.tolist()
+    cols_to_scale = [col for col in filled.columns if (col in classes or col in numeric_cols)
+                     and col not in COLS_TO_EXCLUDE_FROM_SCALING]
+    scaler = MinMaxScaler()
     if cols_to_scale:
-        scaler = MinMaxScaler()
-        df[cols_to_scale] = scaler.fit_transform(df[cols_to_scale])
+        scaler.fit(pd.DataFrame({
+            col: np.searchsorted(classes[col], filled[col].to_numpy(dtype=object)) if col in classes else filled[col]
+            for col in cols_to_scale
+        }))
+
+    return {
+        'columns': df.columns.tolist(),
+        'numeric_columns': [col for col in df.columns if pd.api.types.is_numeric_dtype(df[col])],
+        'fill_values': fill_values,
+        'classes': classes,
+        'scaled_columns': cols_to_scale,
+        'scale': scaler.scale_ if cols_to_scale else np.empty(0),
+        'offset': scaler.min_ if cols_to_scale else np.empty(0),
+    }
 
+def transform_dataframe(df: pd.DataFrame, state: dict) -> pd.DataFrame:
+    """
+    Applies a fitted preprocessing state to a batch of rows, without refitting
+    anything: the batch is aligned to the fitted columns (unknown columns are
+    dropped, missing ones read as empty), gaps are filled with the fitted
+    values, text is encoded with the fitted classes (a value never seen in
+    training gets the code of the column's fill value) and the numeric
+    columns are scaled with the fitted minima and ranges.
+    """
+    df = df.reindex(columns=state['columns'])
+    for col in state['numeric_columns']:
+        if not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    df = df.fillna(state['fill_values'])
+
+    for col, classes in state['classes'].items():
+        codes = pd.Categorical(df[col], categories=classes).codes.astype(np.int64)
+        fill_value = state['fill_values'].get(col)
+        if (codes < 0).any():
+            codes[codes < 0] = np.searchsorted(classes, fill_value) if fill_value in classes else 0
+        df[col] = codes
+
+    cols_to_scale = state['scaled_columns']
+    if cols_to_scale:
+        values = df[cols_to_scale].to_numpy(dtype=np.float64)
+        values *= state['scale']
+        values += state['offset']
+        df[cols_to_scale] = values
     return df
 
+def process_single_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Fits the preprocessing state on df and applies it to df (the training
+    data of a category). New data is transformed with the saved state instead.
+    """
+    return transform_dataframe(df, fit_preprocessor(df))
+
+def fit_and_save_preprocessor(df: pd.DataFrame, category_name, compact=False) -> pd.DataFrame:
+    """
+    Fits the preprocessing state of a category, saves it next to its models
+    for make_predictions and returns the preprocessed training data, in
+    compact dtypes with compact=True (see memory_usage.compact_dtypes).
+    """
+    state = fit_preprocessor(df)
+    os.makedirs(MODELS_DIR, exist_ok=True)
+    joblib.dump(state, preprocessor_path(category_name))
+    processed = transform_dataframe(df, state)
+    return compact_dtypes(processed) if compact else processed
+
+def load_preprocessor(category_name):
+    """
+    The saved preprocessing state of a category, or None if it was never fitted.
+    """
+    path = preprocessor_path(category_name)
+    return joblib.load(path) if os.path.exists(path) else None
+
+def iter_raw_chunks(file_path, chunk_size=CHUNK_SIZE, dtype=None, columns=None):
+    """
+    Reads a raw file chunk_size rows at a time. dtype is passed to read_csv;
+    Arrow files keep their own types, except that columns given in a dtype
+    dict are cast to it.
+    """
+    if not file_path.endswith('.arrow'):
+        yield from pd.read_csv(file_path, chunksize=chunk_size, dtype=dtype, usecols=columns)
+        return
+    import pyarrow as pa
+
+    with pa.memory_map(file_path) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            for start in range(0, batch.num_rows, chunk_size):
+                chunk = batch.slice(start, chunk_size).to_pandas()
+                if columns is not None:
+                    chunk = chunk[columns]
+                if isinstance(dtype, dict):
+                    chunk = chunk.astype({col: kind for col, kind in dtype.items() if col in chunk.columns})
+                yield chunk
+
+def quantize(values: pd.Series) -> pd.Series:
+    """
+    Maps numbers to the middle of their log bucket, each bucket spanning a
+    factor of (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY), so a value's
+    bucket is within RELATIVE_ACCURACY of it. Zero stays zero.
+    """
+    gamma = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    magnitude = values.abs().to_numpy(dtype=np.float64)
+    buckets = np.zeros(len(values))
+    nonzero = magnitude > 0
+    index = np.ceil(np.log(magnitude[nonzero]) / np.log(gamma))
+    buckets[nonzero] = np.sign(values.to_numpy(dtype=np.float64)[nonzero]) * 2 * gamma ** index / (gamma + 1)
+    return pd.Series(buckets, index=values.index)
+
+def numeric_keys(counts: pd.Series):
+    """
+    The counted values as numbers, with read_csv's rules: None when any of
+    them is not a number (the column is text).
+    """
+    numbers = pd.to_numeric(pd.Series(counts.index, dtype=object), errors='coerce')
+    return None if numbers.isna().any() else numbers
+
+def update_column_stats(stats: dict, series: pd.Series, typed: bool):
+    """
+    Adds a chunk of one column to its running statistics: the count of
+    each distinct value (or of each sketch bucket), the number of missing
+    cells, and, once sketched, the exact minimum and maximum.
+    """
+    stats['missing'] += int(series.isna().sum())
+    values = series.dropna()
+    if typed and is_text_dtype(series):
+        stats['text'] = True
+    if stats['sketched']:
+        numbers = pd.to_numeric(values, errors='coerce')
+        if numbers.isna().any():
+            raise ValueError(f"'{series.name}' has text after more than {MAX_EXACT_VALUES} distinct numbers; "
+                             f"preprocess it in memory instead.")
+        if len(numbers):
+            stats['min'] = min(stats['min'], numbers.min())
+            stats['max'] = max(stats['max'], numbers.max())
+            stats['integer'] = stats['integer'] and pd.api.types.is_integer_dtype(numbers)
+        values = quantize(numbers)
+    stats['counts'] = stats['counts'].add(values.value_counts(), fill_value=0)
+
+    if not stats['sketched'] and not stats['text'] and len(stats['counts']) > MAX_EXACT_VALUES:
+        numbers = numeric_keys(stats['counts'])
+        if numbers is None:
+            stats['text'] = True
+            return
+        stats.update(sketched=True, min=numbers.min(), max=numbers.max(),
+                     integer=pd.api.types.is_integer_dtype(numbers))
+        counts = pd.Series(stats['counts'].to_numpy(), index=quantize(numbers).to_numpy())
+        stats['counts'] = counts.groupby(level=0).sum()
+
+def weighted_median(counts: pd.Series):
+    """
+    The median of values given as {value: count}, as Series.median computes
+    it: the middle value, or the mean of the two middle ones.
+    """
+    counts = counts.sort_index()
+    cumulative = counts.to_numpy().cumsum()
+    total = cumulative[-1]
+    lower, upper = (counts.index[np.searchsorted(cumulative, rank, side='right')]
+                    for rank in ((total - 1) // 2, total // 2))
+    return np.float64(lower) if lower == upper else (np.float64(lower) + np.float64(upper)) / 2
+
+def fit_preprocessor_chunked(file_path, chunk_size=CHUNK_SIZE) -> ChunkedFit:
+    """
+    Learns the state fit_preprocessor would learn from the whole file, in one
+    streaming pass that holds a chunk and per-column value counts at a time.
+    Medians come from the counts (exact, unless the column has more than
+    MAX_EXACT_VALUES distinct numbers), modes from the most frequent value,
+    classes from the distinct values and the scaling from the minima and
+    maxima. CSV cells are read as text and each column's type is decided
+    once from all its values, as read_csv decides it for the whole file.
+    """
+    typed = file_path.endswith('.arrow')
+    columns, column_stats, rows = None, {}, 0
+    for chunk in iter_raw_chunks(file_path, chunk_size, dtype=None if typed else str):
+        if columns is None:
+            columns = [col for col in chunk.columns if col not in COLS_TO_DROP]
+            column_stats = {col: {'counts': pd.Series(dtype=np.float64), 'missing': 0, 'text': False,
+                                  'sketched': False, 'min': np.inf, 'max': -np.inf, 'integer': True}
+                            for col in columns}
+        for col in columns:
+            update_column_stats(column_stats[col], chunk[col], typed)
+        rows += len(chunk)
+    if columns is None:
+        columns = []
+
+    columns = [col for col in columns if len(column_stats[col]['counts'])]
+    fill_values, classes, dtypes, bounds, estimated = {}, {}, {}, {}, []
+    for col in columns:
+        stats = column_stats[col]
+        numbers = None if stats['text'] or stats['sketched'] else numeric_keys(stats['counts'])
+        if stats['sketched'] or numbers is not None:
+            if stats['sketched']:
+                counts = stats['counts']
+                low, high, integer = stats['min'], stats['max'], stats['integer']
+                estimated.append(col)
+            else:
+                counts = pd.Series(stats['counts'].to_numpy(), index=numbers.to_numpy()).groupby(level=0).sum()
+                low, high, integer = numbers.min(), numbers.max(), pd.api.types.is_integer_dtype(numbers)
+            fill_values[col] = weighted_median(counts)
+            dtypes[col] = 'int64' if integer and stats['missing'] == 0 else 'float64'
+            bounds[col] = (low, high)
+        else:
+            counts = stats['counts']
+            top = counts[counts == counts.max()].index
+            fill_values[col] = sorted(top)[0]
+            classes[col] = np.array(sorted(counts.index), dtype=object)
+            dtypes[col] = object
+            bounds[col] = (0, len(classes[col]) - 1)
+
+    cols_to_scale = [col for col in columns if col not in COLS_TO_EXCLUDE_FROM_SCALING]
+    scaler = MinMaxScaler()
+    if cols_to_scale:
+        # Fitting on the minima and maxima gives the same scaling as fitting on every row.
+        scaler.fit(pd.DataFrame([{col: bounds[col][0] for col in cols_to_scale},
+                                 {col: bounds[col][1] for col in cols_to_scale}], columns=cols_to_scale))
+
+    state = {
+        'columns': columns,
+        'numeric_columns': [col for col in columns if col not in classes],
+        'fill_values': fill_values,
+        'classes': classes,
+        'scaled_columns': cols_to_scale,
+        'scale': scaler.scale_ if cols_to_scale else np.empty(0),
+        'offset': scaler.min_ if cols_to_scale else np.empty(0),
+    }
+    return ChunkedFit(state, dtypes, estimated, rows)
+
+def preprocess_file_chunked(file_path, category_name, output_path, chunk_size=CHUNK_SIZE):
+    """
+    Preprocesses a raw file that need not fit in memory, in two streaming
+    passes: fit_preprocessor_chunked learns the state, which is saved like
+    fit_and_save_preprocessor saves it, then each chunk is read with the
+    column types of the whole file, transformed and appended to output_path.
+
+    The output matches the in-memory path exactly while every numeric column
+    has at most MAX_EXACT_VALUES distinct values. Beyond that, only the gaps
+    filled in the sketched columns differ, by at most RELATIVE_ACCURACY
+    (relative). Memory holds one chunk plus the value counts, which grow with
+    the distinct values, not the rows. Returns the ChunkedFit.
+    """
+    fit = fit_preprocessor_chunked(file_path, chunk_size)
+    os.makedirs(MODELS_DIR, exist_ok=True)
+    joblib.dump(fit.state, preprocessor_path(category_name))
+
+    columns = fit.state['columns']
+    written = False
+    for chunk in iter_raw_chunks(file_path, chunk_size, dtype=fit.dtypes, columns=columns):
+        transform_dataframe(chunk, fit.state).to_csv(output_path, mode='a' if written else 'w',
+                                                     header=not written, index=False)
+        written = True
+    if not written:
+        pd.DataFrame(columns=columns).to_csv(output_path, index=False)
+    return fit
+
+def find_raw_files(raw_dir):
+    """
+    One input file per table: load_data.py writes <table>.csv or, with
+    --format arrow, <table>.arrow. When both exist the newer one wins.
+    """
+    latest = {}
+    for file_path in glob.glob(os.path.join(raw_dir, '*.csv')) + glob.glob(os.path.join(raw_dir, '*.arrow')):
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        if name not in latest or os.path.getmtime(file_path) > os.path.getmtime(latest[name]):
+            latest[name] = file_path
+    return sorted(latest.values())
+
+def read_raw_file(file_path):
+    if file_path.endswith('.arrow'):
+        import pyarrow.feather
+
+        # Typed columns, memory-mapped instead of parsed.
+        return pyarrow.feather.read_table(file_path, memory_map=True).to_pandas()
+    return pd.read_csv(file_path)
+
+def preprocessing_code_hash():
+    return hash_source([fit_preprocessor, transform_dataframe, fit_and_save_preprocessor, compact_dtypes,
+                        is_text_dtype])
+
+def preprocess_table(df: pd.DataFrame, table_name, force=False, stats=None, compact=False) -> pd.DataFrame:
+    """
+    Fits and saves the table's preprocessor and preprocesses the table
+    (fit_and_save_preprocessor), through the stage cache: the cached output
+    is reused while the table's data, the preprocessing code and the saved
+    preprocessor are unchanged.
+    """
+    output = cached_stage('preprocess', table_name, fit_and_save_preprocessor, df, args=(table_name, compact),
+                          code_hash=preprocessing_code_hash(), force=force,
+                          artifacts=lambda value: [preprocessor_path(table_name)])
+    if stats is not None:
+        record_cache_stats(stats, 'preprocess', output)
+    if output.hit:
+        print(f"      - Unchanged since the last run; reusing the cached output.")
+    return output.value
+
+def preprocess_tables(tables: dict, force=False, stats=None, compact=False) -> dict:
+    """
+    Runs preprocess_table over {table_name: raw DataFrame} in memory,
+    through the stage cache. A table that fails is reported and left out, as in main().
+    """
+    processed = {}
+    for table_name, df in tables.items():
+        print(f"    - Preprocessing '{table_name}'...")
+        try:
+            with measure('preprocess', table_name, rows_in=len(df)) as record:
+                processed[table_name] = preprocess_table(df, table_name, force, stats, compact)
+                record['rows_out'] = len(processed[table_name])
+            print(f"      - Successfully processed. Final shape: {processed[table_name].shape}")
+        except Exception as e:
+            print(f"    - ERROR: Failed to process '{table_name}'. Details: {e}")
+    return processed
+
 def main():
+    parser = argparse.ArgumentParser(description="Preprocess the raw staging files.")
+    parser.add_argument('--force', action='store_true', help="Recompute every table, ignoring the stage cache.")
+    parser.add_argument('--chunk-size', type=int, metavar='ROWS',
+                        help="Stream each file in chunks of this many rows instead of loading it whole "
+                             "(two passes; bypasses the stage cache).")
+    add_report_arguments(parser, ['preprocess'])
+    args = parser.parse_args()
+    start_run('preprocess', args.profile)
+
     print(f"--- [2/3] Running preprocess.py ---")
     
-    input_files = glob.glob(os.path.join(RAW_DIR, '*.csv'))
+    input_files = find_raw_files(RAW_DIR)
     
     if not input_files:
         print(f"  - WARNING: No raw data files found in '{os.path.basename(RAW_DIR)}'.")
+        record_skip('preprocess', f"No raw data files found in '{os.path.basename(RAW_DIR)}'.")
+        finish_run(args)
         return
 
     print(f"  - Found {len(input_files)} files to preprocess...")
+    stats = {}
 
-    for file_path in input_files:
-        file_name = os.path.basename(file_path)
-        print(f"    - Preprocessing '{file_name}'...")
-        
-        try:
-            df = pd.read_csv(file_path)
-            processed_df = process_single_dataframe(df)
-            output_path = os.path.join(PREPROCESSED_DIR, file_name)
-            processed_df.to_csv(output_path, index=False)
-            print(f"      - Successfully processed. Final shape: {processed_df.shape}")
-            
-        except Exception as e:
-            print(f"    - ERROR: Failed to process '{file_name}'. Details: {e}")
-            continue
-        
+    with measure('preprocess'):
+        for file_path in input_files:
+            file_name = os.path.splitext(os.path.basename(file_path))[0] + '.csv'
+            print(f"    - Preprocessing '{os.path.basename(file_path)}'...")
+
+            try:
+                if args.chunk_size:
+                    with measure('preprocess', os.path.splitext(file_name)[0]) as record:
+                        fit = preprocess_file_chunked(file_path, os.path.splitext(file_name)[0],
+                                                      os.path.join(PREPROCESSED_DIR, file_name), args.chunk_size)
+                        record.update(rows_in=fit.rows, rows_out=fit.rows)
+                        record['details']['estimated_medians'] = fit.estimated
+                    print(f"      - Successfully processed in chunks of {args.chunk_size}. "
+                          f"Final shape: {(fit.rows, len(fit.state['columns']))}")
+                    if fit.estimated:
+                        print(f"      - Medians estimated within {RELATIVE_ACCURACY:.1%}: {', '.join(fit.estimated)}")
+                    continue
+
+                with measure('preprocess', os.path.splitext(file_name)[0]) as record:
+                    df = read_raw_file(file_path)
+                    record['rows_in'] = len(df)
+                    processed_df = preprocess_table(df, os.path.splitext(file_name)[0], args.force, stats)
+                    output_path = os.path.join(PREPROCESSED_DIR, file_name)
+                    processed_df.to_csv(output_path, index=False)
+                    record['rows_out'] = len(processed_df)
+                print(f"      - Successfully processed. Final shape: {processed_df.shape}")
+
+            except Exception as e:
+                print(f"    - ERROR: Failed to process '{file_name}'. Details: {e}")
+                continue
+
+    print_cache_stats(stats)
     print(f"  - ✅ Preprocessing complete for all files.")
+    finish_run(args)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,213 @@
+import time
+import argparse
+import pandas as pd
+
+from database_connection import DB_PATH, CLUSTERS_TABLE, DERIVED_TABLES, get_schema_catalog, raw_connection
+from near_duplicates import title_series, normalize_titles, exclude_duplicates_sql
+
+SEARCH_TABLE = 'product_search'
+# Indexed columns, in the order of their bm25 weights: a match in the title
+# counts most, then the brand, then the product type.
+SEARCH_COLUMNS = ('title', 'brand', 'type')
+RANK_WEIGHTS = (10.0, 4.0, 2.0)
+# The table name is indexed too, as one token ('_' is a token character), so
+# a category filter is a lookup in the index rather than a check of every
+# match; free text is only matched against SEARCH_COLUMNS.
+# Prefix indexes for 2- and 3-character prefixes, so short search-as-you-type
+# queries are answered from the index instead of scanning every term.
+PREFIX_LENGTHS = '2 3'
+DEFAULT_LIMIT = 10
+# bm25 has to score every match before the best can be picked, about 0.5ms
+# per thousand matches: a bare category word over a million rows matches
+# ~130k products and takes 70-100ms to rank. Every match is ranked by
+# default; a caller that needs a bounded latency can rank only the first
+# matches in index order, e.g. this many, at the cost of results that may
+# not be the best ones (reported as truncated).
+MAX_RANKED_MATCHES = 20_000
+
+# Folds the Arabic letter variants and marks that normalize_text leaves alone:
+# hamza forms and alef madda to the bare letter, teh marbuta and heh with yeh
+# to heh, and the harakat dropped, so 'آبمیوه' matches 'ابمیوه' and 'مَدل' matches 'مدل'.
+SEARCH_FOLD_TABLE = str.maketrans({
+    'آ': 'ا', 'أ': 'ا', 'إ': 'ا', 'ٱ': 'ا', 'ؤ': 'و', 'ئ': 'ی', 'ة': 'ه', 'ۀ': 'ه', 'ء': None, 'ٰ': None,
+    **{chr(code): None for code in range(0x064B, 0x0660)},
+})
+
+def normalize_search_text(series: pd.Series) -> pd.Series:
+    """
+    The normalization applied to indexed text and to queries alike: Persian
+    and Arabic digits and letter forms unified, ZWNJ and punctuation turned
+    into spaces, lower case (see near_duplicates.normalize_titles), and the
+    letter variants in SEARCH_FOLD_TABLE folded. Missing cells and the
+    cleaner's 'nan' become ''.
+    """
+    series = pd.Series(series, dtype=object)
+    series = series.where(series.notna() & (series.astype(str) != 'nan'), '')
+    return normalize_titles(series).str.translate(SEARCH_FOLD_TABLE)
+
+def search_index_exists(db_path=None):
+    with raw_connection(db_path) as conn:
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (SEARCH_TABLE,)).fetchone() is not None
+
+def read_documents(conn, table, columns, has_clusters):
+    """
+    Reads the searchable text of one category table: the title (the title
+    column or the product URL slug), the brand and the type when the table
+    has them. Near-duplicates of another product are left out.
+    """
+    source = next((col for col in ('title', 'product_url') if col in columns), None)
+    if source is None:
+        return None
+    wanted = [source] + [col for col in ('brand', 'type') if col in columns]
+    selected = ', '.join(f'"{col}"' for col in wanted)
+    query = f'SELECT rowid AS row_id, {selected} FROM "{table}"'
+    params = {}
+    if has_clusters:
+        query += f' WHERE {exclude_duplicates_sql()}'
+        params = {'table_name': table}
+    df = pd.read_sql_query(query, conn, params=params)
+
+    product = title_series(df).fillna('')
+    documents = pd.DataFrame({'title': normalize_search_text(product)})
+    for col in ('brand', 'type'):
+        documents[col] = normalize_search_text(df[col]) if col in df.columns else ''
+    documents['product'] = product
+    documents['table_name'] = table
+    documents['row_id'] = df['row_id']
+    return documents
+
+def write_search_index(db_path=None):
+    """
+    Rebuilds the FTS5 index over the title, brand and type of every category
+    table. The indexed text is normalized with normalize_search_text, since
+    Python cannot register a custom FTS5 tokenizer; FTS5's unicode61
+    tokenizer then splits it on the spaces. Each row also stores the
+    product title as shown, its table and its rowid. Returns the number of
+    products indexed.
+    """
+    catalog = get_schema_catalog(db_path)
+    has_clusters = CLUSTERS_TABLE in catalog
+    column_list = ', '.join(SEARCH_COLUMNS)
+    rows = 0
+    with raw_connection(db_path, read_only=False) as conn:
+        conn.execute(f'DROP TABLE IF EXISTS "{SEARCH_TABLE}"')
+        conn.execute(
+            f'CREATE VIRTUAL TABLE "{SEARCH_TABLE}" USING fts5('
+            f'{column_list}, table_name, product UNINDEXED, row_id UNINDEXED, '
+            f"tokenize = \"unicode61 tokenchars '_'\", prefix = '{PREFIX_LENGTHS}')"
+        )
+        insert = (f'INSERT INTO "{SEARCH_TABLE}" ({column_list}, table_name, product, row_id) '
+                  f'VALUES ({", ".join("?" * (len(SEARCH_COLUMNS) + 3))})')
+        for table, columns in catalog.items():
+            if table in DERIVED_TABLES:
+                continue
+            documents = read_documents(conn, table, columns, has_clusters)
+            if documents is None:
+                continue
+            records = documents[list(SEARCH_COLUMNS) + ['table_name', 'product', 'row_id']]
+            conn.executemany(insert, records.itertuples(index=False, name=None))
+            rows += len(documents)
+
+        weights = ', '.join(str(weight) for weight in RANK_WEIGHTS + (0.0,))
+        conn.execute(f'INSERT INTO "{SEARCH_TABLE}" ("{SEARCH_TABLE}", rank) VALUES (\'rank\', \'bm25({weights})\')')
+        conn.execute(f'INSERT INTO "{SEARCH_TABLE}" ("{SEARCH_TABLE}") VALUES (\'optimize\')')
+        conn.commit()
+
+    print(f"  - Search index '{SEARCH_TABLE}': {rows} products from {len(set(catalog) - set(DERIVED_TABLES))} tables.")
+    return rows
+
+def match_expression(query, prefix=True, categories=None):
+    """
+    Turns a free-text query into an FTS5 MATCH expression: every normalized
+    token must appear in the title, brand or type, and with prefix=True the
+    last token may be the start of a word, for search-as-you-type. categories
+    adds a filter on the indexed table name. Returns '' for a query with no tokens.
+    """
+    tokens = normalize_search_text(pd.Series([query])).iloc[0].split()
+    if not tokens:
+        return ''
+    terms = [f'"{token}"' for token in tokens]
+    if prefix:
+        terms[-1] += '*'
+    expression = f"{{{' '.join(SEARCH_COLUMNS)}}} : ({' '.join(terms)})"
+    if categories:
+        expression += ' AND table_name : (' + ' OR '.join(f'"{table}"' for table in categories) + ')'
+    return expression
+
+def search_products(query, limit=DEFAULT_LIMIT, categories=None, prefix=True, db_path=None,
+                    max_ranked=None) -> pd.DataFrame:
+    """
+    Ranked product search across every category, best matches first (FTS5
+    bm25 with RANK_WEIGHTS; lower scores are better). categories limits the
+    results to some tables. Every match is ranked unless max_ranked is set,
+    in which case only the first max_ranked matches in index order are (see
+    MAX_RANKED_MATCHES) and results.attrs['truncated'] says whether the query
+    had more matches than that. Returns table_name, row_id, product, brand,
+    type and score.
+    """
+    columns = ['table_name', 'row_id', 'product', 'brand', 'type', 'score']
+    expression = match_expression(query, prefix, categories)
+    if not expression:
+        results = pd.DataFrame(columns=columns)
+        results.attrs['truncated'] = False
+        return results
+
+    # Rank first, then read the stored columns of the top rows only: selecting
+    # them in the ranking query would read them for every match. A plain
+    # ORDER BY score LIMIT keeps only the best rows while scoring, where
+    # FTS5's ORDER BY rank sorts every match.
+    weights = ', '.join(str(weight) for weight in RANK_WEIGHTS + (0.0,))
+    score = f'bm25("{SEARCH_TABLE}", {weights}) AS score'
+    if max_ranked is None:
+        top = f'SELECT rowid, {score} FROM "{SEARCH_TABLE}" WHERE "{SEARCH_TABLE}" MATCH ? ORDER BY score LIMIT ?'
+        params = (expression, limit)
+    else:
+        matches = f'SELECT rowid, {score} FROM "{SEARCH_TABLE}" WHERE "{SEARCH_TABLE}" MATCH ? LIMIT ?'
+        top = f'SELECT rowid, score FROM ({matches}) ORDER BY score LIMIT ?'
+        params = (expression, max_ranked, limit)
+    sql = (f'SELECT s.table_name, s.row_id, s.product, s.brand, s.type, top.score '
+           f'FROM ({top}) AS top JOIN "{SEARCH_TABLE}" AS s ON s.rowid = top.rowid ORDER BY top.score')
+    with raw_connection(db_path) as conn:
+        rows = conn.execute(sql, params).fetchall()
+        truncated = False
+        if max_ranked is not None:
+            # Counting matches needs no bm25 scores, so it is cheap next to ranking them.
+            count = (f'SELECT count(*) FROM (SELECT rowid FROM "{SEARCH_TABLE}" '
+                     f'WHERE "{SEARCH_TABLE}" MATCH ? LIMIT ?)')
+            truncated = conn.execute(count, (expression, max_ranked + 1)).fetchone()[0] > max_ranked
+    results = pd.DataFrame(rows, columns=columns)
+    results.attrs['truncated'] = truncated
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Search products by title, brand and type across every category.")
+    parser.add_argument('query', nargs='?', help="Search text, in Persian or English.")
+    parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT, help="Results to show (default: %(default)s).")
+    parser.add_argument('--categories', nargs='+', help="Only search these tables.")
+    parser.add_argument('--exact', action='store_true', help="Match whole words only; by default the last word is a prefix.")
+    parser.add_argument('--max-ranked', type=int, metavar='N',
+                        help=f"Rank only the first N matches in index order (e.g. {MAX_RANKED_MATCHES:,}) to bound "
+                             f"the latency of broad queries; by default every match is ranked.")
+    parser.add_argument('--rebuild', action='store_true', help="Rebuild the search index first.")
+    parser.add_argument('--db', default=DB_PATH, help="SQLite database to search.")
+    args = parser.parse_args()
+
+    if args.rebuild or not search_index_exists(args.db):
+        print("Building the product search index...")
+        write_search_index(args.db)
+    if not args.query:
+        return
+
+    start = time.perf_counter()
+    results = search_products(args.query, args.limit, args.categories, not args.exact, args.db, args.max_ranked)
+    elapsed = time.perf_counter() - start
+    print(f"--- {len(results)} results for '{args.query}' (MATCH {match_expression(args.query, not args.exact, args.categories)}) "
+          f"in {elapsed * 1000:.2f} ms ---")
+    if not results.empty:
+        print(results.to_string(index=False))
+    if results.attrs['truncated']:
+        print(f"  - Note: more than {args.max_ranked:,} products matched; only the first {args.max_ranked:,} in "
+              f"index order were ranked, so these may not be the best matches.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+import os
+import time
+import random
+import argparse
+import threading
+import pandas as pd
+from collections import OrderedDict
+
+from database_connection import (
+    DB_PATH, STATS_TABLE, RATINGS_TABLE, TOP_ITEMS_TABLE, raw_connection, get_column_types, get_category_tables,
+)
+from near_duplicates import url_title
+
+# Keywords that identify a column's role, in order of preference. Matching
+# scans the columns in table order and takes the first that contains any
+# keyword; for numeric roles a column with a numeric declared type wins over
+# a text one (the typed measurement columns, e.g. 'capacity_l').
+ROLE_KEYWORDS = {
+    'title': ['title', 'نام', 'محصول'],
+    'price': ['price', 'قیمت'],
+    'rating': ['rating', 'stars', 'امتیاز'],
+    'capacity': ['capacity', 'ظرفیت', 'توان', 'وزن', 'power', 'weight'],
+}
+NUMERIC_ROLES = ('price', 'rating', 'capacity')
+INTEGER_TYPES = {'BIGINT', 'INTEGER', 'SMALLINT'}
+NUMERIC_TYPES = {'FLOAT', 'REAL'} | INTEGER_TYPES
+
+DEFAULT_LIMIT = 5
+# Length of the per-category top lists kept by the import (see aggregates);
+# top-N queries up to this limit are read from them.
+SUMMARY_TOP_N = 20
+SAMPLE_ATTEMPTS = 10
+RESULT_CACHE_SIZE = 256
+
+_roles = {}
+_results = OrderedDict()
+_lock = threading.Lock()
+
+def find_col_by_keyword(columns, keywords):
+    for col in columns:
+        for keyword in keywords:
+            if keyword in str(col).lower():
+                return col
+    return None
+
+def get_tables(db_path=None):
+    return get_category_tables(db_path)
+
+def column_roles(table, db_path=None):
+    """
+    Returns {role: column or None} for title, price, rating and capacity.
+    Tables without a title column get 'product_url', whose slug is the
+    product title (see near_duplicates.url_title). The mapping is computed
+    once per table and schema: the catalog it is built from is cached on the
+    database's schema_version.
+    """
+    declared_types = get_column_types(db_path)[table]
+    key = (os.path.abspath(db_path or DB_PATH), table, tuple(declared_types.items()))
+    roles = _roles.get(key)
+    if roles is not None:
+        return roles
+
+    columns = list(declared_types)
+    roles = {}
+    for role, keywords in ROLE_KEYWORDS.items():
+        if role in NUMERIC_ROLES:
+            typed = [col for col in columns if declared_types[col] in NUMERIC_TYPES]
+            roles[role] = find_col_by_keyword(typed, keywords) or find_col_by_keyword(columns, keywords)
+        else:
+            roles[role] = find_col_by_keyword(columns, keywords)
+    if roles['title'] is None:
+        roles['title'] = 'product_url' if 'product_url' in columns else columns[0]
+    _roles[key] = roles
+    return roles
+
+def value_sql(table, col, db_path=None):
+    """
+    The SQL expression for a numeric role. Columns the cleaner kept as TEXT
+    hold numbers as text and 'nan' for missing cells; only values with a
+    digit are cast, so 'nan' reads as NULL instead of 0.
+    """
+    if get_column_types(db_path)[table][col] in NUMERIC_TYPES:
+        return f'"{col}"'
+    return f'CASE WHEN "{col}" GLOB \'*[0-9]*\' THEN CAST("{col}" AS REAL) END'
+
+def database_snapshot(db_path=None):
+    """
+    Identifies the current contents of a database file by the size and
+    modification time of the file and its WAL. Any committed write changes
+    it, so query results can be cached per snapshot.
+    """
+    db_path = os.path.abspath(db_path or DB_PATH)
+    snapshot = [db_path]
+    for path in (db_path, db_path + '-wal'):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            snapshot += [stat.st_size, stat.st_mtime_ns]
+    return tuple(snapshot)
+
+def fetch(sql, params=(), db_path=None) -> pd.DataFrame:
+    """
+    Runs a parameterized query on a pooled reader connection. The SQL text of
+    each query is fixed per table, so sqlite3's per-connection statement cache
+    prepares it once and later calls only bind new parameters.
+    """
+    with raw_connection(db_path) as conn:
+        cursor = conn.execute(sql, params)
+        columns = [column[0] for column in cursor.description]
+        return pd.DataFrame(cursor.fetchall(), columns=columns)
+
+def with_titles(df: pd.DataFrame, table, db_path=None):
+    if 'title' in df.columns and column_roles(table, db_path)['title'] == 'product_url':
+        df['title'] = df['title'].map(url_title)
+    return df
+
+def sample_rows(table, n=DEFAULT_LIMIT, seed=None, db_path=None) -> pd.DataFrame:
+    """
+    Picks up to n random rows without sorting the table: each pick draws a
+    rowid between the smallest and largest and seeks to the first row at or
+    after it through the rowid B-tree. Rows right after a gap in the rowids
+    are slightly more likely to be picked.
+    """
+    title = column_roles(table, db_path)['title']
+    rng = random.Random(seed)
+    with raw_connection(db_path) as conn:
+        # Two statements: SQLite only answers min() and max() from the B-tree
+        # ends when each is alone in its query; together they scan the table.
+        low = conn.execute(f'SELECT min(rowid) FROM "{table}"').fetchone()[0]
+        high = conn.execute(f'SELECT max(rowid) FROM "{table}"').fetchone()[0]
+        picked = {}
+        if low is not None:
+            sql = f'SELECT rowid, "{title}" FROM "{table}" WHERE rowid >= ? ORDER BY rowid LIMIT 1'
+            for _ in range(n * SAMPLE_ATTEMPTS):
+                if len(picked) == n:
+                    break
+                row = conn.execute(sql, (rng.randint(low, high),)).fetchone()
+                picked.setdefault(row[0], row[1])
+    df = pd.DataFrame({'row_id': list(picked), 'title': list(picked.values())})
+    return with_titles(df, table, db_path)
+
+def summary_rows(summary, table, sql, params=(), db_path=None):
+    """
+    Reads rows of a summary table (see aggregates) for one category, or
+    returns None when the database has no summary for it yet, in which case
+    the caller scans the category table instead.
+    """
+    if summary not in get_column_types(db_path):
+        return None
+    df = fetch(sql, (table,) + tuple(params), db_path)
+    return df if not df.empty else None
+
+def category_stats(table, columns, db_path=None):
+    return summary_rows(STATS_TABLE, table,
+                        f'SELECT {columns} FROM "{STATS_TABLE}" WHERE table_name = ? AND scope = \'category\'',
+                        db_path=db_path)
+
+def count_rows(table, db_path=None) -> pd.DataFrame:
+    summary = category_stats(table, 'items AS total_items', db_path)
+    if summary is not None:
+        return summary
+    return fetch(f'SELECT COUNT(*) AS total_items FROM "{table}"', db_path=db_path)
+
+def top_rows(table, role, limit=DEFAULT_LIMIT, db_path=None) -> pd.DataFrame:
+    """
+    The limit rows with the highest value of a numeric role, with their
+    titles; ties go to the lower rowid. Read from the summary's top list
+    when it is long enough, otherwise sorted from the table.
+    """
+    roles = column_roles(table, db_path)
+    if limit <= SUMMARY_TOP_N:
+        summary = summary_rows(TOP_ITEMS_TABLE, table,
+                               f'SELECT row_id, title, value AS "{roles[role]}" FROM "{TOP_ITEMS_TABLE}" '
+                               f'WHERE table_name = ? AND metric = ? ORDER BY rank LIMIT ?', (role, limit), db_path)
+        if summary is not None:
+            # The summary stores every value as REAL; integer columns read back as integers.
+            if get_column_types(db_path)[table][roles[role]] in INTEGER_TYPES:
+                summary[roles[role]] = summary[roles[role]].astype('int64')
+            return with_titles(summary, table, db_path)
+    value = value_sql(table, roles[role], db_path)
+    sql = (f'SELECT rowid AS row_id, "{roles["title"]}" AS title, {value} AS "{roles[role]}" FROM "{table}" '
+           f'WHERE {value} IS NOT NULL ORDER BY {value} DESC, rowid LIMIT ?')
+    return with_titles(fetch(sql, (limit,), db_path), table, db_path)
+
+def average(table, role, db_path=None) -> pd.DataFrame:
+    if role == 'price':
+        summary = category_stats(table, 'mean_price AS average_price, priced_items AS rows_with_price', db_path)
+        if summary is not None:
+            return summary
+    value = value_sql(table, column_roles(table, db_path)[role], db_path)
+    return fetch(f'SELECT AVG({value}) AS average_{role}, COUNT({value}) AS rows_with_{role} FROM "{table}"',
+                 db_path=db_path)
+
+def price_stats(table, db_path=None) -> pd.DataFrame:
+    df = category_stats(table, 'priced_items, min_price, p10_price, p25_price, median_price, p75_price, '
+                             'p90_price, max_price, mean_price', db_path)
+    return df if df is not None else pd.DataFrame()
+
+def brand_stats(table, limit=DEFAULT_LIMIT, db_path=None) -> pd.DataFrame:
+    df = summary_rows(STATS_TABLE, table,
+                      f'SELECT brand, items, median_price, mean_rating FROM "{STATS_TABLE}" '
+                      f'WHERE table_name = ? AND scope = \'brand\' AND brand IS NOT NULL '
+                      f'ORDER BY items DESC, brand LIMIT ?', (limit,), db_path)
+    return df if df is not None else pd.DataFrame()
+
+def rating_distribution(table, db_path=None) -> pd.DataFrame:
+    df = summary_rows(RATINGS_TABLE, table,
+                      f'SELECT rating, items FROM "{RATINGS_TABLE}" '
+                      f'WHERE table_name = ? AND scope = \'category\' AND rating IS NOT NULL ORDER BY rating',
+                      db_path=db_path)
+    return df if df is not None else pd.DataFrame()
+
+# name: (description, role the table needs a column for, function(table, limit, seed, db_path))
+QUERIES = {
+    'sample': ("Show {limit} random items", None,
+               lambda table, limit, seed, db_path: sample_rows(table, limit, seed, db_path)),
+    'count': ("Count total number of items", None,
+              lambda table, limit, seed, db_path: count_rows(table, db_path)),
+    'most_expensive': ("Find {limit} most expensive items", 'price',
+                       lambda table, limit, seed, db_path: top_rows(table, 'price', limit, db_path)),
+    'average_price': ("Calculate average price", 'price',
+                      lambda table, limit, seed, db_path: average(table, 'price', db_path)),
+    'top_rated': ("Find {limit} best rated items", 'rating',
+                  lambda table, limit, seed, db_path: top_rows(table, 'rating', limit, db_path)),
+    'largest': ("Find top {limit} items by '{column}'", 'capacity',
+                lambda table, limit, seed, db_path: top_rows(table, 'capacity', limit, db_path)),
+    'price_stats': ("Price percentiles", 'price',
+                    lambda table, limit, seed, db_path: price_stats(table, db_path)),
+    'brands': ("Find the {limit} brands with most items", None,
+               lambda table, limit, seed, db_path: brand_stats(table, limit, db_path)),
+    'rating_distribution': ("Count items per rating", 'rating',
+                            lambda table, limit, seed, db_path: rating_distribution(table, db_path)),
+}
+# Queries whose result depends on the seed; they are only cached when one is given.
+RANDOM_QUERIES = {'sample'}
+# Queries only answered from the summary tables; they apply once the import has written them.
+SUMMARY_QUERIES = {'price_stats', 'brands', 'rating_distribution'}
+
+def run_query(name, table, limit=DEFAULT_LIMIT, seed=None, db_path=None, use_cache=True):
+    """
+    Runs one of QUERIES on a table. Results are cached per database snapshot
+    (see database_snapshot), so repeating a query on an unchanged database
+    costs a dictionary lookup; a random sample is only cached when it is
+    reproducible (seed given). Returns (DataFrame, seconds, cached).
+    """
+    start = time.perf_counter()
+    cacheable = use_cache and (name not in RANDOM_QUERIES or seed is not None)
+    key = (database_snapshot(db_path), name, table, limit, seed if name in RANDOM_QUERIES else None)
+    if cacheable:
+        with _lock:
+            cached = _results.get(key)
+            if cached is not None:
+                _results.move_to_end(key)
+                return cached.copy(), time.perf_counter() - start, True
+
+    df = QUERIES[name][2](table, limit, seed, db_path)
+    if cacheable:
+        with _lock:
+            _results[key] = df.copy()
+            while len(_results) > RESULT_CACHE_SIZE:
+                _results.popitem(last=False)
+    return df, time.perf_counter() - start, False
+
+def table_queries(table, db_path=None):
+    """
+    The queries that apply to a table: those whose role the table has a
+    column for, and the SUMMARY_QUERIES when the database has summaries.
+    """
+    roles = column_roles(table, db_path)
+    summarized = STATS_TABLE in get_column_types(db_path)
+    return [name for name, (_, role, _) in QUERIES.items()
+            if (role is None or roles.get(role)) and (summarized or name not in SUMMARY_QUERIES)]
+
+def describe_query(name, table, limit=DEFAULT_LIMIT, db_path=None):
+    description, role, _ = QUERIES[name]
+    column = column_roles(table, db_path).get(role) if role else None
+    return f"[{table}] " + description.format(limit=limit, column=column)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the analytics queries on every category table and time them.")
+    parser.add_argument('--tables', nargs='+', help="Only these tables (default: all).")
+    parser.add_argument('--queries', nargs='+', choices=list(QUERIES), help="Only these queries (default: all that apply).")
+    parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT, help="Rows per top-N query or sample (default: %(default)s).")
+    parser.add_argument('--seed', type=int, help="Seed for the random sample; makes it reproducible and cacheable.")
+    parser.add_argument('--repeat', type=int, default=1, help="Run everything this many times to show the result cache.")
+    parser.add_argument('--no-cache', action='store_true', help="Always run the queries against the database.")
+    parser.add_argument('--quiet', action='store_true', help="Print the timings only, not the results.")
+    args = parser.parse_args()
+
+    if not os.path.exists(DB_PATH):
+        print(f"Error: Database file not found at '{DB_PATH}'")
+        return
+    tables = args.tables or get_tables()
+    if not tables:
+        print("No tables found in the database.")
+        return
+    print(f"✅ Database connection successful. Found tables: {tables}\n")
+
+    timings = []
+    for run in range(args.repeat):
+        for table in tables:
+            names = [name for name in table_queries(table) if not args.queries or name in args.queries]
+            if run == 0 and not args.quiet:
+                print("=" * 60)
+                print(f"Running Queries on Table: {table}")
+                print("=" * 60)
+            for name in names:
+                df, seconds, cached = run_query(name, table, args.limit, args.seed, use_cache=not args.no_cache)
+                timings.append((run, table, name, seconds, cached))
+                if run == 0 and not args.quiet:
+                    print(f"\n--- Query: {describe_query(name, table, args.limit)} ---")
+                    print("--> No results found." if df.empty else df.to_string())
+
+    print(f"\n{'run':<5}{'table':<18}{'query':<21}{'ms':>10}  cached")
+    for run, table, name, seconds, cached in timings:
+        print(f"{run + 1:<5}{table:<18}{name:<21}{seconds * 1000:>10.2f}  {'yes' if cached else ''}")
+    for run in range(args.repeat):
+        total = sum(seconds for r, _, _, seconds, _ in timings if r == run)
+        print(f"  - Run {run + 1}: {total * 1000:.1f} ms for {sum(1 for t in timings if t[0] == run)} queries.")
+
+if __name__ == '__main__':
+    main()
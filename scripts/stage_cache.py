@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import pickle
+import hashlib
+import pandas as pd
+from collections import namedtuple
+
+from import_manifest import hash_file, save_manifest
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.path.join(PROJECT_ROOT, 'staging', '.cache')
+
+StageOutput = namedtuple('StageOutput', ['value', 'hit', 'seconds'])
+
+def frame_digest(df: pd.DataFrame):
+    """
+    Hashes a DataFrame's column names, dtypes and values (not its index), so
+    the same data hashes the same whether it was read from a staging file or
+    handed over in memory.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr([(str(col), str(dtype)) for col, dtype in df.dtypes.items()]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def stage_fingerprint(stage, name, input_digest, code_hash, args=()):
+    digest = hashlib.sha256()
+    for part in (stage, name, input_digest, code_hash, repr(args)):
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def entry_paths(stage, name):
+    directory = os.path.join(CACHE_DIR, stage)
+    return os.path.join(directory, f"{name}.json"), os.path.join(directory, f"{name}.pkl")
+
+def load_entry(stage, name, fingerprint):
+    """
+    Returns (value, entry) when the cache holds an output of this stage for
+    exactly this fingerprint and the files the output points at are unchanged,
+    otherwise None.
+    """
+    entry_path, value_path = entry_paths(stage, name)
+    try:
+        with open(entry_path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+        if entry.get('fingerprint') != fingerprint:
+            return None
+        for path, sha256 in entry.get('artifacts', {}).items():
+            path = os.path.join(PROJECT_ROOT, path)
+            if not os.path.exists(path) or hash_file(path) != sha256:
+                return None
+        with open(value_path, 'rb') as f:
+            return pickle.load(f), entry
+    except (OSError, ValueError, pickle.UnpicklingError, EOFError):
+        return None
+
+def save_entry(stage, name, fingerprint, value, seconds, artifacts=()):
+    entry_path, value_path = entry_paths(stage, name)
+    os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+    temp_path = value_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, value_path)
+    save_manifest({
+        'fingerprint': fingerprint,
+        'seconds': seconds,
+        'artifacts': {os.path.relpath(path, PROJECT_ROOT): hash_file(path) for path in artifacts},
+    }, entry_path)
+
+def lookup_stage(stage, name, df, args=(), code_hash='', force=False):
+    """
+    The first half of cached_stage, for callers that run the stage
+    themselves (the training scheduler): returns (fingerprint, StageOutput)
+    when the cache holds the output, or (fingerprint, None) when the stage
+    has to run, after which store_stage saves its output under the fingerprint.
+    """
+    fingerprint = stage_fingerprint(stage, name, frame_digest(df), code_hash, args)
+    if not force:
+        cached = load_entry(stage, name, fingerprint)
+        if cached is not None:
+            value, entry = cached
+            return fingerprint, StageOutput(value, True, entry.get('seconds', 0.0))
+    return fingerprint, None
+
+def store_stage(stage, name, fingerprint, value, seconds, artifacts=()) -> StageOutput:
+    save_entry(stage, name, fingerprint, value, seconds, artifacts)
+    return StageOutput(value, False, seconds)
+
+def cached_stage(stage, name, func, df, args=(), code_hash='', force=False, artifacts=None) -> StageOutput:
+    """
+    Make-style caching of one stage of one category: func(df, *args) is only
+    run when no cached output matches the fingerprint of its input (the
+    DataFrame's content), the producing code (code_hash) and args. Outputs
+    are pickled under staging/.cache/<stage>/. For a stage whose real output
+    is a set of files (trained models), artifacts(value) names them; they are
+    hashed and a hit also requires them to be unchanged. force=True runs the
+    stage regardless and refreshes the cache.
+    Returns StageOutput(value, hit, seconds) where seconds is the time the
+    stage took when it was computed.
+    """
+    fingerprint, cached = lookup_stage(stage, name, df, args, code_hash, force)
+    if cached is not None:
+        return cached
+
+    start = time.perf_counter()
+    value = func(df, *args)
+    seconds = time.perf_counter() - start
+    return store_stage(stage, name, fingerprint, value, seconds, artifacts(value) if artifacts else ())
+
+def record_cache_stats(stats: dict, stage, output: StageOutput):
+    counts = stats.setdefault(stage, {'hits': 0, 'misses': 0, 'saved': 0.0, 'spent': 0.0})
+    counts['hits' if output.hit else 'misses'] += 1
+    counts['saved' if output.hit else 'spent'] += output.seconds
+
+def merge_cache_stats(stats: dict, other: dict):
+    for stage, counts in other.items():
+        total = stats.setdefault(stage, {'hits': 0, 'misses': 0, 'saved': 0.0, 'spent': 0.0})
+        for key, value in counts.items():
+            total[key] += value
+    return stats
+
+def print_cache_stats(stats: dict):
+    if not stats:
+        return
+    print(f"\n{'cached stage':<14}{'hits':>8}{'misses':>8}{'computed (s)':>15}{'skipped (s)':>14}")
+    for stage, counts in stats.items():
+        print(f"{stage:<14}{counts['hits']:>8}{counts['misses']:>8}{counts['spent']:>15.2f}{counts['saved']:>14.2f}")
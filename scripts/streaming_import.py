@@ -0,0 +1,121 @@
+import itertools
+import numpy as np
+import pandas as pd
+import openpyxl
+
+from import_to_db import clean_dataframe, row_key_column
+from bulk_writer import bulk_load
+from measurements import add_measurement_columns
+from database_connection import NA_STRINGS
+
+DEFAULT_CHUNK_SIZE = 10_000
+MISMATCH_POLICIES = ('coerce', 'raise')
+
+def unique_column_names(header):
+    """
+    Names the columns the way pd.read_excel does: empty header cells become
+    'Unnamed: <i>' and repeated names get a '.1', '.2', ... suffix.
+    """
+    names, seen = [], {}
+    for i, name in enumerate(header):
+        if name is None or name == '':
+            name = f"Unnamed: {i}"
+        elif not isinstance(name, str):
+            name = str(name)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+def convert_cell(value):
+    # Same conversions as pd.read_excel: whole floats become ints, blanks and NA markers become NaN.
+    if value is None or (isinstance(value, str) and value in NA_STRINGS):
+        return np.nan
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def iter_sheet_chunks(file_path, header=1, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Streams the first sheet of a workbook as DataFrames of at most chunk_size
+    rows, using openpyxl's read-only mode so only one chunk is held in memory.
+    header is the 0-based row holding the column names, as in pd.read_excel.
+    """
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header_row = next(itertools.islice(rows, header, None), None)
+        if header_row is None:
+            return
+        columns = unique_column_names(header_row)
+        width = len(columns)
+
+        start = 0
+        while True:
+            chunk = []
+            for row in itertools.islice(rows, chunk_size):
+                if all(cell is None for cell in row):
+                    continue
+                row = tuple(row[:width]) + (None,) * (width - len(row))
+                chunk.append([convert_cell(cell) for cell in row])
+            if not chunk:
+                break
+            yield pd.DataFrame(chunk, columns=columns, index=pd.RangeIndex(start, start + len(chunk)))
+            start += len(chunk)
+    finally:
+        workbook.close()
+
+def stream_import_file(file_path, table_name, engine, chunk_size=DEFAULT_CHUNK_SIZE, on_type_mismatch='coerce'):
+    """
+    Imports one workbook chunk by chunk so memory stays flat whatever the sheet size.
+
+    The first chunk is cleaned with the usual numeric-ratio inference and its
+    result fixes the schema for the rest of the sheet. Later chunks are cleaned
+    against that schema: a cell in a numeric column that holds no number is a
+    mismatch, which becomes NULL with on_type_mismatch='coerce' (counted and
+    reported) or aborts the import with on_type_mismatch='raise'. Text columns
+    keep numeric cells as text, and the measurement columns found in the first
+    chunk are replaced by the same typed columns in every chunk. Duplicate 'title'/'id' keys are dropped across
+    chunks, keeping the first, by a UNIQUE index in SQLite (see bulk_load), so
+    no set of keys grows in memory. Returns (rows_written, mismatches).
+    """
+    if on_type_mismatch not in MISMATCH_POLICIES:
+        raise ValueError(f"on_type_mismatch must be one of {MISMATCH_POLICIES}, got '{on_type_mismatch}'")
+
+    chunks = iter_sheet_chunks(file_path, header=1, chunk_size=chunk_size)
+    first_chunk = next(chunks, None)
+    if first_chunk is None:
+        print(f"  - Warning: No rows found for '{table_name}'. Skipping.")
+        return 0, 0
+
+    cleaned = clean_dataframe(first_chunk)
+    numeric_columns = [col for col in cleaned.columns if pd.api.types.is_numeric_dtype(cleaned[col])]
+    cleaned, measurement_spec = add_measurement_columns(cleaned, first_chunk)
+    rows_read, rows_written, mismatches = len(first_chunk), 0, 0
+
+    with bulk_load(table_name, cleaned, engine, unique_key=row_key_column(cleaned)) as write_rows:
+        rows_written += write_rows(cleaned)
+
+        for chunk in chunks:
+            rows_read += len(chunk)
+            cleaned = clean_dataframe(chunk, numeric_columns=numeric_columns)
+            for col in numeric_columns:
+                lost = cleaned[col].isna() & chunk.loc[cleaned.index, col].notna()
+                if lost.any():
+                    if on_type_mismatch == 'raise':
+                        example = chunk.loc[lost[lost].index[0], col]
+                        raise ValueError(f"Column '{col}' was typed numeric from the first chunk but row "
+                                         f"{lost[lost].index[0]} holds '{example}'.")
+                    mismatches += int(lost.sum())
+
+            cleaned, _ = add_measurement_columns(cleaned, chunk, measurement_spec)
+            rows_written += write_rows(cleaned)
+
+    print(f"  - Streamed {rows_read} rows in chunks of {chunk_size}; {rows_written} rows written.")
+    if mismatches:
+        print(f"  - Warning: {mismatches} cells in numeric columns held no number and were stored as NULL.")
+    print(f"  - ✅ Successfully created/replaced table '{table_name}' in the database (indexed: {write_rows.indexed}).")
+    return rows_written, mismatches
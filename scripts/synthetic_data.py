@@ -0,0 +1,267 @@
+import os
+import re
+import glob
+import time
+import argparse
+import contextlib
+import io
+from functools import lru_cache
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from import_to_db import DATA_DIR, clean_dataframe
+from measurements import add_measurement_columns
+
+SYNTHETIC_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'staging', 'synthetic')
+CHUNK_SIZE = 100_000
+# The sizes the benchmarks are run at: a real category's order of magnitude,
+# a large catalogue, and more than fits in memory in the raw stages.
+SIZES = (1_000, 100_000, 10_000_000)
+# Excel's 1,048,576 rows per sheet, less the banner and header rows.
+MAX_WORKBOOK_ROWS = 1_048_574
+# Numbers in sampled cells are scaled by a log-normal factor with this sigma,
+# then kept within the range the real column spans.
+SPREAD = 0.15
+# Columns whose number identifies the product (the 'dkp-' id of the URL, the
+# image file number); each synthetic row gets its own.
+UNIQUE_COLUMNS = ('product_url', 'image_path')
+
+PERSIAN_DIGITS = '۰۱۲۳۴۵۶۷۸۹'
+TO_LATIN_TABLE = str.maketrans({**{digit: str(i) for i, digit in enumerate(PERSIAN_DIGITS)}, '٫': '.', '٬': ','})
+TO_PERSIAN_TABLE = str.maketrans('0123456789', PERSIAN_DIGITS)
+# A cell holding one number, with the text around it kept as-is (units such as 'سانتی‌متر' or 'عدد').
+NUMBER_CELL = re.compile(r'^(\D*?)(\d[\d,]*(?:\.\d+)?)(\D*)$')
+ID_CELL = re.compile(r'^(\D*)(\d+)(.*)$', re.DOTALL)
+
+# A real category to sample from: the workbook's banner row ('Column1', ...),
+# its columns, and for each column the real cells and their number templates.
+CategoryProfile = namedtuple('CategoryProfile', ['category', 'banner', 'columns', 'columns_data'])
+# Per column: the real cells, the number in each (NaN where there is none),
+# the template index of each (-1: copied as-is), the templates
+# (prefix, decimals, grouping char, decimal char, Persian digits, suffix, kind)
+# and the real numbers' range.
+ColumnProfile = namedtuple('ColumnProfile', ['cells', 'numbers', 'template_ids', 'templates', 'low', 'high'])
+
+def category_workbook(category):
+    """
+    The workbook a category is sampled from: <category>.xlsx in its data
+    folder, or else its first workbook (the folders hold a Persian-named copy too).
+    """
+    preferred = os.path.join(DATA_DIR, category, f"{category}.xlsx")
+    if os.path.exists(preferred):
+        return preferred
+    workbooks = sorted(glob.glob(os.path.join(DATA_DIR, category, '*.xlsx')))
+    if not workbooks:
+        raise FileNotFoundError(f"No workbook found for category '{category}' in '{DATA_DIR}'.")
+    return workbooks[0]
+
+def list_categories():
+    return sorted(name for name in os.listdir(DATA_DIR) if glob.glob(os.path.join(DATA_DIR, name, '*.xlsx')))
+
+def cell_template(cell):
+    """
+    Splits a real cell into (number, template), or (NaN, None) for a cell
+    that is copied as-is: missing cells, text without exactly one number, bools.
+    """
+    if isinstance(cell, (bool, np.bool_)) or pd.isna(cell):
+        return np.nan, None
+    if isinstance(cell, (int, np.integer)):
+        return float(cell), ('', 0, None, '.', False, '', 'int')
+    if isinstance(cell, (float, np.floating)):
+        decimals = 0 if float(cell).is_integer() else len(repr(float(cell)).split('.')[1])
+        return float(cell), ('', min(decimals, 6), None, '.', False, '', 'float')
+    if not isinstance(cell, str):
+        return np.nan, None
+    match = NUMBER_CELL.match(cell.translate(TO_LATIN_TABLE))
+    if match is None:
+        return np.nan, None
+    prefix, number, suffix = match.groups()
+    start, end = match.span(2)
+    original = cell[start:end]
+    decimals = len(number.split('.')[1]) if '.' in number else 0
+    grouping = '٬' if '٬' in original else ',' if ',' in original else None
+    decimal_point = '٫' if '٫' in original else '.'
+    persian = any(digit in original for digit in PERSIAN_DIGITS)
+    return float(number.replace(',', '')), (prefix, decimals, grouping, decimal_point, persian, suffix, 'text')
+
+def profile_column(cells: np.ndarray, unique=False) -> ColumnProfile:
+    numbers = np.full(len(cells), np.nan)
+    template_ids = np.full(len(cells), -1)
+    templates, index = [], {}
+    for i, cell in enumerate(cells):
+        if unique:
+            match = ID_CELL.match(cell) if isinstance(cell, str) else None
+            number, template = (np.nan, None) if match is None else (0.0, (match.group(1), match.group(3)))
+        else:
+            number, template = cell_template(cell)
+        if template is None:
+            continue
+        numbers[i] = number
+        template_ids[i] = index.setdefault(template, len(templates))
+        if template_ids[i] == len(templates):
+            templates.append(template)
+    known = numbers[~np.isnan(numbers)]
+    low, high = (known.min(), known.max()) if len(known) else (np.nan, np.nan)
+    return ColumnProfile(cells, numbers, template_ids, templates, low, high)
+
+@lru_cache(maxsize=None)
+def load_profile(category) -> CategoryProfile:
+    """
+    Reads a category's real workbook (see category_workbook) into the
+    profile synthetic rows are drawn from.
+    """
+    path = category_workbook(category)
+    banner = pd.read_excel(path, header=None, nrows=1).iloc[0].tolist()
+    df = pd.read_excel(path, header=1)
+    columns_data = {col: profile_column(df[col].to_numpy(dtype=object), unique=col in UNIQUE_COLUMNS)
+                    for col in df.columns}
+    return CategoryProfile(category, banner, df.columns.tolist(), columns_data)
+
+def format_numbers(values: np.ndarray, template) -> list:
+    prefix, decimals, grouping, decimal_point, persian, suffix, kind = template
+    if kind == 'int':
+        return [int(value) for value in values]
+    if kind == 'float':
+        return [float(value) for value in np.round(values, decimals)]
+    spec = f"{',' if grouping else ''}.{decimals}f"
+    texts = [f"{value:{spec}}" for value in values]
+    if (grouping and grouping != ',') or decimal_point != '.':
+        separators = str.maketrans({',': grouping or ',', '.': decimal_point})
+        texts = [text.translate(separators) for text in texts]
+    if persian:
+        texts = [text.translate(TO_PERSIAN_TABLE) for text in texts]
+    return [f"{prefix}{text}{suffix}" for text in texts]
+
+def synthetic_column(column: ColumnProfile, rows, rng, first_id, unique=False) -> np.ndarray:
+    """
+    rows cells of one column: real cells drawn at random, so the share of
+    missing cells, units and numeral systems follow the real column, with
+    their numbers moved by up to a few SPREADs (see format_numbers). In a
+    UNIQUE_COLUMNS column the number is the row's id instead.
+    """
+    picked = rng.integers(0, len(column.cells), size=rows)
+    values = column.cells.take(picked)
+    template_ids = column.template_ids.take(picked)
+    if unique:
+        ids = np.arange(first_id, first_id + rows)
+        for template_id in np.unique(template_ids[template_ids >= 0]):
+            where = np.flatnonzero(template_ids == template_id)
+            prefix, suffix = column.templates[template_id]
+            values[where] = [f"{prefix}{row_id}{suffix}" for row_id in ids[where]]
+        return values
+
+    numbers = column.numbers.take(picked) * np.exp(rng.normal(0.0, SPREAD, size=rows))
+    numbers = np.clip(numbers, column.low, column.high)
+    for template_id in np.unique(template_ids[template_ids >= 0]):
+        where = np.flatnonzero(template_ids == template_id)
+        template = column.templates[template_id]
+        rounded = np.round(numbers[where], template[1])
+        values[where] = format_numbers(rounded, template)
+    return values
+
+def iter_synthetic_chunks(category, rows, chunk_size=CHUNK_SIZE, seed=0):
+    """
+    Yields rows synthetic rows of a category's raw sheet, as pd.read_excel
+    would read them (header=1), chunk_size rows at a time with a continuing
+    index. The same seed and chunk size give the same rows.
+    """
+    profile = load_profile(category)
+    for number, start in enumerate(range(0, rows, chunk_size)):
+        size = min(chunk_size, rows - start)
+        rng = np.random.default_rng([seed, number])
+        yield pd.DataFrame({
+            col: synthetic_column(profile.columns_data[col], size, rng, start + 1, col in UNIQUE_COLUMNS)
+            for col in profile.columns
+        }, index=pd.RangeIndex(start, start + size))
+
+def generate_sheet(category, rows, seed=0) -> pd.DataFrame:
+    """
+    A category's synthetic raw sheet in memory (see iter_synthetic_chunks).
+    """
+    chunks = list(iter_synthetic_chunks(category, rows, seed=seed))
+    return pd.concat(chunks) if chunks else pd.DataFrame(columns=load_profile(category).columns)
+
+def iter_cleaned_chunks(chunks):
+    """
+    Cleans raw sheet chunks the way the streaming import does: the first
+    chunk's inferred schema and measurement columns apply to every chunk
+    (see streaming_import.stream_import_file).
+    """
+    numeric_columns, spec = None, None
+    for chunk in chunks:
+        with contextlib.redirect_stdout(io.StringIO()):
+            cleaned = clean_dataframe(chunk, numeric_columns=numeric_columns)
+            if numeric_columns is None:
+                numeric_columns = [col for col in cleaned.columns if pd.api.types.is_numeric_dtype(cleaned[col])]
+            cleaned, spec = add_measurement_columns(cleaned, chunk, spec)
+        yield cleaned
+
+def write_workbook(category, rows, output_dir=SYNTHETIC_DIR, seed=0):
+    """
+    Writes <output_dir>/<category>/<category>.xlsx laid out like the real
+    workbooks (banner row, header row, data), so import_to_db can read the
+    folder as its data directory. Returns the path.
+    """
+    import openpyxl
+
+    if rows > MAX_WORKBOOK_ROWS:
+        raise ValueError(f"A sheet holds at most {MAX_WORKBOOK_ROWS:,} rows; write {rows:,} rows as a table instead.")
+    profile = load_profile(category)
+    path = os.path.join(output_dir, category, f"{category}.xlsx")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(category)
+    sheet.append(profile.banner)
+    sheet.append(profile.columns)
+    for chunk in iter_synthetic_chunks(category, rows, seed=seed):
+        for row in chunk.itertuples(index=False, name=None):
+            sheet.append([None if pd.isna(cell) else cell.item() if isinstance(cell, np.generic) else cell
+                          for cell in row])
+    workbook.save(path)
+    return path
+
+def write_table(category, rows, output_dir=SYNTHETIC_DIR, seed=0, chunk_size=CHUNK_SIZE):
+    """
+    Writes <output_dir>/<category>.csv: the synthetic sheet cleaned chunk by
+    chunk (see iter_cleaned_chunks), in the form load_data.py exports to
+    staging/01_raw, so it can be fed to preprocess.py. Memory holds one
+    chunk whatever the row count. Returns the path.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"{category}.csv")
+    chunks = iter_cleaned_chunks(iter_synthetic_chunks(category, rows, chunk_size, seed))
+    for i, cleaned in enumerate(chunks):
+        cleaned.to_csv(path, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic category workbooks and tables from the real ones.")
+    parser.add_argument('--rows', type=int, nargs='+', default=[SIZES[0]],
+                        help=f"Rows per category; several sizes give one folder each (e.g. {' '.join(map(str, SIZES))}).")
+    parser.add_argument('--categories', nargs='+', help="Only these categories (default: all).")
+    parser.add_argument('--format', nargs='+', choices=['workbook', 'table'], default=['table'],
+                        help="Workbooks for import_to_db, cleaned CSV tables for preprocess.py, or both.")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed.")
+    parser.add_argument('--output', default=SYNTHETIC_DIR, help="Output directory (default: staging/synthetic).")
+    args = parser.parse_args()
+
+    categories = args.categories or list_categories()
+    for rows in args.rows:
+        output_dir = os.path.join(args.output, str(rows))
+        print(f"--- Generating {rows:,} rows per category in '{output_dir}' ---")
+        for category in categories:
+            for kind in args.format:
+                start = time.perf_counter()
+                try:
+                    writer = write_workbook if kind == 'workbook' else write_table
+                    path = writer(category, rows, output_dir, args.seed)
+                except Exception as e:
+                    print(f"  - ❌ {category} ({kind}): {e}")
+                    continue
+                print(f"  - ✅ {category} ({kind}): '{os.path.relpath(path, args.output)}' "
+                      f"in {time.perf_counter() - start:.2f}s.")
+
+if __name__ == '__main__':
+    main()
@@ -5,73 +5,258 @@ import joblib
 import numpy as np
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.linear_model import LinearRegression
+from sklearn.base import clone
 import xgboost as xgb
+import sklearn
+import json
+import argparse
+from import_manifest import hash_source
+from stage_cache import cached_stage, record_cache_stats, print_cache_stats
+from feature_engineering import FEATURE_EXPRESSIONS, expression_inputs
+from instrumentation import measure, start_run, finish_run, add_report_arguments
 
 MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'models')
 FINAL_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'staging', '03_final')
 os.makedirs(MODELS_DIR, exist_ok=True)
 
-def train_all_possible_models():
+# The winning configuration of model_selection.py. Where it has an entry for a
+# category and task, training uses it instead of DEFAULT_BEST_MODELS.
+SELECTION_PATH = os.path.join(MODELS_DIR, 'model_selection.json')
+
+# The estimators a configuration can name, and the settings every instance gets.
+ESTIMATORS = {
+    'linear': LinearRegression,
+    'random_forest': RandomForestRegressor,
+    'xgboost': xgb.XGBRegressor,
+}
+ESTIMATOR_DEFAULTS = {
+    'linear': {},
+    'random_forest': {'random_state': 42, 'n_jobs': -1},
+    'xgboost': {'random_state': 42, 'n_jobs': -1},
+}
+
+# The model of each category and task from the original, manual model
+# selection, used where model_selection.json has no entry.
+# Each training run fits a fresh clone, so these instances stay unfitted.
+DEFAULT_BEST_MODELS = {
+    'Gas_stove': {'price': RandomForestRegressor(random_state=42, n_jobs=-1), 'rating_with_price': xgb.XGBRegressor(random_state=42, n_jobs=-1), 'rating_without_price': RandomForestRegressor(random_state=42, n_jobs=-1)},
+    'Washing_machine': {'price': xgb.XGBRegressor(random_state=42, n_jobs=-1), 'rating_with_price': xgb.XGBRegressor(random_state=42, n_jobs=-1), 'rating_without_price': xgb.XGBRegressor(random_state=42, n_jobs=-1)},
+    'Stirrer': {'price': RandomForestRegressor(random_state=42, n_jobs=-1), 'rating_with_price': RandomForestRegressor(random_state=42, n_jobs=-1), 'rating_without_price': RandomForestRegressor(random_state=42, n_jobs=-1)},
+    'Refrigerator': {'price': RandomForestRegressor(random_state=42, n_jobs=-1), 'rating_with_price': RandomForestRegressor(random_state=42, n_jobs=-1), 'rating_without_price': RandomForestRegressor(random_state=42, n_jobs=-1)},
+    'Rice_cooker': {'price': xgb.XGBRegressor(random_state=42, n_jobs=-1), 'rating_with_price': xgb.XGBRegressor(random_state=42, n_jobs=-1), 'rating_without_price': RandomForestRegressor(random_state=42, n_jobs=-1)},
+    'Meat_grinder': {'price': RandomForestRegressor(random_state=42, n_jobs=-1), 'rating_with_price': LinearRegression(), 'rating_without_price': LinearRegression()},
+    'fryer': {'price': RandomForestRegressor(random_state=42, n_jobs=-1), 'rating_with_price': RandomForestRegressor(random_state=42, n_jobs=-1), 'rating_without_price': RandomForestRegressor(random_state=42, n_jobs=-1)},
+    'Dishwasher': {'price': xgb.XGBRegressor(random_state=42, n_jobs=-1), 'rating_with_price': RandomForestRegressor(random_state=42, n_jobs=-1), 'rating_without_price': RandomForestRegressor(random_state=42, n_jobs=-1)},
+    'Juicer': {'price': RandomForestRegressor(random_state=42, n_jobs=-1), 'rating_with_price': RandomForestRegressor(random_state=42, n_jobs=-1), 'rating_without_price': LinearRegression()}
+}
+
+TASKS = ['price', 'rating_with_price', 'rating_without_price']
+# The target of each task and the columns its features leave out.
+TASK_TARGETS = {
+    'price': ('price', ['price', 'rating']),
+    'rating_with_price': ('rating', ['rating']),
+    'rating_without_price': ('rating', ['price', 'rating']),
+}
+
+def build_estimator(estimator, params=None):
+    """
+    An unfitted estimator from a configuration entry: a name of ESTIMATORS
+    and its parameters, on top of ESTIMATOR_DEFAULTS.
+    """
+    return ESTIMATORS[estimator](**{**ESTIMATOR_DEFAULTS[estimator], **(params or {})})
+
+def load_best_models(path=SELECTION_PATH) -> dict:
+    """
+    {category: {task: unfitted estimator}}: DEFAULT_BEST_MODELS with the
+    winners recorded in the model selection file (if any) in their place.
+    """
+    best_models = {category: dict(tasks) for category, tasks in DEFAULT_BEST_MODELS.items()}
+    if not os.path.exists(path):
+        return best_models
+    with open(path, 'r', encoding='utf-8') as f:
+        selection = json.load(f)
+    for category_name, tasks in selection.get('models', {}).items():
+        for task_name, winner in tasks.items():
+            best_models.setdefault(category_name, {})[task_name] = build_estimator(winner['estimator'], winner['params'])
+    return best_models
+
+BEST_MODELS = load_best_models()
+
+def task_matrices(df: pd.DataFrame, task_name):
+    """
+    The features and target of a task in a category's final data, or None
+    when the data has no target for it. The features are the numeric
+    columns besides the task's target and left-out columns, and besides the
+    engineered features computed from those (price_per_kg from the price):
+    they are not known when the model predicts.
+    """
+    target_col, drop_cols = TASK_TARGETS[task_name]
+    if target_col not in df.columns:
+        return None
+    derived = [col for col in df.columns
+               if col in FEATURE_EXPRESSIONS and expression_inputs(col, df.columns) & set(drop_cols)]
+    X = df.drop(columns=drop_cols + derived, errors='ignore').select_dtypes(include=np.number)
+    return X, df[target_col]
+
+def train_task_model(df: pd.DataFrame, category_name: str, task_name: str, n_jobs=None, quiet=False):
+    """
+    Trains and saves the model of one category and task. n_jobs overrides
+    the threads the estimator may use while fitting (the training scheduler
+    hands each model its share of the cores); the saved model keeps its
+    BEST_MODELS setting. Returns the model's file name, or None when the
+    task does not apply to the data.
+    """
+    log = (lambda message: None) if quiet else print
+    best_model = BEST_MODELS.get(category_name, {}).get(task_name)
+    if best_model is None:
+        log(f"    - WARNING: No best model defined for this task. Skipping.")
+        return None
+
+    matrices = task_matrices(df, task_name)
+    if matrices is None:
+        return None
+    X, y = matrices
+
+    if X.empty:
+        log(f"    - WARNING: No features available for this task. Skipping.")
+        return None
+
+    model_to_train = clone(best_model)
+    if n_jobs is not None and 'n_jobs' in model_to_train.get_params():
+        model_to_train.set_params(n_jobs=n_jobs)
+    model_to_train.fit(X, y)
+    if n_jobs is not None and 'n_jobs' in model_to_train.get_params():
+        model_to_train.set_params(n_jobs=best_model.get_params()['n_jobs'])
+
+    model_filename = f"{category_name}_{task_name}_model.joblib"
+    model_path = os.path.join(MODELS_DIR, model_filename)
+    joblib.dump(model_to_train, model_path)
+    log(f"    - ✅ Model saved: {model_filename}")
+    return model_filename
+
+def train_category_models(df: pd.DataFrame, category_name: str) -> list:
+    """
+    Trains and saves the models of one category from its final DataFrame.
+    Returns the file names of the saved models.
+    """
+    saved = []
+    for task_name in TASKS:
+        print(f"  - Task: Training model for '{task_name}'...")
+        model_filename = train_task_model(df, category_name, task_name)
+        if model_filename is not None:
+            saved.append(model_filename)
+    return saved
+
+def model_spec_hash(category_name):
+    """
+    Hashes what decides the models of a category besides its data: the
+    training code, the estimator classes and parameters in BEST_MODELS, and
+    the library versions.
+    """
+    spec = {
+        task_name: (type(model).__module__, type(model).__name__, sorted(model.get_params().items()))
+        for task_name, model in BEST_MODELS.get(category_name, {}).items()
+    }
+    return hash_source([train_category_models, train_task_model, task_matrices, TASK_TARGETS, FEATURE_EXPRESSIONS,
+                        TASKS, spec, sklearn.__version__, xgb.__version__])
+
+def train_category(df: pd.DataFrame, category_name, force=False, stats=None) -> list:
+    """
+    train_category_models through the stage cache: training is skipped while
+    the category's final data, its model spec and the saved model files are
+    unchanged. Returns the file names of the category's models.
+    """
+    output = cached_stage('train', category_name, train_category_models, df, args=(category_name,),
+                          code_hash=model_spec_hash(category_name), force=force,
+                          artifacts=lambda saved: [os.path.join(MODELS_DIR, name) for name in saved])
+    if stats is not None:
+        record_cache_stats(stats, 'train', output)
+    if output.hit:
+        print(f"  - Data and model spec unchanged; keeping the {len(output.value)} saved models.")
+    return output.value
+
+def find_final_datasets():
+    final_datasets = glob.glob(os.path.join(FINAL_DATA_DIR, '*.csv'))
+    return {os.path.basename(path).replace('.csv', ''): path for path in final_datasets}
+
+def train_all_possible_models(datasets=None, force=False, stats=None):
+    """
+    Trains and saves the models of every category. datasets maps category
+    names to final DataFrames (the in-process pipeline); by default the
+    final CSV files in staging/03_final are read. Categories whose models
+    are up to date are skipped unless force=True (see train_category).
+    """
     
     print(f"{'#'*20} Starting Automated Training for All Models {'#'*20}")
     
-    final_datasets = glob.glob(os.path.join(FINAL_DATA_DIR, '*.csv'))
-    if not final_datasets:
+    if datasets is None:
+        datasets = find_final_datasets()
+    if not datasets:
         print("  - ERROR: No final data files found. Please run the data preparation pipeline first.")
         return
 
-    best_models_map = {
-        'Gas_stove': {'price': RandomForestRegressor(random_state=42, n_jobs=-1), 'rating_with_price': xgb.XGBRegressor(random_state=42, n_jobs=-1), 'rating_without_price': RandomForestRegressor(random_state=42, n_jobs=-1)},
-        'Washing_machine': {'price': xgb.XGBRegressor(random_state=42, n_jobs=-1), 'rating_with_price': xgb.XGBRegressor(random_state=42, n_jobs=-1), 'rating_without_price': xgb.XGBRegressor(random_state=42, n_jobs=-1)},
-        'Stirrer': {'price': RandomForestRegressor(random_state=42, n_jobs=-1), 'rating_with_price': RandomForestRegressor(random_state=42, n_jobs=-1), 'rating_without_price': RandomForestRegressor(random_state=42, n_jobs=-1)},
-        'Refrigerator': {'price': RandomForestRegressor(random_state=42, n_jobs=-1), 'rating_with_price': RandomForestRegressor(random_state=42, n_jobs=-1), 'rating_without_price': RandomForestRegressor(random_state=42, n_jobs=-1)},
-        'Rice_cooker': {'price': xgb.XGBRegressor(random_state=42, n_jobs=-1), 'rating_with_price': xgb.XGBRegressor(random_state=42, n_jobs=-1), 'rating_without_price': RandomForestRegressor(random_state=42, n_jobs=-1)},
-        'Meat_grinder': {'price': RandomForestRegressor(random_state=42, n_jobs=-1), 'rating_with_price': LinearRegression(), 'rating_without_price': LinearRegression()},
-        'fryer': {'price': RandomForestRegressor(random_state=42, n_jobs=-1), 'rating_with_price': RandomForestRegressor(random_state=42, n_jobs=-1), 'rating_without_price': RandomForestRegressor(random_state=42, n_jobs=-1)},
-        'Dishwasher': {'price': xgb.XGBRegressor(random_state=42, n_jobs=-1), 'rating_with_price': RandomForestRegressor(random_state=42, n_jobs=-1), 'rating_without_price': RandomForestRegressor(random_state=42, n_jobs=-1)},
-        'Juicer': {'price': RandomForestRegressor(random_state=42, n_jobs=-1), 'rating_with_price': RandomForestRegressor(random_state=42, n_jobs=-1), 'rating_without_price': LinearRegression()}
-    }
-    
-    tasks = ['price', 'rating_with_price', 'rating_without_price']
-
-    for data_path in final_datasets:
-        category_name = os.path.basename(data_path).replace('.csv', '')
+    for category_name, data in datasets.items():
         print(f"\n{'='*20} Processing Category: {category_name} {'='*20}")
-        df = pd.read_csv(data_path)
-
-        for task_name in tasks:
-            print(f"  - Task: Training model for '{task_name}'...")
-            
-            model_to_train = best_models_map.get(category_name, {}).get(task_name)
-            if model_to_train is None:
-                print(f"    - WARNING: No best model defined for this task. Skipping.")
-                continue
-
-            if task_name == 'price':
-                if 'price' not in df.columns: continue
-                target_col, drop_cols = 'price', ['price', 'rating']
-            elif task_name == 'rating_with_price':
-                if 'rating' not in df.columns: continue
-                target_col, drop_cols = 'rating', ['rating']
-            elif task_name == 'rating_without_price':
-                if 'rating' not in df.columns: continue
-                target_col, drop_cols = 'rating', ['price', 'rating']
-            
-            y = df[target_col]
-            X = df.drop(columns=drop_cols, errors='ignore').select_dtypes(include=np.number)
-            
-            if X.empty:
-                print(f"    - WARNING: No features available for this task. Skipping.")
-                continue
-
-            model_to_train.fit(X, y)
-
-            model_filename = f"{category_name}_{task_name}_model.joblib"
-            model_path = os.path.join(MODELS_DIR, model_filename)
-            joblib.dump(model_to_train, model_path)
-            print(f"    - ✅ Model saved: {model_filename}")
+        with measure('train', category_name) as record:
+            df = pd.read_csv(data) if isinstance(data, str) else data
+            record['rows_in'] = len(df)
+            record['details']['models'] = train_category(df, category_name, force, stats)
 
     print(f"\n{'#'*20} All Models Trained and Saved Successfully {'#'*20}")
 
+def main():
+    parser = argparse.ArgumentParser(description="Train and save the models of every category.")
+    parser.add_argument('--force', action='store_true', help="Retrain every model, ignoring the stage cache.")
+    parser.add_argument('--cores', type=int, metavar='N',
+                        help="Train the (category, task) models concurrently within N cores "
+                             "(see training_scheduler.py); by default they train one after another.")
+    parser.add_argument('--compare-serial', action='store_true',
+                        help="With --cores: also retrain everything one model after another and compare the wall times.")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Update the saved models with the raw rows they have not seen, prepared with the saved "
+                             "preprocessors, instead of refitting them (see incremental_training.py); "
+                             "with --force every model is refit.")
+    add_report_arguments(parser, ['train'])
+    args = parser.parse_args()
+    start_run('train_model', args.profile)
+
+    if args.incremental:
+        from incremental_training import train_incremental
+
+        with measure('train'):
+            train_incremental(force=args.force)
+        finish_run(args)
+        return
+
+    stats = {}
+    if args.cores is None:
+        with measure('train'):
+            train_all_possible_models(force=args.force, stats=stats)
+        print_cache_stats(stats)
+        finish_run(args)
+        return
+
+    from training_scheduler import train_scheduled
+
+    timings = {}
+    if args.compare_serial:
+        with measure('train') as record:
+            record['details']['mode'] = 'serial'
+            train_all_possible_models(force=True)
+        timings['serial'] = record['wall_seconds']
+    with measure('train') as record:
+        record['details'].update(mode='scheduled', cores=args.cores)
+        train_scheduled(cores=args.cores, force=args.force or args.compare_serial, stats=stats)
+    timings[f'{args.cores} cores'] = record['wall_seconds']
+
+    print_cache_stats(stats)
+    print(f"\n{'training':<14}{'wall (s)':>10}")
+    for label, seconds in timings.items():
+        print(f"{label:<14}{seconds:>10.2f}")
+    if 'serial' in timings:
+        print(f"  - Scheduled training took {timings[f'{args.cores} cores'] / timings['serial']:.2f}x the serial time "
+              f"({timings['serial'] / timings[f'{args.cores} cores']:.2f}x speedup).")
+    finish_run(args)
+
 if __name__ == '__main__':
-    train_all_possible_models()
\ No newline at end of file
+    main()
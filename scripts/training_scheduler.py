@@ -0,0 +1,162 @@
+import os
+import time
+import math
+import traceback
+import pandas as pd
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from threadpoolctl import threadpool_limits
+
+from train_model import BEST_MODELS, TASKS, MODELS_DIR, find_final_datasets, model_spec_hash, train_task_model
+from stage_cache import lookup_stage, store_stage, record_cache_stats
+from instrumentation import measure
+
+DEFAULT_CORES = os.cpu_count() or 1
+# An ensemble gets one thread per this many training rows, up to the whole
+# budget. The real categories have a few hundred rows: their forests fit in
+# milliseconds per tree, where extra threads cost more to start than they
+# save, so they train one thread each, many at a time.
+ROWS_PER_THREAD = 2_000
+
+# One model to train: the category and task, the category's final data, the
+# threads the model fits with (its share of the core budget) and its
+# estimated cost, which orders the jobs.
+TrainJob = namedtuple('TrainJob', ['category', 'task', 'df', 'threads', 'cost'])
+JobResult = namedtuple('JobResult', ['status', 'model_file', 'threads', 'seconds', 'error'])
+
+def model_threads(model, rows, cores):
+    """
+    Threads a model fits with: ensembles (random forests, XGBoost) build
+    their trees in parallel, one thread per ROWS_PER_THREAD rows; anything
+    else, such as LinearRegression, runs on one core.
+    """
+    params = model.get_params()
+    if 'n_estimators' not in params or 'n_jobs' not in params:
+        return 1
+    return max(1, min(cores, math.ceil(rows / ROWS_PER_THREAD)))
+
+def model_cost(model, df):
+    """
+    A rough cost for ordering the jobs: cells times trees for an ensemble,
+    cells for anything else.
+    """
+    params = model.get_params()
+    trees = (params.get('n_estimators') or 100) if 'n_estimators' in params else 1
+    return len(df) * len(df.columns) * trees
+
+def plan_jobs(datasets: dict, cores) -> list:
+    """
+    The (category, task) jobs of {category: final DataFrame}, the most
+    expensive first, so the long fits start early and the short ones fill
+    the gaps.
+    """
+    jobs = []
+    for category_name, df in datasets.items():
+        for task_name in TASKS:
+            model = BEST_MODELS.get(category_name, {}).get(task_name)
+            if model is None:
+                continue
+            jobs.append(TrainJob(category_name, task_name, df, model_threads(model, len(df), cores),
+                                 model_cost(model, df)))
+    return sorted(jobs, key=lambda job: job.cost, reverse=True)
+
+def run_job(job: TrainJob):
+    """
+    Trains one job's model on job.threads threads, measured per thread for
+    the run report. Returns (model file or None, seconds).
+    """
+    with measure('train', job.category, rows_in=len(job.df), per_thread=True) as record:
+        record['details'].update(task=job.task, threads=job.threads)
+        start = time.perf_counter()
+        model_file = train_task_model(job.df, job.category, job.task, n_jobs=job.threads, quiet=True)
+        record['details']['models'] = [model_file] if model_file else []
+    return model_file, time.perf_counter() - start
+
+def run_jobs(jobs: list, cores=DEFAULT_CORES, on_result=None) -> dict:
+    """
+    Runs the jobs on threads, at most cores threads busy at once counting
+    each model's own threads: a job starts when its threads fit in what the
+    running jobs leave free, taking the first that fits in job order. The
+    fits release the GIL, so threads scale like processes without copying
+    the data. BLAS is held to one thread, so a LinearRegression next to the
+    forests does not spread over every core behind the budget's back.
+    on_result(job, JobResult) is called as each job settles.
+    Returns {(category, task): JobResult}.
+    """
+    cores = max(cores, 1)
+    pending = list(jobs)
+    running = {}
+    results = {}
+    free = cores
+    with threadpool_limits(limits=1, user_api='blas'), ThreadPoolExecutor(max_workers=cores) as executor:
+        while pending or running:
+            for job in list(pending):
+                # A job wanting more than the budget runs alone.
+                threads = min(job.threads, cores)
+                if threads <= free:
+                    pending.remove(job)
+                    free -= threads
+                    running[executor.submit(run_job, job)] = (job, threads, time.perf_counter())
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job, threads, start = running.pop(future)
+                free += threads
+                try:
+                    model_file, seconds = future.result()
+                    result = JobResult('ok', model_file, threads, seconds, None)
+                except Exception as e:
+                    error = ''.join(traceback.format_exception_only(type(e), e)).strip()
+                    result = JobResult('failed', None, threads, time.perf_counter() - start, error)
+                results[(job.category, job.task)] = result
+                if on_result is not None:
+                    on_result(job, result)
+    return results
+
+def train_scheduled(datasets=None, cores=DEFAULT_CORES, force=False, stats=None):
+    """
+    train_all_possible_models with the (category, task) jobs run
+    concurrently under a budget of cores (see run_jobs). The stage cache is
+    kept per category as in train_category: categories whose data, model
+    spec and model files are unchanged are skipped unless force=True, and a
+    category is cached again once all of its models are trained.
+    Returns {(category, task): JobResult} of the jobs that ran.
+    """
+    print(f"{'#'*20} Training All Models on {cores} Cores {'#'*20}")
+    if datasets is None:
+        datasets = find_final_datasets()
+    if not datasets:
+        print("  - ERROR: No final data files found. Please run the data preparation pipeline first.")
+        return {}
+
+    to_train, fingerprints = {}, {}
+    for category_name, data in datasets.items():
+        df = pd.read_csv(data) if isinstance(data, str) else data
+        fingerprint, cached = lookup_stage('train', category_name, df, (category_name,),
+                                           model_spec_hash(category_name), force)
+        if cached is not None:
+            if stats is not None:
+                record_cache_stats(stats, 'train', cached)
+            print(f"  - {category_name}: data and model spec unchanged; keeping the {len(cached.value)} saved models.")
+            continue
+        to_train[category_name], fingerprints[category_name] = df, fingerprint
+
+    def report(job, result):
+        if result.status == 'ok':
+            print(f"  - ✅ {job.category} / {job.task}: {result.seconds:.2f}s on {result.threads} threads.")
+        else:
+            print(f"  - ❌ {job.category} / {job.task} failed: {result.error}")
+
+    results = run_jobs(plan_jobs(to_train, cores), cores, on_result=report)
+
+    for category_name, df in to_train.items():
+        category_results = [results[(category_name, task)] for task in TASKS if (category_name, task) in results]
+        if any(result.status != 'ok' for result in category_results):
+            continue
+        saved = [result.model_file for result in category_results if result.model_file]
+        output = store_stage('train', category_name, fingerprints[category_name], saved,
+                             sum(result.seconds for result in category_results),
+                             [os.path.join(MODELS_DIR, name) for name in saved])
+        if stats is not None:
+            record_cache_stats(stats, 'train', output)
+    return results
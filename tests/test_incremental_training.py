@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'scripts'))
+
+import preprocess
+import train_model
+import incremental_training
+
+RAW_TABLE = os.path.join(ROOT, 'staging', '01_raw', 'Refrigerator.csv')
+NEW_ROWS = 12
+
+
+def use_tmp_dirs(monkeypatch, tmp_path):
+    models_dir = str(tmp_path / 'models')
+    os.makedirs(models_dir)
+    monkeypatch.setattr(preprocess, 'MODELS_DIR', models_dir)
+    monkeypatch.setattr(train_model, 'MODELS_DIR', models_dir)
+    monkeypatch.setattr(incremental_training, 'MODELS_DIR', models_dir)
+    monkeypatch.setattr(incremental_training, 'STATE_DIR', str(tmp_path / 'state'))
+
+
+def test_appended_raw_rows_update_a_model(monkeypatch, tmp_path):
+    use_tmp_dirs(monkeypatch, tmp_path)
+    raw = pd.read_csv(RAW_TABLE)
+    old = raw.iloc[:-NEW_ROWS]
+    preprocess.fit_and_save_preprocessor(old, 'Refrigerator')
+
+    first = incremental_training.train_incremental({'Refrigerator': old})
+    assert {result.action for result in first.values()} == {'refit'}
+
+    second = incremental_training.train_incremental({'Refrigerator': raw})
+    assert any(result.action == 'updated' for result in second.values())
+    assert all(result.new_rows <= NEW_ROWS for result in second.values())
+
+
+def test_refit_preprocessor_forces_a_refit(monkeypatch, tmp_path):
+    use_tmp_dirs(monkeypatch, tmp_path)
+    raw = pd.read_csv(RAW_TABLE)
+    preprocess.fit_and_save_preprocessor(raw.iloc[:-NEW_ROWS], 'Refrigerator')
+    incremental_training.train_incremental({'Refrigerator': raw.iloc[:-NEW_ROWS]})
+
+    preprocess.fit_and_save_preprocessor(raw, 'Refrigerator')
+    results = incremental_training.train_incremental({'Refrigerator': raw})
+    assert {result.reason for result in results.values()} == {"the preprocessor was refit"}